@@ -3,11 +3,10 @@ import os
 import psycopg2
 from psycopg2 import sql
 from psycopg2.extras import DictCursor
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, g, before_render_template, has_request_context
+from flask.globals import request_ctx
 from flask_caching import Cache
 from flask_compress import Compress
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
 from itertools import groupby
 from operator import itemgetter
 from babel.dates import format_date
@@ -16,32 +15,29 @@ from babel.dates import format_date
 # E adicione format_date a ela, assim:
 from babel.dates import format_date
 
-app = Flask(__name__)
-app.config['CACHE_TYPE'] = 'SimpleCache'
-cache = Cache()
-compress = Compress()
-limiter = Limiter(
-    key_func=get_remote_address,
-    default_limits=["200 per day", "50 per hour"]
-)
-cache.init_app(app)
-compress.init_app(app)
-limiter.init_app(app)
-
-# Security headers
-@app.after_request
-def add_security_headers(response):
-    response.headers['X-Content-Type-Options'] = 'nosniff'
-    response.headers['X-Frame-Options'] = 'DENY'
-    response.headers['X-XSS-Protection'] = '1; mode=block'
-    response.headers['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains'
-    return response
 from werkzeug.security import generate_password_hash, check_password_hash
 from dotenv import load_dotenv
 import logging
 import re
+import sys
+import time
+import hashlib
+import hmac
+import threading
+import random
+import queue
+import select
+import atexit
+import click
+import uuid
+import copy
+import logging.handlers
+from collections import Counter, OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
 from decimal import Decimal, ROUND_HALF_UP, InvalidOperation # Adicionado ROUND_HALF_UP, InvalidOperation
 import json
+import tempfile
 from datetime import date, timedelta, datetime
 from math import ceil
 from dateutil.relativedelta import relativedelta
@@ -53,27 +49,1561 @@ from babel.numbers import format_currency # Para calcular data de conclusão da
 # Carrega variáveis de ambiente
 load_dotenv()
 
-# Configuração de logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# --- Configuração de logging (assíncrono, JSON) ---
+# As mensagens são enfileiradas pelo QueueHandler na thread da requisição e gravadas em stdout
+# por uma thread de fundo (QueueListener). Use argumentos no estilo %s em vez de f-strings:
+# a mensagem só é formatada se o nível estiver habilitado e o registro não for descartado.
+# LOG_NIVEL: nível mínimo (padrão INFO). LOG_FORMATO: json (padrão) ou texto.
+# LOG_AMOSTRAGEM: JSON {"prefixo da mensagem": taxa} para amostrar mensagens < WARNING (ex.: {"Acessando dashboard": 0.1}).
+# LOG_LIMITE_POR_SEGUNDO: máximo de registros por tipo de mensagem por segundo (0 = sem limite); ERROR nunca é descartado.
+class FiltroContextoRequisicao(logging.Filter):
+    """Anexa request_id, schema e rota ao registro (roda na thread da requisição)."""
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            record.schema = session.get('user_schema')
+            record.rota = request.endpoint
+        return True
+
+
+class FiltroAmostragem(logging.Filter):
+    """Amostragem e limite de taxa por tipo de mensagem (o template antes da formatação)."""
+    def __init__(self, taxas=None, limite_por_segundo=0):
+        super().__init__()
+        self.taxas = taxas or {}
+        self.limite_por_segundo = limite_por_segundo
+        self._janelas = {}
+        self._lock = threading.Lock()
+        self.descartados = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR:
+            return True
+        tipo = record.msg if isinstance(record.msg, str) else str(type(record.msg))
+        if record.levelno < logging.WARNING:
+            for prefixo, taxa in self.taxas.items():
+                if tipo.startswith(prefixo):
+                    if random.random() >= taxa:
+                        self.descartados += 1
+                        return False
+                    break
+        if self.limite_por_segundo:
+            segundo = int(time.monotonic())
+            with self._lock:
+                janela_segundo, contagem = self._janelas.get(tipo, (segundo, 0))
+                if janela_segundo != segundo:
+                    janela_segundo, contagem = segundo, 0
+                if contagem >= self.limite_por_segundo:
+                    self.descartados += 1
+                    return False
+                self._janelas[tipo] = (janela_segundo, contagem + 1)
+        return True
+
+
+class QueueHandlerEstruturado(logging.handlers.QueueHandler):
+    """Como o QueueHandler padrão, mas mantém o traceback em exc_text em vez de concatená-lo à mensagem."""
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class FormatadorJSON(logging.Formatter):
+    CAMPOS_EXTRAS = ('request_id', 'schema', 'rota', 'metodo', 'path', 'status', 'duracao_ms')
+
+    def format(self, record):
+        entrada = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'nivel': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for campo in self.CAMPOS_EXTRAS:
+            valor = getattr(record, campo, None)
+            if valor is not None:
+                entrada[campo] = valor
+        if record.exc_text:
+            entrada['exc'] = record.exc_text
+        return json.dumps(entrada, ensure_ascii=False, default=str)
+
+
+def configurar_logging():
+    nivel = getattr(logging, os.environ.get('LOG_NIVEL', 'INFO').upper(), logging.INFO)
+    try:
+        taxas = json.loads(os.environ.get('LOG_AMOSTRAGEM') or '{}')
+    except ValueError:
+        taxas = {}
+    filtro_amostragem = FiltroAmostragem(taxas, int(os.environ.get('LOG_LIMITE_POR_SEGUNDO', '0')))
+
+    saida = logging.StreamHandler(sys.stdout)
+    if os.environ.get('LOG_FORMATO', 'json') == 'texto':
+        saida.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    else:
+        saida.setFormatter(FormatadorJSON())
+
+    fila = queue.SimpleQueue()
+    handler_fila = QueueHandlerEstruturado(fila)
+    handler_fila.addFilter(filtro_amostragem)
+    handler_fila.addFilter(FiltroContextoRequisicao())
+    listener = logging.handlers.QueueListener(fila, saida, respect_handler_level=True)
+
+    raiz = logging.getLogger()
+    raiz.handlers[:] = [handler_fila]
+    raiz.setLevel(nivel)
+    listener.start()
+    atexit.register(listener.stop)
+    return filtro_amostragem
+
+
+filtro_amostragem_logs = configurar_logging()
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'fallback_inseguro_trocar_em_producao')
 
+# --- Cache de bytecode dos templates ---
+# JINJA_CACHE_DIR: diretório onde o Jinja grava o bytecode de cada template compilado (padrão
+# <tmp>/meu_dashboard-jinja; vazio = desativado). É compartilhado pelos workers e sobrevive a restarts:
+# aquecer_app() no boot carrega daí em vez de recompilar. A chave inclui o checksum do fonte, então
+# um template alterado no deploy é recompilado sozinho.
+JINJA_CACHE_DIR = os.environ.get('JINJA_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'meu_dashboard-jinja'))
+if JINJA_CACHE_DIR:
+    from jinja2 import FileSystemBytecodeCache
+    try:
+        os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+    except OSError as e:
+        logging.warning("JINJA_CACHE_DIR '%s' inutilizável (%s); templates compilados só em memória", JINJA_CACHE_DIR, e)
+
+# --- Extensões (cache, compressão) ---
+# CACHE_TYPE: backend do flask_caching (padrão SimpleCache, por processo). Com vários workers use um cache
+# compartilhado (ex.: CACHE_TYPE=RedisCache e CACHE_REDIS_URL) para que a invalidação por escrita valha em todos.
+app.config['CACHE_TYPE'] = os.environ.get('CACHE_TYPE', 'SimpleCache')
+if os.environ.get('CACHE_REDIS_URL'):
+    app.config['CACHE_REDIS_URL'] = os.environ['CACHE_REDIS_URL']
+cache = Cache()
+compress = Compress()
+cache.init_app(app)
+compress.init_app(app)
+
+# --- Request ID, log de acesso e requisições ativas ---
+# Registrados antes de todos os outros hooks (rate limit, prazo, tenant, admissão): uma requisição recusada
+# por um deles ainda sai com X-Request-ID, entra no log de acesso e conta em _requisicoes_ativas.
+# Requisições em andamento (profiler, drenagem no desligamento): chave própria de cada requisição, guardada
+# em g -> (thread, endpoint, schema). A chave não é a thread: no caminho ASGI (asgi.py) os hooks rodam numa
+# thread do asyncio.to_thread e o teardown na do event loop.
+_requisicoes_ativas = {}
+
+
+@app.before_request
+def iniciar_contexto_requisicao():
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:16]
+    g.inicio_requisicao = time.perf_counter()
+
+
+@app.after_request
+def registrar_acesso(response):
+    response.headers['X-Request-ID'] = g.get('request_id', '')
+    inicio = g.get('inicio_requisicao')
+    if inicio is not None and request.endpoint != 'static':
+        logging.info("Requisição concluída", extra={
+            'metodo': request.method, 'path': request.full_path.rstrip('?'), 'status': response.status_code,
+            'duracao_ms': round((time.perf_counter() - inicio) * 1000, 1),
+        })
+    return response
+
+
+@app.before_request
+def registrar_requisicao_ativa():
+    g.requisicao_ativa = object()
+    _requisicoes_ativas[g.requisicao_ativa] = (threading.get_ident(), request.endpoint, session.get('user_schema'))
+
+
+@app.teardown_request
+def remover_requisicao_ativa(exc):
+    _requisicoes_ativas.pop(g.pop('requisicao_ativa', None), None)
+
+
+# --- Rate limit por usuário ---
+# A chave é o tenant da sessão (session['user_schema']); só requisições anônimas caem no IP, então
+# usuários atrás do mesmo NAT de operadora não dividem cota. Os contadores ficam num storage compartilhado
+# pelos workers, com janela deslizante (sliding-window-counter), e não zeram quando um worker reinicia.
+# LIMITES_STORAGE_URI: storage do flask_limiter (ex.: redis://host:6379/1). Padrão memory://, por processo:
+#   o substituto local para desenvolvimento e testes. Se o storage cair, vale um fallback em memória.
+# LIMITES_PADRAO: limites por usuário em cada rota, separados por ';' (ex.: "300 per hour;60 per minute"); vazio (padrão) = nenhum.
+# LIMITES_PESADOS: orçamento único, em unidades de custo, das rotas marcadas com @rota_pesada(custo)
+#   (padrão "60 per minute;600 per hour"). O custo de um /relatorios é o nº de meses do intervalo pedido.
+# O Limiter é criado por criar_app() (configurar_rate_limit), não no import: o flask_limiter puxa o
+# limits.aio, que custa dezenas de ms, e scripts, CLI e benchmarks que só importam o app não pagam isso.
+# Com os dois vazios ele nem é importado.
+LIMITES_STORAGE_URI = os.environ.get('LIMITES_STORAGE_URI', 'memory://')
+LIMITES_PADRAO = [limite for limite in os.environ.get('LIMITES_PADRAO', '').split(';') if limite.strip()]
+LIMITES_PESADOS = [limite for limite in os.environ.get('LIMITES_PESADOS', '60 per minute;600 per hour').split(';') if limite.strip()]
+
+
+def rota_pesada(custo=1):
+    """Põe a rota no orçamento LIMITES_PESADOS; custo é um int ou uma função sem argumentos (aplique abaixo de @app.route)."""
+    def decorador(f):
+        f.custo_rate_limit = custo
+        return f
+    return decorador
+
+
+def custo_rota_pesada():
+    custo = getattr(app.view_functions.get(request.endpoint), 'custo_rate_limit', 1)
+    return max(1, int(custo() if callable(custo) else custo))
+
+
+def fora_do_orcamento_pesado():
+    return not hasattr(app.view_functions.get(request.endpoint), 'custo_rate_limit')
+
+
+limiter = None
+
+
+def configurar_rate_limit():
+    """Cria o Limiter (só aqui o flask_limiter é importado); precisa rodar antes da primeira requisição."""
+    global limiter
+    if limiter is not None or not (LIMITES_PADRAO or LIMITES_PESADOS):
+        return limiter
+    from flask_limiter import Limiter
+    from flask_limiter.util import get_remote_address
+
+    def chave_rate_limit():
+        user_schema = session.get('user_schema')
+        return f"tenant:{user_schema}" if user_schema else f"ip:{get_remote_address()}"
+
+    # As checagens rodam no before_request (application_limits e default_limits, sem decorators nas views),
+    # então valem também no caminho ASGI, que chama preprocess_request mas não a view.
+    limiter = Limiter(
+        key_func=chave_rate_limit,
+        default_limits=LIMITES_PADRAO,
+        default_limits_exempt_when=lambda: request.endpoint == 'static',
+        application_limits=LIMITES_PESADOS,
+        application_limits_exempt_when=fora_do_orcamento_pesado,
+        application_limits_cost=custo_rota_pesada,
+        strategy='sliding-window-counter',
+        storage_uri=LIMITES_STORAGE_URI,
+        headers_enabled=True,
+        swallow_errors=True,
+        in_memory_fallback_enabled=True,
+        key_prefix='meu_dashboard',
+    )
+    limiter.init_app(app)
+    # O init_app põe a checagem no fim da fila de before_request; ela volta para logo depois dos hooks de
+    # request id, antes de prazo, tenant e admissão (quem já estourou o limite não espera vaga).
+    hooks = app.before_request_funcs[None]
+    hooks.insert(hooks.index(registrar_requisicao_ativa) + 1, hooks.pop())
+    return limiter
+
+
+def resposta_recusada(status, erro, detalhe, mensagem, retry_after=None):
+    """Resposta de recusa por carga (429/503): JSON para quem pede JSON, texto para o navegador."""
+    if request.accept_mimetypes.best == 'application/json':
+        resposta = jsonify(erro=erro, detalhe=detalhe)
+    else:
+        resposta = app.make_response(mensagem)
+    resposta.status_code = status
+    if retry_after is not None:
+        resposta.headers['Retry-After'] = str(retry_after)
+    return resposta
+
+
+@app.errorhandler(429)
+def limite_excedido(e):
+    incrementar_metrica('rate_limit', f"excedido[{request.endpoint}]")
+    logging.warning("Rate limit excedido em %s: %s", request.endpoint, e.description)
+    return resposta_recusada(429, 'limite_excedido', e.description,
+                             'Demasiadas solicitudes. Espera un momento e inténtalo de nuevo.')
+
+# Security headers
+@app.after_request
+def add_security_headers(response):
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    response.headers['X-Frame-Options'] = 'DENY'
+    response.headers['X-XSS-Protection'] = '1; mode=block'
+    response.headers['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains'
+    return response
+
+
+# --- Prazos por rota (deadlines) ---
+# Cada requisição tem um orçamento de tempo: o declarado na view com @prazo_rota(segundos) ou
+# PRAZO_PADRAO_SEGUNDOS (padrão 10). PRAZOS_ROTAS (JSON {"endpoint": segundos}) sobrescreve ambos.
+# O que resta do orçamento vai como `SET LOCAL statement_timeout` junto de cada consulta, e os laços de
+# expansão em Python conferem o prazo com verificar_prazo(). Ao estourar, levanta PrazoExcedido, que é
+# um QueryCanceledError: os handlers já o tratam no `except psycopg2.Error` e renderizam a página vazia.
+PRAZO_PADRAO_SEGUNDOS = float(os.environ.get('PRAZO_PADRAO_SEGUNDOS', '10'))
+try:
+    PRAZOS_ROTAS = {k: float(v) for k, v in json.loads(os.environ.get('PRAZOS_ROTAS') or '{}').items()}
+except (ValueError, AttributeError):
+    logging.error("PRAZOS_ROTAS inválido; usando apenas os prazos declarados nas rotas.")
+    PRAZOS_ROTAS = {}
+
+
+class PrazoExcedido(psycopg2.extensions.QueryCanceledError):
+    """O orçamento de tempo da requisição acabou (no banco ou nos laços em Python)."""
+
+
+def prazo_rota(segundos):
+    """Declara o orçamento de tempo da rota (aplique logo acima do def, abaixo de @app.route)."""
+    def decorador(f):
+        f.prazo_segundos = segundos
+        return f
+    return decorador
+
+
+@app.before_request
+def iniciar_prazo():
+    view = app.view_functions.get(request.endpoint)
+    segundos = PRAZOS_ROTAS.get(request.endpoint, getattr(view, 'prazo_segundos', PRAZO_PADRAO_SEGUNDOS))
+    g.prazo = time.monotonic() + segundos
+
+
+def tempo_restante_ms():
+    if not has_request_context() or 'prazo' not in g:
+        return None
+    return (g.prazo - time.monotonic()) * 1000
+
+
+def registrar_prazo_excedido(origem):
+    incrementar_metrica('prazos_excedidos', f"{request.endpoint}[{origem}]")
+    if not g.get('prazo_excedido'):
+        g.prazo_excedido = True
+        logging.warning("Prazo da rota %s excedido (%s)", request.endpoint, origem)
+        flash('La solicitud tardó demasiado y se canceló; los datos mostrados pueden estar incompletos.', 'warning')
+
+
+def verificar_prazo():
+    """Chamado nos laços longos em Python; sem contexto de requisição (scripts, benchmarks) não faz nada."""
+    restante = tempo_restante_ms()
+    if restante is not None and restante <= 0:
+        registrar_prazo_excedido('python')
+        raise PrazoExcedido("Prazo da requisição excedido")
+
+
+# Vão sem o prefixo: SET TRANSACTION precisa ser o primeiro comando da transação, e numa transação abortada
+# o Postgres recusa o SET LOCAL, o que impediria o ROLLBACK TO SAVEPOINT dos grupos opcionais.
+COMANDOS_SEM_PRAZO = ('SET ', 'SAVEPOINT ', 'ROLLBACK', 'RELEASE ')
+
+
+class CursorComPrazo:
+    """Mixin de cursor: envia `SET LOCAL statement_timeout` com o tempo restante na mesma ida ao banco."""
+    def execute(self, query, vars=None):
+        restante = tempo_restante_ms()
+        if restante is None or self.connection.autocommit:
+            return super().execute(query, vars)
+        texto = query if isinstance(query, str) else query.as_string(self)
+        if texto.lstrip().upper().startswith(COMANDOS_SEM_PRAZO):
+            return super().execute(query, vars)
+        if restante <= 0:
+            registrar_prazo_excedido('banco')
+            raise PrazoExcedido("Prazo da requisição excedido antes da consulta")
+        try:
+            return super().execute(f"SET LOCAL statement_timeout = {max(1, int(restante))}; {texto}", vars)
+        except psycopg2.extensions.QueryCanceledError as e:
+            registrar_prazo_excedido('banco')
+            raise PrazoExcedido(str(e).strip()) from e
+
+
+# --- Disjuntor (circuit breaker) do banco ---
+# Depois de DB_DISJUNTOR_FALHAS falhas seguidas (conexão recusada/caída, sem nenhuma consulta bem-sucedida
+# entre elas, em conexão nova ou do pool), o disjuntor abre e get_db_connection() falha na hora, sem
+# esperar o connect_timeout, por DB_DISJUNTOR_ABERTO_SEGUNDOS.
+# Passado esse tempo, fica meio-aberto: uma única requisição sonda o banco com uma conexão nova;
+# se der certo o disjuntor fecha, senão abre de novo.
+DB_DISJUNTOR_FALHAS = int(os.environ.get('DB_DISJUNTOR_FALHAS', '5'))
+DB_DISJUNTOR_ABERTO_SEGUNDOS = float(os.environ.get('DB_DISJUNTOR_ABERTO_SEGUNDOS', '15'))
+
+
+class DisjuntorBanco:
+    def __init__(self, limite_falhas, segundos_aberto):
+        self.limite_falhas = limite_falhas
+        self.segundos_aberto = segundos_aberto
+        self.estado = 'fechado'
+        self.falhas_seguidas = 0
+        self._aberto_ate = 0.0
+        self._sondando = False
+        self._lock = threading.Lock()
+
+    def permitir(self):
+        """None = rejeitar; 'normal' = seguir; 'sonda' = tentativa do estado meio-aberto (conexão nova)."""
+        with self._lock:
+            if self.estado == 'fechado':
+                return 'normal'
+            if self.estado == 'aberto' and time.monotonic() >= self._aberto_ate:
+                self._mudar_estado('meio_aberto')
+            if self.estado == 'meio_aberto' and not self._sondando:
+                self._sondando = True
+                return 'sonda'
+            return None
+
+    def aberto(self):
+        return self.estado == 'aberto' and time.monotonic() < self._aberto_ate
+
+    def liberar_sonda(self):
+        """A sonda nem chegou a tentar (ex.: sem vaga de conexão); outra requisição pode sondar."""
+        with self._lock:
+            self._sondando = False
+
+    def registrar_sucesso(self):
+        with self._lock:
+            self._sondando = False
+            if self.estado != 'fechado':
+                self._mudar_estado('fechado')
+            self.falhas_seguidas = 0
+
+    def zerar_falhas(self):
+        """Uma consulta deu certo: as falhas anteriores não eram seguidas. O estado só muda pela sonda."""
+        if self.falhas_seguidas and self.estado == 'fechado':  # leitura sem lock no caminho quente
+            with self._lock:
+                if self.estado == 'fechado':
+                    self.falhas_seguidas = 0
+
+    def registrar_falha(self):
+        with self._lock:
+            self.falhas_seguidas += 1
+            self._sondando = False
+            if self.estado == 'meio_aberto' or self.falhas_seguidas >= self.limite_falhas:
+                self._aberto_ate = time.monotonic() + self.segundos_aberto
+                if self.estado != 'aberto':
+                    self._mudar_estado('aberto')
+                    descartar_conexoes_ociosas()
+
+    def _mudar_estado(self, estado):
+        logging.warning("Disjuntor do banco: %s -> %s (falhas seguidas: %d)", self.estado, estado, self.falhas_seguidas)
+        self.estado = estado
+        definir_metrica('disjuntor_banco', 'estado', estado)
+        incrementar_metrica('disjuntor_banco', f"transicoes[{estado}]")
+
+
+disjuntor_banco = DisjuntorBanco(DB_DISJUNTOR_FALHAS, DB_DISJUNTOR_ABERTO_SEGUNDOS)
+
+
+class CursorMonitorado:
+    """Mixin de cursor: conexão perdida no meio da consulta conta como falha para o disjuntor; sucesso zera a contagem."""
+    def execute(self, query, vars=None):
+        try:
+            retorno = super().execute(query, vars)
+        except psycopg2.extensions.QueryCanceledError:
+            raise
+        except psycopg2.OperationalError:
+            if self.connection.closed:  # deadlocks, locks etc. também são OperationalError, mas não derrubam a conexão
+                marcar_banco_indisponivel()
+            raise
+        disjuntor_banco.zerar_falhas()
+        return retorno
+
+
+def marcar_banco_indisponivel():
+    disjuntor_banco.registrar_falha()
+    if has_request_context():
+        g.banco_indisponivel = True
+
+
+# --- Pool de conexões e statements preparados ---
+# Os handlers continuam chamando conn.close(): com o pool ativo a conexão volta ociosa (após rollback)
+# em vez de ser fechada, e os statements preparados nela sobrevivem entre requisições.
+# DB_POOL_MAX: conexões ociosas mantidas por worker (padrão 10; 0 desliga o pool).
+# DB_POOL_OCIOSA_MAX: segundos que uma conexão pode ficar ociosa antes de ser descartada (padrão 300).
+# DB_POOL_VERIFICAR_APOS: segundos ociosa a partir dos quais a conexão passa por um SELECT 1 antes de ser
+# reutilizada (padrão 30; 0 verifica sempre). Conexões que o servidor derrubou (restart, idle timeout do
+# PgBouncer/firewall) só aparecem assim; status de transação desconhecido descarta sem consultar.
+# DB_PREPARED_STATEMENTS: 1 (padrão) prepara no servidor as consultas executadas via executar_preparado().
+# DB_PREPARED_MAX: máximo de statements preparados por conexão, com descarte LRU (padrão 100).
+# DB_MODO_CONEXAO: 'direto' (padrão) ou 'pgbouncer_transacao'. Atrás de um PgBouncer com pool_mode=transaction
+# cada transação pode cair em outro backend, então nenhum estado pode viver na sessão: os statements
+# preparados nomeados ficam desligados (as consultas vão como statements não nomeados) e parâmetros por
+# requisição só podem ser definidos com definir_parametros_transacao() (SET LOCAL). Teste com perf/compat_pgbouncer.py.
+# DB_CONEXOES_MAX: teto de conexões emprestadas ao mesmo tempo por worker (padrão 0 = sem teto). Quem passa
+# do teto espera uma vaga até o prazo da rota. Necessário com green threads (verde.py), onde centenas de
+# requisições concorrentes abririam cada uma a sua conexão.
+MODOS_CONEXAO = ('direto', 'pgbouncer_transacao')
+DB_MODO_CONEXAO = os.environ.get('DB_MODO_CONEXAO', 'direto')
+if DB_MODO_CONEXAO not in MODOS_CONEXAO:
+    logging.error("DB_MODO_CONEXAO desconhecido '%s'; usando 'direto'.", DB_MODO_CONEXAO)
+    DB_MODO_CONEXAO = 'direto'
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '10'))
+DB_POOL_OCIOSA_MAX = float(os.environ.get('DB_POOL_OCIOSA_MAX', '300'))
+DB_POOL_VERIFICAR_APOS = float(os.environ.get('DB_POOL_VERIFICAR_APOS', '30'))
+DB_PREPARED_STATEMENTS = os.environ.get('DB_PREPARED_STATEMENTS', '1') == '1'
+if DB_PREPARED_STATEMENTS and DB_MODO_CONEXAO == 'pgbouncer_transacao':
+    logging.info("DB_MODO_CONEXAO=pgbouncer_transacao: statements preparados nomeados desativados.")
+    DB_PREPARED_STATEMENTS = False
+DB_PREPARED_MAX = int(os.environ.get('DB_PREPARED_MAX', '100'))
+DB_CONEXOES_MAX = int(os.environ.get('DB_CONEXOES_MAX', '0'))
+_pool_lock = threading.Lock()
+_pool_ociosas = []  # [(conexão, momento em que voltou ao pool)]
+_vagas_conexao = threading.BoundedSemaphore(DB_CONEXOES_MAX) if DB_CONEXOES_MAX > 0 else None
+
+
+class ConexaoApp(psycopg2.extensions.connection):
+    """
+    Conexão do app: devolve-se ao pool no close(), guarda o LRU de statements preparados e
+    envolve os cursores (de qualquer cursor_factory, ex.: DictCursor) com os mixins_cursor.
+    """
+    mixins_cursor = (CursorMonitorado, CursorComPrazo)
+    _classes_cursor = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.emprestada = False
+        self.ocupa_vaga = False
+        self.preparados = OrderedDict()  # texto SQL -> (nome do statement, ordem dos parâmetros)
+        self.textos_preparados = {}  # nome do statement -> texto SQL
+        self._proximo_preparado = 0
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.pop('cursor_factory', None) or self.cursor_factory or psycopg2.extensions.cursor
+        chave = (self.mixins_cursor, base)
+        classe = self._classes_cursor.get(chave)
+        if classe is None:
+            nome = base.__name__ + ''.join(m.__name__.replace('Cursor', '') for m in self.mixins_cursor)
+            classe = self._classes_cursor.setdefault(chave, type(nome, self.mixins_cursor + (base,), {}))
+        return super().cursor(*args, cursor_factory=classe, **kwargs)
+
+    def close(self):
+        liberar_vaga(self)
+        if self.emprestada:
+            self.emprestada = False
+            if devolver_conexao(self):
+                return
+        super().close()
+
+    def descartar_preparados(self):
+        self.preparados.clear()
+        self.textos_preparados.clear()
+
+
+def devolver_conexao(conn):
+    """Limpa a transação e guarda a conexão no pool; False se ela deve ser fechada de fato."""
+    if conn.closed:
+        return False
+    try:
+        falhou = conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INERROR
+        conn.rollback()
+        if falhou and conn.preparados:
+            # Um erro pode vir de um plano preparado inválido (ex.: tabela alterada); recomeça do zero.
+            with psycopg2.extensions.connection.cursor(conn) as cur:
+                cur.execute("DEALLOCATE ALL")
+            conn.commit()
+            conn.descartar_preparados()
+    except psycopg2.Error as e:
+        logging.warning("Conexão descartada ao voltar para o pool: %s", e)
+        return False
+    with _pool_lock:
+        if len(_pool_ociosas) < DB_POOL_MAX:
+            _pool_ociosas.append((conn, time.monotonic()))
+            return True
+    return False
+
+
+def reservar_vaga(espera):
+    """Reserva uma vaga em DB_CONEXOES_MAX, esperando até `espera` segundos (None = sem limite)."""
+    if _vagas_conexao is None:
+        return True
+    if _vagas_conexao.acquire(timeout=espera):
+        return True
+    incrementar_metrica('pool_conexoes', 'sem_vaga')
+    return False
+
+
+def liberar_vaga(conn):
+    if conn.ocupa_vaga:
+        conn.ocupa_vaga = False
+        _vagas_conexao.release()
+
+
+def descartar_conexoes_ociosas():
+    with _pool_lock:
+        ociosas = [conn for conn, _ in _pool_ociosas]
+        _pool_ociosas.clear()
+    for conn in ociosas:
+        psycopg2.extensions.connection.close(conn)
+
+
+def conexao_viva(conn):
+    """SELECT 1 numa conexão ociosa; False (e a conexão fechada) se o servidor já a derrubou."""
+    try:
+        with psycopg2.extensions.connection.cursor(conn) as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error as e:
+        logging.info("Conexão ociosa descartada, servidor não respondeu: %s", e)
+        psycopg2.extensions.connection.close(conn)
+        return False
+
+
+def obter_conexao_ociosa():
+    agora = time.monotonic()
+    while True:
+        vencidas = []
+        conn = None
+        with _pool_lock:
+            while _pool_ociosas:
+                candidata, devolvida_em = _pool_ociosas.pop()
+                if candidata.closed:
+                    continue
+                if (devolvida_em < agora - DB_POOL_OCIOSA_MAX or candidata.get_transaction_status()
+                        == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN):
+                    vencidas.append(candidata)
+                    continue
+                conn = candidata
+                break
+        for vencida in vencidas:
+            psycopg2.extensions.connection.close(vencida)
+        if conn is None or devolvida_em >= agora - DB_POOL_VERIFICAR_APOS or conexao_viva(conn):
+            return conn
+        incrementar_metrica('pool_conexoes', 'mortas')
+
+
+def definir_parametros_transacao(cur, parametros):
+    """
+    Define parâmetros do Postgres só para a transação atual (set_config com is_local = SET LOCAL).
+    É a única forma segura de estado por requisição com PgBouncer em modo transação.
+    """
+    if not parametros:
+        return
+    chamadas = sql.SQL(', ').join(sql.SQL("set_config(%s, %s, true)") for _ in parametros)
+    valores = [item for nome, valor in parametros.items() for item in (nome, str(valor))]
+    cur.execute(sql.SQL("SELECT {}").format(chamadas), valores)
+
+
+PLACEHOLDER_RE = re.compile(r"%(?:\((\w+)\))?s|%%")
+
+
+def converter_placeholders(texto):
+    """Troca %s / %(nome)s por $1..$n para o PREPARE; retorna o texto e a ordem dos parâmetros."""
+    ordem, posicoes = [], {}
+
+    def trocar(m):
+        if m.group(0) == '%%':
+            return '%'
+        nome = m.group(1)
+        if nome is None:
+            ordem.append(len(ordem))
+            return f"${len(ordem)}"
+        if nome not in posicoes:
+            ordem.append(nome)
+            posicoes[nome] = len(ordem)
+        return f"${posicoes[nome]}"
+
+    return PLACEHOLDER_RE.sub(trocar, texto), ordem
+
+
+def executar_preparado(cur, query, params=None):
+    """
+    Como cur.execute(), mas com PREPARE/EXECUTE por (conexão, texto SQL). Como o schema faz parte do
+    texto, o cache é por tenant; repetições na mesma conexão pulam parse e planejamento no servidor.
+    """
+    conn = cur.connection
+    if not DB_PREPARED_STATEMENTS or not isinstance(conn, ConexaoApp):
+        return cur.execute(query, params)
+    texto = query if isinstance(query, str) else query.as_string(cur)
+    preparado = conn.preparados.get(texto)
+    if preparado:
+        conn.preparados.move_to_end(texto)
+        incrementar_metrica('prepared_statements', 'reusos')
+    else:
+        texto_pg, ordem = converter_placeholders(texto)
+        conn._proximo_preparado += 1
+        nome = f"app_stmt_{conn._proximo_preparado}"
+        cur.execute(f"PREPARE {nome} AS {texto_pg}")
+        preparado = conn.preparados[texto] = (nome, ordem)
+        conn.textos_preparados[nome] = texto
+        incrementar_metrica('prepared_statements', 'preparos')
+        if len(conn.preparados) > DB_PREPARED_MAX:
+            _, (nome_antigo, _) = conn.preparados.popitem(last=False)
+            del conn.textos_preparados[nome_antigo]
+            cur.execute(f"DEALLOCATE {nome_antigo}")
+            incrementar_metrica('prepared_statements', 'descartes_lru')
+    nome, ordem = preparado
+    valores = [params[chave] for chave in ordem]
+    if valores:
+        return cur.execute(f"EXECUTE {nome} ({', '.join(['%s'] * len(valores))})", valores)
+    return cur.execute(f"EXECUTE {nome}")
+
+
+# --- Injeção de latência e falhas no banco (somente testes de resiliência) ---
+# DB_INJECAO_FALHAS: JSON inline ou caminho de um arquivo JSON. Exemplo:
+#   {"semente": 1,
+#    "conexao": {"latencia_ms": 50, "jitter_ms": 20, "taxa_recusa": 0.05},
+#    "regras": [{"padrao": "FROM \"user\\d+\"\\.\"?gastos", "latencia_ms": 300, "jitter_ms": 200, "taxa_erro": 0.02},
+#               {"padrao": ".*", "latencia_ms": 5}]}
+# Cada statement usa a primeira regra cujo regex casa com o SQL. NUNCA habilite em produção.
+class InjetorFalhasDB:
+    def __init__(self, config):
+        self.conexao = config.get('conexao', {})
+        self.regras = [(re.compile(r['padrao'], re.IGNORECASE | re.DOTALL), r) for r in config.get('regras', [])]
+        self._rng = random.Random(config.get('semente'))
+        self._lock = threading.Lock()
+
+    def _sortear(self):
+        with self._lock:
+            return self._rng.random()
+
+    def _atrasar(self, regra):
+        latencia_ms = regra.get('latencia_ms', 0) + regra.get('jitter_ms', 0) * self._sortear()
+        if latencia_ms > 0:
+            time.sleep(latencia_ms / 1000.0)
+
+    def ao_conectar(self):
+        self._atrasar(self.conexao)
+        if self._sortear() < self.conexao.get('taxa_recusa', 0):
+            incrementar_metrica('injecao_falhas', 'conexoes_recusadas')
+            raise psycopg2.OperationalError("Conexão recusada (falha injetada)")
+
+    def ao_executar(self, texto_sql):
+        for padrao, regra in self.regras:
+            if padrao.search(texto_sql):
+                self._atrasar(regra)
+                if self._sortear() < regra.get('taxa_erro', 0):
+                    incrementar_metrica('injecao_falhas', f"erros[{padrao.pattern}]")
+                    raise psycopg2.OperationalError("Conexão perdida durante a consulta (falha injetada)")
+                return
+
+
+class CursorComFalhas:
+    """Mixin de cursor: aplica a regra do injetor antes de cada execute/executemany."""
+    def execute(self, query, vars=None):
+        texto = query if isinstance(query, str) else query.as_string(self)
+        if texto.startswith('EXECUTE '):
+            texto = self.connection.textos_preparados.get(texto.split()[1], texto)
+        try:
+            injetor_falhas_db.ao_executar(texto)
+        except psycopg2.OperationalError:
+            psycopg2.extensions.connection.close(self.connection)  # como numa queda real, a conexão morre
+            raise
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        injetor_falhas_db.ao_executar(query if isinstance(query, str) else query.as_string(self))
+        return super().executemany(query, vars_list)
+
+
+class ConexaoComFalhas(ConexaoApp):
+    """Conexão cujos cursores também passam pelo injetor (as falhas injetadas contam para o disjuntor)."""
+    mixins_cursor = (CursorMonitorado, CursorComFalhas, CursorComPrazo)
+
+
+def carregar_injetor_falhas_db():
+    valor = os.environ.get('DB_INJECAO_FALHAS', '').strip()
+    if not valor:
+        return None
+    try:
+        if not valor.startswith('{'):
+            with open(valor, encoding='utf-8') as f:
+                valor = f.read()
+        injetor = InjetorFalhasDB(json.loads(valor))
+    except (OSError, ValueError, KeyError, re.error) as e:
+        logging.error("DB_INJECAO_FALHAS inválido, injeção desativada: %s", e)
+        return None
+    logging.warning("Injeção de falhas no banco ATIVA (%d regras). Não use em produção.", len(injetor.regras))
+    return injetor
+
+
+injetor_falhas_db = carregar_injetor_falhas_db()
+DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', '2'))
+
 # --- Conexão com DB ---
-def get_db_connection():
+def parametros_conexao():
+    return {
+        'host': os.environ.get('DB_HOST', 'localhost'),
+        'port': os.environ.get('DB_PORT', '5432'),
+        'database': os.environ.get('DB_NAME', 'postgres'),
+        'user': os.environ.get('DB_USER', 'postgres'),
+        'password': os.environ.get('DB_PASSWORD', 'typebot'),
+        'connect_timeout': DB_CONNECT_TIMEOUT,
+    }
+
+
+def get_db_connection(espera_vaga=None):
+    """
+    Conexão do pool (ou nova); None se o banco estiver indisponível ou não houver vaga em DB_CONEXOES_MAX.
+    espera_vaga: segundos esperando vaga; None = o que resta do prazo da requisição.
+    """
+    tentativa = disjuntor_banco.permitir()
+    if tentativa is None:
+        incrementar_metrica('disjuntor_banco', 'rejeicoes')
+        return None
+    if espera_vaga is None:
+        restante = tempo_restante_ms()
+        espera_vaga = None if restante is None else max(restante, 0) / 1000
+    if not reservar_vaga(espera_vaga):
+        if tentativa == 'sonda':
+            disjuntor_banco.liberar_sonda()
+        if has_request_context():
+            registrar_prazo_excedido('vaga_conexao')
+        return None
     conn = None
     try:
+        if injetor_falhas_db:
+            injetor_falhas_db.ao_conectar()
+        conn = obter_conexao_ociosa() if DB_POOL_MAX > 0 and tentativa == 'normal' else None
+        if conn:
+            conn.emprestada = True
+            conn.ocupa_vaga = _vagas_conexao is not None
+            incrementar_metrica('pool_conexoes', 'reutilizadas')
+            return conn
+        incrementar_metrica('pool_conexoes', 'novas')
         conn = psycopg2.connect(
-            host=os.environ.get('DB_HOST', 'localhost'),
-            database=os.environ.get('DB_NAME', 'postgres'),
-            user=os.environ.get('DB_USER', 'postgres'),
-            password=os.environ.get('DB_PASSWORD', 'typebot')
+            connection_factory=ConexaoComFalhas if injetor_falhas_db else ConexaoApp,
+            **parametros_conexao()
         )
+        conn.emprestada = DB_POOL_MAX > 0
+        conn.ocupa_vaga = _vagas_conexao is not None
+        disjuntor_banco.registrar_sucesso()
         return conn
     except psycopg2.Error as e:
         logging.error(f"Erro ao conectar ao PostgreSQL: {e}")
+        marcar_banco_indisponivel()
         if conn: conn.close()
+        if _vagas_conexao is not None:
+            _vagas_conexao.release()
         return None
+    except BaseException:
+        # ex.: timeout de green thread (verde.py) no meio do connect: devolve a vaga e a sonda antes de sair
+        if conn: conn.close()
+        if tentativa == 'sonda':
+            disjuntor_banco.liberar_sonda()
+        if _vagas_conexao is not None:
+            _vagas_conexao.release()
+        raise
+
+
+# --- Unidade de trabalho por requisição ---
+# GETs que ainda escrevem (ex.: criam a tabela sob demanda) e por isso não podem ser READ ONLY.
+ENDPOINTS_GET_COM_ESCRITA = {'numeros_compartilhados'}
+# POSTs que não escrevem no schema do tenant (não trocam a versão de cache dele).
+ENDPOINTS_POST_SEM_ESCRITA = {'login'}
+
+
+class UnidadeDeTrabalho:
+    """
+    Conexão da requisição guardada em flask.g, com a mesma interface que os handlers já usam
+    (cursor/commit/rollback/close). A conexão só é obtida no primeiro cursor(), e close() a devolve
+    ao pool na hora. Nos GETs, cada transação é REPEATABLE READ READ ONLY, então todas as consultas
+    de uma página enxergam o mesmo snapshot. Se não houver banco, cursor() levanta
+    psycopg2.OperationalError, que os handlers já tratam no `except psycopg2.Error`.
+    """
+    def __init__(self, somente_leitura):
+        self.somente_leitura = somente_leitura
+        self._conn = None
+        self._transacao_configurada = False
+
+    def __bool__(self):
+        # Tenant sem as tabelas da página: nenhuma consulta é feita (ver verificar_tenant).
+        if g.get('tenant_indisponivel'):
+            return False
+        # Com o disjuntor aberto os handlers caem direto no `if not conn:` (falha rápida).
+        if self._conn is None and disjuntor_banco.aberto():
+            g.banco_indisponivel = True
+            return False
+        return True
+
+    def cursor(self, *args, **kwargs):
+        if self._conn is None:
+            self._conn = get_db_connection()
+            if self._conn is None:
+                if g.get('prazo_excedido'):  # esperou vaga em DB_CONEXOES_MAX até o fim do prazo
+                    raise PrazoExcedido("Prazo excedido esperando vaga de conexão")
+                g.banco_indisponivel = True
+                raise psycopg2.OperationalError("Não foi possível conectar ao PostgreSQL")
+            incrementar_metrica('unidade_de_trabalho', 'conexoes_obtidas')
+        if self.somente_leitura and not self._transacao_configurada:
+            with self._conn.cursor() as cur:
+                cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+            self._transacao_configurada = True
+        return self._conn.cursor(*args, **kwargs)
+
+    def commit(self):
+        if self._conn is not None:
+            self._conn.commit()
+        self._transacao_configurada = False
+
+    def rollback(self):
+        if self._conn is not None:
+            self._conn.rollback()
+        self._transacao_configurada = False
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        self._transacao_configurada = False
+        if conn is not None:
+            conn.close()
+
+
+def conexao_da_requisicao():
+    """Unidade de trabalho da requisição atual (criada na primeira chamada)."""
+    if 'unidade_de_trabalho' not in g:
+        somente_leitura = request.method in ('GET', 'HEAD') and request.endpoint not in ENDPOINTS_GET_COM_ESCRITA
+        g.unidade_de_trabalho = UnidadeDeTrabalho(somente_leitura)
+    return g.unidade_de_trabalho
+
+
+@app.teardown_request
+def encerrar_unidade_de_trabalho(exc):
+    unidade = g.pop('unidade_de_trabalho', None)
+    if unidade is not None:
+        unidade.close()
+
+
+def liberar_conexao_antes_do_render(sender, template, context, **extra):
+    """Nenhuma conexão fica presa ao pool durante a renderização do template."""
+    unidade = g.get('unidade_de_trabalho')
+    if unidade is not None:
+        unidade.close()
+
+
+before_render_template.connect(liberar_conexao_antes_do_render, app)
+
+
+# --- Execução paralela de consultas independentes (fan-out) ---
+# executar_grupos_paralelos() reparte grupos independentes de consultas entre até FANOUT_MAX_CONEXOES
+# conexões (contando a da requisição; padrão 3, 1 = sequencial). O primeiro lote roda na thread da
+# requisição, os demais num executor compartilhado do worker (FANOUT_THREADS, padrão 8). Em GETs as
+# conexões extras importam o snapshot da transação da requisição (pg_export_snapshot), então a página
+# continua vendo um único estado do banco; o prazo restante vai como statement_timeout em cada uma.
+FANOUT_MAX_CONEXOES = int(os.environ.get('FANOUT_MAX_CONEXOES', '3'))
+FANOUT_THREADS = int(os.environ.get('FANOUT_THREADS', '8'))
+_executor_fanout = None
+_executor_fanout_pid = None
+_executor_fanout_lock = threading.Lock()
+
+
+def executor_fanout():
+    global _executor_fanout, _executor_fanout_pid
+    with _executor_fanout_lock:
+        if _executor_fanout is None or _executor_fanout_pid != os.getpid():  # threads não sobrevivem a fork
+            _executor_fanout = ThreadPoolExecutor(max_workers=FANOUT_THREADS, thread_name_prefix='fanout')
+            _executor_fanout_pid = os.getpid()
+        return _executor_fanout
+
+
+class GrupoConsulta:
+    """
+    Grupo com uma única consulta: fetchall() (ou só a primeira linha, com um=True), opcionalmente
+    passado por transformar(). É declarativo para que o caminho ASGI (asgi.py) rode o mesmo grupo com asyncpg.
+    """
+    def __init__(self, query, params=None, um=False, transformar=None, opcional=False):
+        self.query = query
+        self.params = params
+        self.um = um
+        self.transformar = transformar
+        self.opcional = opcional
+
+    def finalizar(self, linhas):
+        resultado = (linhas[0] if linhas else None) if self.um else linhas
+        return self.transformar(resultado) if self.transformar else resultado
+
+    def __call__(self, conn):
+        cur = conn.cursor(cursor_factory=DictCursor)
+        try:
+            executar_preparado(cur, self.query, self.params)
+            return self.finalizar(cur.fetchall())
+        finally:
+            cur.close()
+
+
+def grupo_categorias(user_schema, tipos):
+    """Categorias de vários tipos numa consulta só: {tipo: [nomes]}, na ordem de buscar_categorias_por_tipo()."""
+    def agrupar(linhas):
+        por_tipo = {tipo: [] for tipo in tipos}
+        for linha in linhas:
+            por_tipo[linha['tipo']].append(linha['nome'])
+        return por_tipo
+    query = sql.SQL(
+        "SELECT tipo, nome FROM {schema}.categorias WHERE tipo = ANY(%s) ORDER BY is_fixa DESC, nome ASC"
+    ).format(schema=sql.Identifier(user_schema))
+    return GrupoConsulta(query, (list(tipos),), transformar=agrupar, opcional=True)
+
+
+def grupo_metodos_pagamento(user_schema):
+    """Mesma consulta de buscar_metodos_pagamento_ativos(), como grupo."""
+    query = sql.SQL(
+        "SELECT id, nome, tipo, modalidad FROM {schema}.metodos_pagamento WHERE ativo = TRUE ORDER BY nome ASC"
+    ).format(schema=sql.Identifier(user_schema))
+    return GrupoConsulta(query, opcional=True)
+
+
+class ResultadosLote(dict):
+    """
+    {nome: resultado} de um lote, com os grupos opcionais que falharam (resultado None) em `opcionais_falhos`.
+    Viaja com os resultados (cópias do single-flight, cache entre processos) para quem conduz o plano marcar
+    a requisição (g.grupo_opcional_falhou): payload parcial não vai para o cache nem vira "última boa".
+    """
+    def __init__(self):
+        super().__init__()
+        self.opcionais_falhos = []
+
+
+def _rodar_lote(conn, lote, opcionais, resultados, erros):
+    for nome, funcao in lote:
+        opcional = nome in opcionais
+        try:
+            if opcional:
+                with conn.cursor() as cur:
+                    cur.execute("SAVEPOINT grupo_opcional")
+            resultados[nome] = funcao(conn)
+        except psycopg2.Error as e:
+            if not opcional:
+                erros.append(e)
+                return  # transação abortada: o resto do lote falharia igual
+            logging.error("Grupo opcional %s falhou: %s", nome, e)
+            resultados[nome] = None
+            resultados.opcionais_falhos.append(nome)
+            with conn.cursor() as cur:
+                cur.execute("ROLLBACK TO SAVEPOINT grupo_opcional")
+
+
+def _rodar_lote_em_conexao_propria(lote, opcionais, somente_leitura, snapshot, restante_ms):
+    resultados, erros = ResultadosLote(), []
+    conn = get_db_connection(espera_vaga=0)
+    if conn is None:
+        return None  # sem vaga (DB_CONEXOES_MAX) ou sem banco: o lote roda na conexão da requisição
+    try:
+        with conn.cursor() as cur:
+            if somente_leitura:
+                cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+            if snapshot:
+                cur.execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+            if restante_ms is not None:
+                definir_parametros_transacao(cur, {'statement_timeout': max(1, int(restante_ms))})
+        _rodar_lote(conn, lote, opcionais, resultados, erros)
+    finally:
+        conn.close()
+    return resultados, erros
+
+
+def executar_grupos_paralelos(conn, grupos, opcionais=()):
+    """
+    grupos: {nome: funcao(conexao) -> resultado}, independentes entre si. Devolve {nome: resultado}.
+    Grupos opcionais (em `opcionais` ou com .opcional) rodam num SAVEPOINT: se falharem o resultado
+    é None, o nome vai para .opcionais_falhos e o resto segue. Qualquer outro erro é relançado depois que todos os lotes terminam.
+    """
+    itens = list(grupos.items())
+    opcionais = set(opcionais) | {nome for nome, funcao in itens if getattr(funcao, 'opcional', False)}
+    quantidade = max(1, min(FANOUT_MAX_CONEXOES, len(itens)))
+    resultados, erros = ResultadosLote(), []
+    if quantidade == 1 or not isinstance(conn, UnidadeDeTrabalho):
+        _rodar_lote(conn, itens, opcionais, resultados, erros)
+    else:
+        lotes = [itens[i::quantidade] for i in range(quantidade)]
+        snapshot = None
+        if conn.somente_leitura:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_export_snapshot()")
+                snapshot = cur.fetchone()[0]
+        restante_ms = tempo_restante_ms()
+        futuros = [executor_fanout().submit(_rodar_lote_em_conexao_propria, lote, opcionais, conn.somente_leitura, snapshot, restante_ms)
+                   for lote in lotes[1:]]
+        _rodar_lote(conn, lotes[0], opcionais, resultados, erros)
+        for lote, futuro in zip(lotes[1:], futuros):  # a transação da requisição (dona do snapshot) fica aberta até todos terminarem
+            try:
+                retorno = futuro.result()
+            except psycopg2.Error as e:
+                erros.append(e)
+                continue
+            if retorno is None:
+                incrementar_metrica('fanout', 'lotes_sem_conexao')
+                _rodar_lote(conn, lote, opcionais, resultados, erros)
+                continue
+            incrementar_metrica('fanout', 'conexoes_extras')
+            resultados.update(retorno[0])
+            resultados.opcionais_falhos.extend(retorno[0].opcionais_falhos)
+            erros.extend(retorno[1])
+    incrementar_metrica('fanout', 'grupos', len(itens))
+
+    if erros:
+        erro = erros[0]
+        if isinstance(erro, psycopg2.extensions.QueryCanceledError) and not isinstance(erro, PrazoExcedido):
+            registrar_prazo_excedido('banco')
+            raise PrazoExcedido(str(erro).strip()) from erro
+        if isinstance(erro, psycopg2.OperationalError) and not isinstance(erro, psycopg2.extensions.QueryCanceledError):
+            g.banco_indisponivel = True
+        raise erro
+    return resultados
+
+
+# --- Rotas de leitura como planos (app síncrono e caminho ASGI) ---
+# As rotas GET pesadas são geradores decorados com @plano_leitura: cada `resultados = yield {nome: GrupoConsulta}`
+# pede um lote de consultas independentes e o `return` final devolve a resposta. Erros de banco voltam
+# para dentro do gerador (plano.throw), então os `except psycopg2.Error` das rotas continuam valendo.
+# Aqui o lote roda com executar_grupos_paralelos(); asgi.py conduz o mesmo gerador com asyncpg.
+# Outro I/O bloqueante (ex.: o cache) vai como `valor = yield ChamadaBloqueante(funcao, *args)`: aqui roda
+# na hora, no caminho ASGI numa thread, para não parar o event loop.
+PLANOS_LEITURA = {}
+
+
+class ChamadaBloqueante:
+    """Pedido de um plano para chamar funcao(*args) fora do event loop (no app síncrono, chamada direta)."""
+    __slots__ = ('funcao', 'args')
+
+    def __init__(self, funcao, *args):
+        self.funcao = funcao
+        self.args = args
+
+    def __call__(self):
+        return self.funcao(*self.args)
+
+
+def conduzir_plano(plano, executar):
+    """Conduz um plano até o fim, executando cada lote pedido com executar(grupos)."""
+    try:
+        pedido = next(plano)
+        while True:
+            if isinstance(pedido, ChamadaBloqueante):
+                try:
+                    valor = pedido()
+                except Exception as e:  # volta para o plano, como faria se a rota chamasse direto
+                    pedido = plano.throw(e)
+                else:
+                    pedido = plano.send(valor)
+                continue
+            try:
+                resultados = executar(pedido)
+            except psycopg2.Error as e:
+                g.erro_banco = True  # a página sai sem (parte d)os dados: não é "última boa" (ver aplicar_cache_obsoleto)
+                pedido = plano.throw(e)
+            else:
+                if getattr(resultados, 'opcionais_falhos', None):
+                    g.grupo_opcional_falhou = True
+                pedido = plano.send(resultados)
+    except StopIteration as fim:
+        return fim.value
+    finally:
+        plano.close()  # erro fora do psycopg2: roda o finally da rota ainda dentro do contexto da requisição
+
+
+def plano_leitura(f):
+    """Registra a rota em PLANOS_LEITURA (pelo nome do endpoint) e devolve a view síncrona."""
+    PLANOS_LEITURA[f.__name__] = f
+
+    @wraps(f)
+    def view(*args, **kwargs):
+        return conduzir_plano(f(*args, **kwargs), executar_lote_da_requisicao)
+    return view
+
+
+def texto_sql(query):
+    """Texto de um sql.Composable sem precisar de conexão (o asyncpg não entende os objetos do psycopg2)."""
+    if isinstance(query, str):
+        return query
+    if isinstance(query, sql.Composed):
+        return ''.join(texto_sql(parte) for parte in query.seq)
+    if isinstance(query, sql.SQL):
+        return query.string
+    if isinstance(query, sql.Identifier):
+        return '.'.join('"' + parte.replace('"', '""') + '"' for parte in query.strings)
+    raise TypeError(f"texto_sql: {type(query).__name__} não suportado")
+
+
+# --- Cache de páginas por tenant (flask_caching) ---
+# A chave inclui schema, usuário e uma versão por tenant: qualquer escrita bem-sucedida do tenant troca
+# a versão, então uma página cacheada nunca mostra dados de outro tenant nem de antes da escrita.
+# Não entram no cache: visitantes sem login, requisições com mensagens flash pendentes e páginas
+# montadas com prazo excedido, banco indisponível ou tenant incompleto. CACHE_PAGINAS_SEGUNDOS (padrão 300).
+CACHE_PAGINAS_SEGUNDOS = int(os.environ.get('CACHE_PAGINAS_SEGUNDOS', '300'))
+
+
+def versao_cache_tenant(schema):
+    return cache.get(f"versao_tenant/{schema}") or 0
+
+
+def chave_cache_pagina():
+    schema = session.get('user_schema') or '-'
+    return f"pagina/{schema}/{versao_cache_tenant(schema)}/{session.get('user_assinatura_id')}{request.full_path}"
+
+
+def pagina_nao_cacheavel():
+    return 'user_assinatura_id' not in session or '_flashes' in session
+
+
+def pagina_cacheavel(resposta):
+    if g.get('prazo_excedido') or g.get('banco_indisponivel') or g.get('tenant_indisponivel'):
+        return False
+    return not request_ctx.flashes and '_flashes' not in session  # nenhuma mensagem flash nesta página
+
+
+@app.after_request
+def invalidar_cache_tenant(response):
+    if request.method in ('GET', 'HEAD'):
+        escrita = request.endpoint in ENDPOINTS_GET_COM_ESCRITA
+    else:
+        escrita = request.endpoint not in ENDPOINTS_POST_SEM_ESCRITA
+    schema = session.get('user_schema')
+    if escrita and schema and response.status_code < 400:
+        cache.set(f"versao_tenant/{schema}", time.time_ns(), timeout=0)
+    return response
+
+
+# --- Coalescência de computações idênticas (single-flight) ---
+# Várias abas do dashboard, ou um retry do front, pedem ao mesmo tempo o mesmo lote de consultas (mesmo schema,
+# período e filtros). Com coalescer() só a primeira chamada executa; as concorrentes com a mesma chave esperam
+# e recebem uma cópia do resultado (ou o mesmo erro). Vale para todos os lotes das rotas @plano_leitura
+# (dashboard, relatórios e as estatísticas/páginas de gastos e receitas). A chave inclui a versão de cache
+# do tenant, então uma leitura logo depois de uma escrita nunca pega carona num lote iniciado antes dela.
+# SINGLE_FLIGHT: 1 (padrão) liga; 0 desliga.
+# SINGLE_FLIGHT_COMPARTILHADO: 1 = coalesce também entre processos, com lock e resultado no cache do
+#   flask_caching (só faz sentido com CACHE_TYPE compartilhado, ex.: RedisCache). Padrão 0.
+# SINGLE_FLIGHT_RESULTADO_SEGUNDOS: por quanto tempo o resultado fica no cache para os outros processos (padrão 5).
+SINGLE_FLIGHT = os.environ.get('SINGLE_FLIGHT', '1') == '1'
+SINGLE_FLIGHT_COMPARTILHADO = os.environ.get('SINGLE_FLIGHT_COMPARTILHADO', '0') == '1'
+SINGLE_FLIGHT_RESULTADO_SEGUNDOS = int(os.environ.get('SINGLE_FLIGHT_RESULTADO_SEGUNDOS', '5'))
+
+
+class Voo:
+    """Uma computação em andamento: os seguidores esperam no evento."""
+    __slots__ = ('evento', 'resultado', 'erro', 'seguidores')
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+        self.erro = None
+        self.seguidores = 0
+
+
+_voos = {}
+_voos_lock = threading.Lock()
+
+
+def chave_lote(grupos):
+    """
+    Identidade de um lote de GrupoConsulta: consultas, parâmetros e forma do resultado. None se algum
+    grupo não for declarativo. transformar() deve depender só da consulta e dos parâmetros.
+    """
+    partes = []
+    for nome, grupo in sorted(grupos.items()):
+        if not isinstance(grupo, GrupoConsulta):
+            return None
+        partes.append((nome, texto_sql(grupo.query), grupo.params, grupo.um, grupo.opcional,
+                       getattr(grupo.transformar, '__qualname__', None)))
+    return hashlib.sha1(repr(partes).encode('utf-8')).hexdigest()
+
+
+def segundos_para_esperar():
+    restante = tempo_restante_ms()
+    return PRAZO_PADRAO_SEGUNDOS if restante is None else max(0.0, restante / 1000)
+
+
+def repassar_erro_do_lider(erro):
+    """
+    O seguidor herda o erro do líder com os mesmos efeitos na página (flash de prazo, banco indisponível).
+    Cada seguidor levanta a sua própria exceção, encadeada na do líder: o mesmo objeto levantado em várias
+    threads/tarefas misturaria os tracebacks. Erros fora do psycopg2 chegam como RuntimeError.
+    """
+    if isinstance(erro, psycopg2.extensions.QueryCanceledError):
+        registrar_prazo_excedido('single_flight')
+    elif isinstance(erro, psycopg2.OperationalError) and has_request_context():
+        g.banco_indisponivel = True
+    if isinstance(erro, psycopg2.Error):
+        try:
+            copia = type(erro)(*erro.args)
+        except TypeError:
+            copia = psycopg2.DatabaseError(str(erro))
+    else:
+        copia = RuntimeError(f"Computação idêntica em andamento falhou: {type(erro).__name__}: {erro}")
+    raise copia from erro
+
+
+def coalescer(chave, calcular):
+    """Roda calcular() uma vez entre as chamadas concorrentes com a mesma chave; cada uma recebe a sua cópia."""
+    if not SINGLE_FLIGHT:
+        return calcular()
+    with _voos_lock:
+        voo = _voos.get(chave)
+        lider = voo is None
+        if lider:
+            voo = _voos[chave] = Voo()
+        else:
+            voo.seguidores += 1
+
+    if not lider:
+        incrementar_metrica('single_flight', 'seguidores')
+        if not voo.evento.wait(segundos_para_esperar()):
+            registrar_prazo_excedido('single_flight')
+            raise PrazoExcedido("Prazo excedido esperando computação idêntica em andamento")
+        if voo.erro is not None:
+            repassar_erro_do_lider(voo.erro)
+        return copy.deepcopy(voo.resultado)
+
+    try:
+        resultado = coalescer_entre_processos(chave, calcular) if SINGLE_FLIGHT_COMPARTILHADO else calcular()
+    except BaseException as e:
+        voo.erro = e
+        raise
+    finally:
+        with _voos_lock:
+            del _voos[chave]
+            compartilhado = voo.seguidores > 0
+        if voo.erro is None and compartilhado:
+            voo.resultado = resultado  # intocado: o líder devolve a própria cópia abaixo
+        voo.evento.set()
+    return copy.deepcopy(resultado) if compartilhado else resultado
+
+
+def coalescer_entre_processos(chave, calcular):
+    """Líder entre processos via cache.add (atômico no Redis); os outros esperam o resultado aparecer no cache."""
+    chave_lock, chave_resultado = f"voo/{chave}/lock", f"voo/{chave}/resultado"
+    if cache.add(chave_lock, os.getpid(), timeout=ceil(segundos_para_esperar()) + 1):
+        try:
+            resultado = calcular()
+            cache.set(chave_resultado, resultado, timeout=SINGLE_FLIGHT_RESULTADO_SEGUNDOS)
+            return resultado
+        finally:
+            cache.delete(chave_lock)
+
+    incrementar_metrica('single_flight', 'seguidores_entre_processos')
+    limite = time.monotonic() + segundos_para_esperar()
+    while True:
+        resultado = cache.get(chave_resultado)
+        if resultado is not None:
+            return resultado
+        if not cache.get(chave_lock):
+            return calcular()  # o líder terminou sem gravar (erro): calcula aqui mesmo
+        if time.monotonic() >= limite:
+            registrar_prazo_excedido('single_flight')
+            raise PrazoExcedido("Prazo excedido esperando computação idêntica em outro processo")
+        time.sleep(0.05)
+
+
+def executar_lote_da_requisicao(grupos):
+    """Executor dos planos no app síncrono: fan-out na conexão da requisição, coalescido por lote."""
+    def executar():
+        return executar_grupos_paralelos(conexao_da_requisicao(), grupos)
+    chave = chave_lote(grupos)
+    if chave is None:
+        return executar()
+    schema = session.get('user_schema') or '-'
+    return coalescer(f"{schema}/{versao_cache_tenant(schema)}/{chave}", executar)
+
+
+# --- Último conteúdo bom por tenant (fallback com o banco fora do ar) ---
+# Cada render bem-sucedido das páginas abaixo guarda o contexto do template (por schema e endpoint,
+# em memória, por worker). Se o banco estiver indisponível na requisição, o contexto vazio do handler é
+# substituído pelo último guardado, marcado com `dados_obsoletos_em` e um aviso. Não conta como
+# bem-sucedido o render depois de um erro de banco tratado pela rota (g.erro_banco), de um grupo opcional
+# que falhou (g.grupo_opcional_falhou), de prazo excedido ou de tenant bloqueado: a página sai vazia ou
+# parcial e apagaria o último conteúdo bom.
+ENDPOINTS_CACHE_OBSOLETO = {'dashboard', 'gastos', 'receitas'}
+CACHE_OBSOLETO_MAX = int(os.environ.get('CACHE_OBSOLETO_MAX', '500'))
+CHAVES_CONTEXTO_IGNORADAS = {'g', 'request', 'session'}
+_cache_obsoleto_lock = threading.Lock()
+_cache_obsoleto = OrderedDict()  # (schema, endpoint, query string ou None) -> (momento, contexto)
+
+
+def _guardar_cache_obsoleto(chave, valor):
+    with _cache_obsoleto_lock:
+        _cache_obsoleto[chave] = valor
+        _cache_obsoleto.move_to_end(chave)
+        while len(_cache_obsoleto) > CACHE_OBSOLETO_MAX:
+            _cache_obsoleto.popitem(last=False)
+
+
+def aplicar_cache_obsoleto(sender, template, context, **extra):
+    if request.endpoint not in ENDPOINTS_CACHE_OBSOLETO or request.method != 'GET':
+        return
+    schema = session.get('user_schema')
+    if not schema:
+        return
+    consulta = request.query_string.decode('utf-8', 'replace')
+    if not g.get('banco_indisponivel'):
+        if g.get('prazo_excedido') or g.get('erro_banco') or g.get('grupo_opcional_falhou') or g.get('tenant_indisponivel'):
+            return  # página parcial ou vazia não é "última boa"
+        contexto = {k: v for k, v in context.items()
+                    if k not in CHAVES_CONTEXTO_IGNORADAS
+                    and not isinstance(v, (UnidadeDeTrabalho, psycopg2.extensions.cursor, psycopg2.extensions.connection))}
+        valor = (datetime.now(), contexto)
+        _guardar_cache_obsoleto((schema, request.endpoint, consulta), valor)
+        _guardar_cache_obsoleto((schema, request.endpoint, None), valor)
+        return
+    with _cache_obsoleto_lock:
+        guardado = _cache_obsoleto.get((schema, request.endpoint, consulta)) or _cache_obsoleto.get((schema, request.endpoint, None))
+    if not guardado:
+        return
+    momento, contexto = guardado
+    context.update(contexto)
+    context['dados_obsoletos_em'] = momento
+    incrementar_metrica('cache_obsoleto', f"servidos[{request.endpoint}]")
+    flash(f"Sin conexión con la base de datos: mostrando los datos guardados el {momento.strftime('%d/%m/%Y %H:%M')}.", 'warning')
+
+
+before_render_template.connect(aplicar_cache_obsoleto, app)
+
+
+# --- Registro de schemas dos tenants ---
+# Cache em memória (por worker) do que existe em cada schema: se existe, tabelas/colunas e a versão de
+# migração (campo versao_schema do COMMENT ON SCHEMA, em JSON). Antes das páginas em REQUISITOS_TENANT
+# o registro é consultado em memória; se faltar algo, a unidade de trabalho fica falsa e o handler
+# renderiza a página vazia sem mandar nenhuma consulta (em vez de uma cascata de "transaction is aborted").
+# Atualização: expira após TENANT_REGISTRO_TTL segundos; POST /admin/tenants/atualizar; e, com
+# TENANT_REGISTRO_NOTIFY=1 (só no modo direto), um LISTEN no canal CANAL_NOTIFY_TENANTS, que as
+# ferramentas de provisionamento/migração disparam com notificar_alteracao_schema().
+TENANT_REGISTRO_TTL = float(os.environ.get('TENANT_REGISTRO_TTL', '300'))
+TENANT_REGISTRO_NOTIFY = os.environ.get('TENANT_REGISTRO_NOTIFY', '0') == '1'
+CANAL_NOTIFY_TENANTS = 'tenant_schema_alterado'
+TABELAS_BASE_TENANT = ('categorias', 'gastos', 'gastos_fixos', 'outras_receitas', 'lembretes', 'metodos_pagamento', 'metas')
+# endpoint -> {tabela: colunas obrigatórias}
+REQUISITOS_TENANT = {
+    'dashboard': {'gastos': set(), 'gastos_fixos': set(), 'outras_receitas': set(),
+                  'lembretes': set(), 'metodos_pagamento': set(), 'metas': set()},
+    'gastos': {'gastos': {'metodo_pagamento_id'}, 'gastos_fixos': set(), 'categorias': set(), 'metodos_pagamento': set()},
+    'receitas': {'outras_receitas': set(), 'categorias': set()},
+    'relatorios': {'gastos': set(), 'gastos_fixos': set(), 'outras_receitas': set(), 'categorias': set()},
+    'categorias': {'categorias': set(), 'gastos': set(), 'gastos_fixos': set()},
+    'lembretes': {'lembretes': set()},
+    'metas': {'metas': set()},
+    'metodos_pagamento': {'metodos_pagamento': set()},
+}
+
+
+class RegistroTenant:
+    __slots__ = ('schema', 'existe', 'colunas', 'versao', 'carregado_em')
+
+    def __init__(self, schema, existe, colunas, versao):
+        self.schema = schema
+        self.existe = existe
+        self.colunas = colunas  # {tabela: frozenset(colunas)}
+        self.versao = versao
+        self.carregado_em = time.monotonic()
+
+    def faltando(self, requisitos):
+        if not self.existe:
+            return ['schema']
+        ausentes = []
+        for tabela, colunas in requisitos.items():
+            if tabela not in self.colunas:
+                ausentes.append(tabela)
+            else:
+                ausentes.extend(f"{tabela}.{coluna}" for coluna in sorted(colunas - self.colunas[tabela]))
+        return ausentes
+
+    def como_dict(self):
+        return {'existe': self.existe, 'versao': self.versao, 'tabelas': {t: sorted(c) for t, c in sorted(self.colunas.items())},
+                'idade_s': round(time.monotonic() - self.carregado_em, 1)}
+
+
+class RegistroTenants:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._registros = {}
+        self._lock = threading.Lock()
+
+    def obter(self, schema):
+        """Registro do schema (do cache, ou carregado do catálogo); None se o banco não respondeu."""
+        registro = self._registros.get(schema)
+        if registro is not None and time.monotonic() - registro.carregado_em < self.ttl:
+            return registro
+        registro = self._carregar(schema)
+        if registro is not None:
+            with self._lock:
+                self._registros[schema] = registro
+        return registro
+
+    def _carregar(self, schema):
+        conn = get_db_connection()
+        if not conn:
+            return None
+        cur = None
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT oid, obj_description(oid, 'pg_namespace') FROM pg_namespace WHERE nspname = %s", (schema,))
+            linha = cur.fetchone()
+            if linha is None:
+                incrementar_metrica('registro_tenants', 'carregados')
+                return RegistroTenant(schema, False, {}, None)
+            oid, comentario = linha
+            cur.execute("""
+                SELECT c.relname, a.attname
+                FROM pg_class c
+                JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+                WHERE c.relnamespace = %s AND c.relkind IN ('r', 'p', 'v')
+            """, (oid,))
+            colunas = defaultdict(set)
+            for tabela, coluna in cur.fetchall():
+                colunas[tabela].add(coluna)
+            try:
+                versao = json.loads(comentario).get('versao_schema') if comentario else None
+            except (ValueError, AttributeError):
+                versao = None
+            incrementar_metrica('registro_tenants', 'carregados')
+            return RegistroTenant(schema, True, {t: frozenset(c) for t, c in colunas.items()}, versao)
+        except psycopg2.Error as e:
+            logging.error("Erro ao carregar o registro do schema %s: %s", schema, e)
+            return None
+        finally:
+            if cur: cur.close()
+            conn.close()
+
+    def invalidar(self, schema=None):
+        with self._lock:
+            if schema:
+                self._registros.pop(schema, None)
+            else:
+                self._registros.clear()
+        logging.info("Registro de tenants invalidado: %s", schema or 'todos')
+
+    def resumo(self):
+        with self._lock:
+            return {schema: registro.como_dict() for schema, registro in sorted(self._registros.items())}
+
+
+registro_tenants = RegistroTenants(TENANT_REGISTRO_TTL)
+
+
+def notificar_alteracao_schema(cur, schema):
+    """Para ferramentas de provisionamento/migração: avisa os workers (com LISTEN ativo) que o schema mudou."""
+    cur.execute("SELECT pg_notify(%s, %s)", (CANAL_NOTIFY_TENANTS, schema))
+
+
+def ouvir_alteracoes_schema():
+    """Thread de fundo: LISTEN no canal e invalidação do registro a cada NOTIFY (reconecta sozinha)."""
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(**parametros_conexao())
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(sql.SQL("LISTEN {}").format(sql.Identifier(CANAL_NOTIFY_TENANTS)))
+            registro_tenants.invalidar()  # pode ter perdido avisos enquanto estava desconectado
+            while True:
+                if select.select([conn], [], [], 60) != ([], [], []):
+                    conn.poll()
+                    while conn.notifies:
+                        registro_tenants.invalidar(conn.notifies.pop(0).payload or None)
+        except psycopg2.Error as e:
+            logging.warning("LISTEN %s interrompido, reconectando em 5s: %s", CANAL_NOTIFY_TENANTS, e)
+        finally:
+            if conn: conn.close()
+        time.sleep(5)
+
+
+_ouvinte_tenants_pid = None
+
+
+@app.before_request
+def verificar_tenant():
+    global _ouvinte_tenants_pid
+    if TENANT_REGISTRO_NOTIFY and DB_MODO_CONEXAO == 'direto' and _ouvinte_tenants_pid != os.getpid():
+        _ouvinte_tenants_pid = os.getpid()  # uma thread por processo (inclusive depois de fork)
+        threading.Thread(target=ouvir_alteracoes_schema, name='ouvinte-tenants', daemon=True).start()
+
+    requisitos = REQUISITOS_TENANT.get(request.endpoint)
+    schema = session.get('user_schema')
+    if not requisitos or not schema:
+        return
+    registro = registro_tenants.obter(schema)
+    if registro is None:
+        return  # banco indisponível: o disjuntor/fallback cuidam disso
+    faltando = registro.faltando(requisitos)
+    if faltando:
+        g.tenant_indisponivel = faltando
+        incrementar_metrica('registro_tenants', f"paginas_bloqueadas[{request.endpoint}]")
+        logging.warning("Schema %s incompleto para %s, consultas puladas. Faltando: %s", schema, request.endpoint, ', '.join(faltando))
+        flash('Su cuenta todavía se está configurando. Intente nuevamente en unos minutos.', 'warning')
 
 
 # --- Funções Auxiliares ---
@@ -212,10 +1742,104 @@ def get_rrule_params(recurrencia_str_original):
         return None
     else:
         # Se, após limpeza e tradução, o termo ainda não for reconhecido.
-        logging.warning(f"Recorrência desconhecida. Original: '{recurrencia_str_original}', Processada como: '{termo_padronizado}'. Nenhuma regra definida corresponde.")
+        logging.warning("Recorrência desconhecida. Original: '%s', Processada como: '%s'. Nenhuma regra definida corresponde.", recurrencia_str_original, termo_padronizado)
         return None
 
 
+RECORRENCIAS_UNICAS = ('unico', 'único', 'única')
+
+
+def expandir_gastos_fixos(gastos_fixos, data_inicio, data_fim, incluir_unicos=True):
+    """
+    Expande gastos fixos (linhas com fecha_inicio, valor e recurrencia) nas ocorrências dentro de
+    [data_inicio, data_fim]. Gera tuplas (gasto_fixo, data_ocorrencia).
+    Gastos com recorrência 'único' só entram quando incluir_unicos=True.
+    """
+    for gf in gastos_fixos:
+        verificar_prazo()
+        dtstart = gf['fecha_inicio']
+        if isinstance(dtstart, datetime):
+            dtstart = dtstart.date()
+        rrule_params = get_rrule_params(gf['recurrencia'])
+        if rrule_params:
+            try:
+                ocorrencias = list(rrule(dtstart=dtstart, until=data_fim, **rrule_params))
+            except Exception as e_rrule:
+                logging.error("Gasto Fixo ID %s rrule error: %s para o período %s a %s", gf.get('id', 'N/A'), e_rrule, data_inicio, data_fim)
+                continue
+            for occ in ocorrencias:
+                occ_date = occ.date()
+                if occ_date >= data_inicio:
+                    yield gf, occ_date
+        elif incluir_unicos and isinstance(gf['recurrencia'], str) and gf['recurrencia'].lower().strip() in RECORRENCIAS_UNICAS:
+            if data_inicio <= dtstart <= data_fim:
+                yield gf, dtstart
+
+
+def agrupar_lembretes(lista_de_lembretes, hoje):
+    """
+    Agrupa lembretes em vencidos / para_hoje / proximos_7_dias / futuros.
+    Lembretes mensais repetitivos são posicionados pela próxima ocorrência a partir de hoje.
+    """
+    limite_proximos_dias = hoje + timedelta(days=7)
+
+    lembretes_agrupados = {
+        'vencidos': [],
+        'para_hoje': [],
+        'proximos_7_dias': [],
+        'futuros': []
+    }
+
+    for lembrete in lista_de_lembretes:
+        lembrete_dict = dict(lembrete) # Converte para um dicionário mutável
+        data_lembrete = lembrete_dict['data']
+        is_repeating_monthly = lembrete_dict.get('repetir') and lembrete_dict.get('tipo_repeticion') == 'mensal'
+
+        if is_repeating_monthly:
+            # Calcula a próxima ocorrência a partir de hoje
+            dia_lembrete = data_lembrete.day
+            try:
+                proxima_ocorrencia = hoje.replace(day=dia_lembrete)
+            except ValueError: # Caso o dia não exista no mês atual (ex: dia 31 em fevereiro)
+                ultimo_dia_mes_atual = (hoje.replace(day=1) + relativedelta(months=1)) - timedelta(days=1)
+                proxima_ocorrencia = ultimo_dia_mes_atual
+
+            if proxima_ocorrencia < hoje:
+                proxima_ocorrencia = proxima_ocorrencia + relativedelta(months=1)
+
+            lembrete_dict['data_exibicao'] = proxima_ocorrencia # Adiciona data para exibição
+
+            # Agrupa baseado na próxima ocorrência
+            if proxima_ocorrencia == hoje:
+                lembretes_agrupados['para_hoje'].append(lembrete_dict)
+            elif hoje < proxima_ocorrencia <= limite_proximos_dias:
+                lembretes_agrupados['proximos_7_dias'].append(lembrete_dict)
+            else:
+                lembretes_agrupados['futuros'].append(lembrete_dict)
+
+        else: # Lembretes não repetitivos
+            lembrete_dict['data_exibicao'] = data_lembrete
+            if data_lembrete < hoje:
+                lembretes_agrupados['vencidos'].append(lembrete_dict)
+            elif data_lembrete == hoje:
+                lembretes_agrupados['para_hoje'].append(lembrete_dict)
+            elif hoje < data_lembrete <= limite_proximos_dias:
+                lembretes_agrupados['proximos_7_dias'].append(lembrete_dict)
+            else: # data_lembrete > limite_proximos_dias
+                lembretes_agrupados['futuros'].append(lembrete_dict)
+
+    # Ordena cada grupo pela data de exibição
+    for grupo in lembretes_agrupados.values():
+        grupo.sort(key=lambda x: x['data_exibicao'])
+
+    return lembretes_agrupados
+
+
+def agrupar_transacoes_por_data(transacoes):
+    """Ordena as transações da mais recente para a mais antiga (in-place) e agrupa por data."""
+    transacoes.sort(key=itemgetter('data'), reverse=True)
+    return {data: list(grupo) for data, grupo in groupby(transacoes, key=itemgetter('data'))}
+
 def format_currency_filter(value):
     if value is None:
         # Para valores nulos, você pode retornar o formato MXN desejado
@@ -343,6 +1967,307 @@ def format_date_filter(value, format_str='%d/%m/%Y'):
         return str(value)
 app.jinja_env.filters['date'] = format_date_filter
 
+# --- Administração: autenticação por token ---
+def admin_obrigatorio(f):
+    """
+    Protege rotas administrativas com o token definido em ADMIN_TOKEN (header X-Admin-Token).
+    Sem ADMIN_TOKEN configurado as rotas ficam desativadas (404).
+    """
+    @wraps(f)
+    def decorada(*args, **kwargs):
+        token_esperado = os.environ.get('ADMIN_TOKEN')
+        if not token_esperado:
+            return jsonify({'erro': 'não encontrado'}), 404
+        token_recebido = request.headers.get('X-Admin-Token', '')
+        if not hmac.compare_digest(token_recebido.encode(), token_esperado.encode()):
+            logging.warning("Acesso administrativo negado para %s (IP %s)", request.path, request.remote_addr)
+            return jsonify({'erro': 'não autorizado'}), 403
+        return f(*args, **kwargs)
+    return decorada
+
+
+# --- Métricas em memória (por worker), expostas em /admin/metricas ---
+_metricas_lock = threading.Lock()
+_metricas = defaultdict(dict)
+
+
+def incrementar_metrica(grupo, chave, quantidade=1):
+    with _metricas_lock:
+        _metricas[grupo][chave] = _metricas[grupo].get(chave, 0) + quantidade
+
+
+def definir_metrica(grupo, chave, valor):
+    with _metricas_lock:
+        _metricas[grupo][chave] = valor
+
+
+# --- Controle de admissão das rotas pesadas (por tenant e global) ---
+# Limita quantas requisições pesadas ficam em andamento ao mesmo tempo neste worker: no máximo
+# ADMISSAO_MAX_POR_TENANT (padrão 2) por tenant e ADMISSAO_MAX_GLOBAL (padrão 6; 0 = desativado) no total,
+# deixando threads e conexões livres para as rotas leves. O excedente espera na fila por até
+# ADMISSAO_ESPERA_SEGUNDOS (padrão 2, nunca além do prazo da rota). Vagas liberadas são entregues em rodízio
+# entre os tenants que esperam: um tenant com várias abas de relatório não passa na frente dos outros.
+# Quem não entra recebe 429 (o próprio tenant está no teto) ou 503 (o worker está cheio), com Retry-After.
+# Cada tenant tem no máximo ADMISSAO_MAX_POR_TENANT requisições na fila; ADMISSAO_FILA_MAX (padrão 50) limita o total.
+# ADMISSAO_ROTAS: endpoints controlados, separados por vírgula (padrão: as rotas de @plano_leitura).
+# Página que o @cache.cached da rota vai servir do cache não ocupa vaga: não vai ao banco.
+# Profundidade da fila e tempos de espera ficam em /admin/metricas (grupo 'admissao').
+ADMISSAO_MAX_GLOBAL = int(os.environ.get('ADMISSAO_MAX_GLOBAL', '6'))
+ADMISSAO_MAX_POR_TENANT = int(os.environ.get('ADMISSAO_MAX_POR_TENANT', '2'))
+ADMISSAO_ESPERA_SEGUNDOS = float(os.environ.get('ADMISSAO_ESPERA_SEGUNDOS', '2'))
+ADMISSAO_FILA_MAX = int(os.environ.get('ADMISSAO_FILA_MAX', '50'))
+ADMISSAO_ROTAS = {r.strip() for r in os.environ.get('ADMISSAO_ROTAS', '').split(',') if r.strip()}
+
+
+class ControleAdmissao:
+    """Vagas por tenant e globais com fila justa entre tenants. Um por processo."""
+
+    def __init__(self, max_global, max_por_tenant, fila_max):
+        self.max_global = max_global
+        self.max_por_tenant = max_por_tenant
+        self.fila_max = fila_max
+        self._lock = threading.Lock()
+        self._em_andamento = Counter()
+        self._total = 0
+        self._filas = OrderedDict()  # tenant -> deque de Events; a ordem das chaves é a do rodízio
+        self._na_fila = 0
+        self._pico_fila = 0
+
+    def _cabe(self, tenant):
+        return self._total < self.max_global and self._em_andamento[tenant] < self.max_por_tenant
+
+    def _ocupar(self, tenant):
+        self._total += 1
+        self._em_andamento[tenant] += 1
+
+    def _despachar(self):
+        # Uma vaga por tenant a cada volta; quem foi atendido e ainda tem fila vai para o fim
+        atendeu = True
+        while atendeu and self._total < self.max_global:
+            atendeu = False
+            for tenant in list(self._filas):
+                if self._total >= self.max_global:
+                    break
+                if self._em_andamento[tenant] >= self.max_por_tenant:
+                    continue
+                fila = self._filas[tenant]
+                self._ocupar(tenant)
+                self._na_fila -= 1
+                fila.popleft().set()
+                if fila:
+                    self._filas.move_to_end(tenant)
+                else:
+                    del self._filas[tenant]
+                atendeu = True
+
+    def entrar(self, tenant, espera):
+        """Ocupa uma vaga para o tenant. Devolve (status da recusa ou None, se precisou esperar na fila)."""
+        with self._lock:
+            if tenant not in self._filas and self._cabe(tenant):
+                self._ocupar(tenant)
+                return None, False
+            if len(self._filas.get(tenant, ())) >= self.max_por_tenant:
+                return 429, False
+            if self._na_fila >= self.fila_max:
+                return 503, False
+            evento = threading.Event()
+            self._filas.setdefault(tenant, deque()).append(evento)
+            self._na_fila += 1
+            self._pico_fila = max(self._pico_fila, self._na_fila)
+        if evento.wait(max(0.0, espera)):
+            return None, True
+        with self._lock:
+            if evento.is_set():
+                return None, True  # a vaga chegou junto com o timeout
+            fila = self._filas[tenant]
+            fila.remove(evento)
+            self._na_fila -= 1
+            if not fila:
+                del self._filas[tenant]
+            return (429 if self._em_andamento[tenant] >= self.max_por_tenant else 503), True
+
+    def sair(self, tenant):
+        with self._lock:
+            self._total -= 1
+            self._em_andamento[tenant] -= 1
+            if self._em_andamento[tenant] <= 0:
+                del self._em_andamento[tenant]
+            self._despachar()
+
+    def estado(self):
+        with self._lock:
+            return {
+                'em_andamento': self._total,
+                'na_fila': self._na_fila,
+                'na_fila_pico': self._pico_fila,
+                'tenants_em_andamento': len(self._em_andamento),
+                'tenants_na_fila': len(self._filas),
+            }
+
+
+controle_admissao = ControleAdmissao(ADMISSAO_MAX_GLOBAL, ADMISSAO_MAX_POR_TENANT, ADMISSAO_FILA_MAX)
+
+
+def registrar_espera_admissao(espera_ms):
+    with _metricas_lock:
+        atual = _metricas['admissao']
+        atual['esperas'] = atual.get('esperas', 0) + 1
+        atual['espera_ms_soma'] = round(atual.get('espera_ms_soma', 0.0) + espera_ms, 1)
+        atual['espera_ms_media'] = round(atual['espera_ms_soma'] / atual['esperas'], 1)
+        atual['espera_ms_max'] = round(max(atual.get('espera_ms_max', 0.0), espera_ms), 1)
+
+
+def pagina_em_cache():
+    """A view é @cache.cached e a página desta requisição já está no cache."""
+    view = app.view_functions.get(request.endpoint)
+    if not hasattr(view, 'make_cache_key') or pagina_nao_cacheavel():
+        return False
+    return cache.has(view.make_cache_key(use_request=True, **(request.view_args or {})))
+
+
+@app.before_request
+def admitir_requisicao_pesada():
+    schema = session.get('user_schema')
+    if not ADMISSAO_MAX_GLOBAL or not schema or request.endpoint not in (ADMISSAO_ROTAS or PLANOS_LEITURA):
+        return  # sem login a view só redireciona para o login
+    if pagina_em_cache():
+        incrementar_metrica('admissao', 'dispensadas_cache')
+        return
+    restante = tempo_restante_ms()
+    espera = ADMISSAO_ESPERA_SEGUNDOS if restante is None else min(ADMISSAO_ESPERA_SEGUNDOS, restante / 1000)
+    inicio = time.monotonic()
+    recusa, esperou = controle_admissao.entrar(schema, espera)
+    if esperou:
+        registrar_espera_admissao((time.monotonic() - inicio) * 1000)
+    if recusa is None:
+        g.admissao_schema = schema
+        incrementar_metrica('admissao', 'admitidas')
+        return
+    incrementar_metrica('admissao', f"recusadas_{recusa}")
+    logging.warning("Admissão recusada (%d) para %s em %s", recusa, schema, request.endpoint)
+    if recusa == 429:
+        return resposta_recusada(429, 'muitas_requisicoes_simultaneas', 'tenant no teto de requisições pesadas simultâneas',
+                                 'Ya tienes otras consultas pesadas en curso. Espera a que terminen e inténtalo de nuevo.',
+                                 retry_after=max(1, ceil(ADMISSAO_ESPERA_SEGUNDOS)))
+    return resposta_recusada(503, 'servidor_ocupado', 'sem vaga para rotas pesadas neste worker',
+                             'El servidor está ocupado en este momento. Inténtalo de nuevo en unos segundos.',
+                             retry_after=max(1, ceil(ADMISSAO_ESPERA_SEGUNDOS)))
+
+
+@app.teardown_request
+def liberar_admissao(exc):
+    schema = g.pop('admissao_schema', None)
+    if schema is not None:
+        controle_admissao.sair(schema)
+
+
+# --- Profiler por amostragem de pilhas ---
+# As amostras são filtradas por _requisicoes_ativas (ver "Request ID, log de acesso e requisições ativas").
+_profiler_lock = threading.Lock()
+PROFILER_MAX_SEGUNDOS = 60
+
+
+def amostrar_pilhas(segundos, intervalo=0.01, rota=None, schema=None, todas_threads=False):
+    """
+    Amostra as pilhas das outras threads do processo durante `segundos`.
+    Retorna um Counter no formato "collapsed stacks" (frames separados por ';'), pronto para flame graphs.
+    Por padrão só considera threads atendendo requisições; `rota` e `schema` restringem a um endpoint/tenant.
+    """
+    contagens = Counter()
+    propria_thread = threading.get_ident()
+    fim = time.monotonic() + segundos
+    while time.monotonic() < fim:
+        por_thread = {thread_id: info for thread_id, *info in list(_requisicoes_ativas.values())}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == propria_thread:
+                continue
+            info = por_thread.get(thread_id)
+            if info is None and (not todas_threads or rota or schema):
+                continue
+            if rota and info[0] != rota:
+                continue
+            if schema and info[1] != schema:
+                continue
+            pilha = []
+            while frame is not None:
+                code = frame.f_code
+                pilha.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            pilha.append(f"rota:{info[0]}" if info else f"thread:{thread_id}")
+            pilha.reverse()
+            contagens[';'.join(pilha)] += 1
+        time.sleep(intervalo)
+    return contagens
+
+
+# --- Profiling de memória por rota (tracemalloc, opt-in) ---
+# MEMORIA_PROFILING_ROTAS: endpoints separados por vírgula (ex.: "relatorios,gastos,dashboard"). Vazio = desativado.
+# MEMORIA_PROFILING_TAXA: fração das requisições dessas rotas que é medida (padrão 0.01).
+MEMORIA_PROFILING_ROTAS = {r.strip() for r in os.environ.get('MEMORIA_PROFILING_ROTAS', '').split(',') if r.strip()}
+MEMORIA_PROFILING_TAXA = float(os.environ.get('MEMORIA_PROFILING_TAXA', '0.01'))
+MEMORIA_PROFILING_TOP = 10
+# tracemalloc é global ao processo: mede-se uma requisição por vez para não misturar alocações.
+# O módulo só é importado quando uma requisição é de fato amostrada.
+_memoria_lock = threading.Lock()
+
+
+@app.before_request
+def iniciar_profiling_memoria():
+    if request.endpoint not in MEMORIA_PROFILING_ROTAS or random.random() >= MEMORIA_PROFILING_TAXA:
+        return
+    if not _memoria_lock.acquire(blocking=False):
+        return
+    import tracemalloc
+    g.memoria_iniciou_tracemalloc = not tracemalloc.is_tracing()
+    if g.memoria_iniciou_tracemalloc:
+        tracemalloc.start()
+    g.memoria_base = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    g.memoria_snapshot = None
+
+
+@before_render_template.connect_via(app)
+def capturar_snapshot_memoria(sender, template, context, **extra):
+    # Antes do render as estruturas montadas pela view (listas de transações, dicts diários) ainda estão vivas.
+    if g.get('memoria_base') is not None and g.get('memoria_snapshot') is None:
+        import tracemalloc
+        g.memoria_snapshot = tracemalloc.take_snapshot()
+
+
+@app.teardown_request
+def finalizar_profiling_memoria(exc):
+    if g.get('memoria_base') is None:
+        return
+    import tracemalloc
+    try:
+        pico_bytes = tracemalloc.get_traced_memory()[1] - g.memoria_base
+        snapshot = g.memoria_snapshot or tracemalloc.take_snapshot()
+        if g.memoria_iniciou_tracemalloc:
+            tracemalloc.stop()
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        top_alocacoes = [
+            {'local': f"{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+             'kb': round(stat.size / 1024, 1), 'blocos': stat.count}
+            for stat in snapshot.statistics('lineno')[:MEMORIA_PROFILING_TOP]
+        ]
+        rota = request.endpoint
+        with _metricas_lock:
+            atual = _metricas['memoria'].get(rota, {'amostras': 0, 'pico_max_kb': 0.0, 'pico_soma_kb': 0.0})
+            pico_kb = round(pico_bytes / 1024, 1)
+            atual['amostras'] += 1
+            atual['pico_soma_kb'] += pico_kb
+            atual['pico_medio_kb'] = round(atual['pico_soma_kb'] / atual['amostras'], 1)
+            atual['ultimo_pico_kb'] = pico_kb
+            if pico_kb >= atual['pico_max_kb']:
+                atual['pico_max_kb'] = pico_kb
+                atual['top_alocacoes_no_pico_max'] = top_alocacoes
+            atual['top_alocacoes_ultima'] = top_alocacoes
+            _metricas['memoria'][rota] = atual
+    finally:
+        g.memoria_base = None
+        _memoria_lock.release()
+
+
 # --- Função para converter tipos não serializáveis em JSON ---
 def json_converter(obj):
     if isinstance(obj, Decimal): return float(obj)
@@ -371,7 +2296,7 @@ def login():
         if not email or not senha:
             flash('El correo electrónico y la contraseña son obligatorios.', 'danger')
             return redirect(url_for('login'))
-        conn = get_db_connection()
+        conn = conexao_da_requisicao()
         if conn:
             cur = None
             try:
@@ -392,7 +2317,9 @@ def login():
                             session['user_nome'] = assinatura_info['nome_cliente']
                             session.permanent = True
                             session.modified = True
-                            logging.info(f"Login bem-sucedido: {login_user['email']}, Schema: {schema_name}")
+                            logging.info("Login bem-sucedido: %s, Schema: %s", login_user['email'], schema_name)
+                            if AQUECER_NO_LOGIN:
+                                aquecer_dashboard(schema_name)
                             return redirect(url_for('dashboard'))
                         else:
                             logging.error(f"Não foi possível gerar nome do schema para usuário {email}.")
@@ -442,7 +2369,7 @@ def criar_conta():
 
         # Você pode adicionar mais validações aqui (formato do email, força da senha, etc.)
 
-        conn = get_db_connection()
+        conn = conexao_da_requisicao()
         if not conn:
             flash('Error crítico: No fue posible conectar con la base de datos.', 'danger')
             # Em caso de erro grave, talvez redirecionar para login seja melhor
@@ -568,7 +2495,7 @@ def edit_outra_receita(item_id):
         return redirect(redirect_url)
 
     # 5. Conexão com o Banco de Dados
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         flash('Erro: Falha ao conectar com o banco de dados.', 'danger')
         return redirect(redirect_url)
@@ -593,7 +2520,8 @@ def edit_outra_receita(item_id):
 
         query_params = (descricao_form, valor_decimal, categoria_form, data_obj, item_id)
 
-        logging.debug(f"Executando UPDATE Outra Receita: Query={update_query.as_string(conn)} Params={query_params}")
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("Executando UPDATE Outra Receita: Query=%s Params=%s", update_query.as_string(cur), query_params)
         cur.execute(update_query, query_params)
         conn.commit()
 
@@ -633,7 +2561,7 @@ def categorias():
         flash('Erro interno: Informações do usuário incompletas.', 'danger')
         session.clear(); return redirect(url_for('login'))
 
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         flash('Erro de conexão com o banco de dados.', 'danger')
         return render_template('categorias.html', categorias_por_tipo={})
@@ -652,7 +2580,7 @@ def categorias():
         # Calcula o último dia do mês de forma segura
         ultimo_dia_mes = (primeiro_dia_mes + relativedelta(months=1)) - timedelta(days=1)
         
-        logging.info(f"Calculando gastos para o período: {primeiro_dia_mes} a {ultimo_dia_mes}")
+        logging.info("Calculando gastos para o período: %s a %s", primeiro_dia_mes, ultimo_dia_mes)
 
         # 2. Calcular gastos variáveis do mês e agrupar por categoria
         query_gastos_var = sql.SQL("""
@@ -672,14 +2600,9 @@ def categorias():
             WHERE activo = TRUE AND fecha_inicio <= %s
         """).format(schema=sql.Identifier(user_schema))
         cur.execute(query_gastos_fixos, (ultimo_dia_mes,))
-        for gf in cur.fetchall():
-            rrule_params = get_rrule_params(gf['recurrencia'])
-            if rrule_params:
-                occurrences = rrule(dtstart=gf['fecha_inicio'], until=ultimo_dia_mes, **rrule_params)
-                for occ in occurrences:
-                    if occ.date() >= primeiro_dia_mes:
-                        categoria_nome = gf['categoria']
-                        gastos_do_mes[categoria_nome] = gastos_do_mes.get(categoria_nome, Decimal('0.00')) + gf['valor']
+        for gf, _ in expandir_gastos_fixos(cur.fetchall(), primeiro_dia_mes, ultimo_dia_mes, incluir_unicos=False):
+            categoria_nome = gf['categoria']
+            gastos_do_mes[categoria_nome] = gastos_do_mes.get(categoria_nome, Decimal('0.00')) + gf['valor']
         
         # 4. Buscar todas as categorias
         query_categorias = sql.SQL("""
@@ -697,7 +2620,7 @@ def categorias():
             cat_dict['gasto_atual'] = gasto_atual
             lista_categorias_enriquecida.append(cat_dict)
             
-        logging.info(f"Categorias buscadas e enriquecidas para schema {user_schema}: {len(lista_categorias_enriquecida)} encontradas.")
+        logging.info("Categorias buscadas e enriquecidas para schema %s: %d encontradas.", user_schema, len(lista_categorias_enriquecida))
 
     except psycopg2.Error as e:
         flash('Erro ao buscar dados no banco de dados.', 'danger')
@@ -760,7 +2683,7 @@ def add_categoria():
             flash(f'Valor de límite inválido: {e}', 'danger')
             return redirect(redirect_url)
 
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         flash('Erro de conexão com o banco.', 'danger'); return redirect(redirect_url)
 
@@ -838,7 +2761,7 @@ def edit_categoria(categoria_id):
             flash(f'Valor de límite inválido: {e}', 'danger')
             return redirect(redirect_url)
 
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         flash('Erro de conexão.', 'danger'); return redirect(redirect_url)
 
@@ -898,7 +2821,7 @@ def set_limite_categoria(categoria_id):
     # Debug: Log do valor recebido
     logging.info(f"Valor recebido para limite: '{limite_valor_str}' para categoria ID {categoria_id} no schema {user_schema}")
 
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         flash('Erro de conexão.', 'danger'); return redirect(redirect_url)
 
@@ -1000,7 +2923,7 @@ def delete_categoria(categoria_id):
     if not user_schema:
         flash('Erro interno.', 'danger'); session.clear(); return redirect(url_for('login'))
 
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         flash('Erro de conexão.', 'danger'); return redirect(redirect_url)
 
@@ -1135,7 +3058,7 @@ def save_lembrete():
         return redirect(redirect_url)
 
     # Conexão com o banco
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         flash('Erro: Falha ao conectar com o banco de dados.', 'danger')
         return redirect(redirect_url)
@@ -1155,7 +3078,8 @@ def save_lembrete():
             # Parâmetros na ordem correta: descricao, data, valor, repetir, tipo_rep, id
             query_params = (descricao, data_obj, valor_decimal, repetir, tipo_rep, lembrete_id_int)
 
-            logging.debug(f"Executando UPDATE Lembrete: Query={update_query.as_string(conn)} Params={query_params}")
+            if logging.root.isEnabledFor(logging.DEBUG):
+                logging.debug("Executando UPDATE Lembrete: Query=%s Params=%s", update_query.as_string(cur), query_params)
             cur.execute(update_query, query_params)
             conn.commit()
             if cur.rowcount > 0:
@@ -1174,7 +3098,8 @@ def save_lembrete():
             # Parâmetros na ordem correta: descricao, data, valor, repetir, tipo_rep
             query_params = (descricao, data_obj, valor_decimal, repetir, tipo_rep)
 
-            logging.debug(f"Executando INSERT Lembrete: Query={insert_query.as_string(conn)} Params={query_params}")
+            if logging.root.isEnabledFor(logging.DEBUG):
+                logging.debug("Executando INSERT Lembrete: Query=%s Params=%s", insert_query.as_string(cur), query_params)
             cur.execute(insert_query, query_params)
             conn.commit()
             flash('¡Recordatorio agregado con éxito!', 'success')
@@ -1220,7 +3145,7 @@ def delete_outra_receita(item_id):
     logging.info(f"Tentativa de excluir Outra Receita ID {item_id} no schema {user_schema}")
 
     # 4. Conecta ao banco de dados
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         flash('Erro: Falha ao conectar com o banco de dados.', 'danger')
         return redirect(redirect_url)
@@ -1233,7 +3158,8 @@ def delete_outra_receita(item_id):
         delete_query = sql.SQL("DELETE FROM {schema}.outras_receitas WHERE id = %s").format(
             schema=sql.Identifier(user_schema)
         )
-        logging.debug(f"Executando DELETE Outra Receita: Query={delete_query.as_string(conn)} Params={[item_id]}")
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("Executando DELETE Outra Receita: Query=%s Params=%s", delete_query.as_string(cur), [item_id])
         # Executa a query passando o ID como parâmetro
         cur.execute(delete_query, (item_id,))
         # Confirma a transação
@@ -1289,7 +3215,7 @@ def delete_lembrete(item_id):
 
     logging.info(f"Tentativa de excluir Lembrete ID {item_id} no schema {user_schema}")
 
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         flash('Erro: Falha ao conectar com o banco de dados.', 'danger')
         return redirect(redirect_url)
@@ -1300,7 +3226,8 @@ def delete_lembrete(item_id):
         delete_query = sql.SQL("DELETE FROM {schema}.lembretes WHERE id = %s").format(
             schema=sql.Identifier(user_schema)
         )
-        logging.debug(f"Executando DELETE Lembrete: Query={delete_query.as_string(conn)} Params={[item_id]}")
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("Executando DELETE Lembrete: Query=%s Params=%s", delete_query.as_string(cur), [item_id])
         cur.execute(delete_query, (item_id,))
         conn.commit()
 
@@ -1403,7 +3330,7 @@ def edit_gasto(tipo_gasto, item_id):
         flash('Erro: Formato de data inválido.', 'danger')
         return redirect(redirect_url)
     
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         flash('Erro de conexão com o banco de dados.', 'danger')
         return redirect(redirect_url)
@@ -1482,7 +3409,7 @@ def delete_gasto(tipo_gasto, item_id):
         return redirect(url_for('gastos')) # Vai para a página padrão
 
     # 2. Conecta ao banco e executa o DELETE
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         flash('Erro: Falha ao conectar com o banco de dados.', 'danger')
         return redirect(redirect_url)
@@ -1495,7 +3422,8 @@ def delete_gasto(tipo_gasto, item_id):
             schema=sql.Identifier(user_schema),
             table=table_name
         )
-        logging.debug(f"Executando DELETE: Query={delete_query.as_string(conn)} Params={[item_id]}")
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("Executando DELETE: Query=%s Params=%s", delete_query.as_string(cur), [item_id])
         # Executa a query passando o ID como parâmetro
         cur.execute(delete_query, (item_id,))
         # Confirma a transação
@@ -1530,440 +3458,521 @@ def delete_gasto(tipo_gasto, item_id):
 
 
 ITEMS_PER_PAGE = 30
+# ?sort_by= das listagens de /gastos ({alias} e {date_col} dependem do tipo) e /receitas; o primeiro é o padrão.
+# perf/planos_consulta.py monta as consultas das páginas com estas mesmas ordenações.
+ORDENACOES_GASTOS = {
+    'fecha_desc': sql.SQL("{alias}.{date_col} DESC"),
+    'fecha_asc': sql.SQL("{alias}.{date_col} ASC"),
+    'valor_desc': sql.SQL("{alias}.valor DESC"),
+    'valor_asc': sql.SQL("{alias}.valor ASC"),
+    'descricao_asc': sql.SQL("{alias}.descripcion ASC"),
+}
+ORDENACOES_RECEITAS = {
+    'fecha_desc': sql.SQL("ORDER BY fecha DESC, id DESC"),
+    'fecha_asc': sql.SQL("ORDER BY fecha ASC, id ASC"),
+    'valor_desc': sql.SQL("ORDER BY valor DESC, fecha DESC"),
+    'valor_asc': sql.SQL("ORDER BY valor ASC, fecha DESC"),
+    'categoria_asc': sql.SQL("ORDER BY categoria ASC, fecha DESC"),
+}
+
+
+# --- Dados do dashboard com stale-while-revalidate ---
+# O payload que o dashboard monta antes do render_template (dados, metas, categorias, JSON dos gráficos) fica
+# no cache por tenant e dia, com os três períodos juntos (ver plano_dados_dashboard): trocar de período não vai
+# ao banco. Até DASHBOARD_FRESCO_SEGUNDOS (padrão 60) é servido como está; depois,
+# por mais DASHBOARD_GRACA_SEGUNDOS (padrão 600), a requisição recebe o payload antigo na hora e uma thread de
+# fundo o recalcula. Passada a graça ele expira e a requisição recalcula na hora. Só uma revalidação por chave
+# de cada vez (lock local e cache.add entre processos). A chave inclui a versão de cache do tenant: depois de
+# uma escrita o payload antigo não é mais encontrado. Payloads montados com erro, prazo excedido, banco
+# indisponível ou tenant incompleto não entram no cache. DASHBOARD_FRESCO_SEGUNDOS=0 desliga.
+# Com este cache ligado a página do dashboard fica fora do cache de páginas (CACHE_PAGINAS_SEGUNDOS): ela
+# seguiria servindo o payload depois do frescor, e um render com payload velho ganharia mais uma rodada.
+DASHBOARD_FRESCO_SEGUNDOS = int(os.environ.get('DASHBOARD_FRESCO_SEGUNDOS', '60'))
+DASHBOARD_GRACA_SEGUNDOS = int(os.environ.get('DASHBOARD_GRACA_SEGUNDOS', '600'))
+_revalidando = set()
+_revalidando_lock = threading.Lock()
+
+
+def periodo_dashboard(periodo_selecionado, hoje):
+    """(período efetivo, início, fim) a partir do ?periodo= do dashboard."""
+    if periodo_selecionado == '15d':
+        return periodo_selecionado, hoje - timedelta(days=14), hoje
+    if periodo_selecionado == '7d':
+        return periodo_selecionado, hoje - timedelta(days=6), hoje
+    return 'mes_atual', hoje.replace(day=1), hoje  # mes_atual e fallback
+
+
+def payload_dashboard_vazio():
+    return {
+        'dados': {
+            "total_receitas_mes": Decimal('0.00'),
+            "total_despesas_mes": Decimal('0.00'),
+            "saldo_mes": Decimal('0.00'),
+            "movimentacoes_recentes": [],
+            "proximos_lembretes": [],
+            "gastos_categoria_labels": [],
+            "gastos_categoria_data": [],
+            "gastos_fixos_categoria_labels": [],
+            "gastos_fixos_categoria_data": [],
+            "gastos_tempo_labels": [],
+            "gastos_tempo_data": []
+        },
+        'meta_ativa': None,
+        'metas_ativas': [],
+        'categorias_por_tipo': {
+            'receita': [],
+            'gasto_variavel': [],
+            'gasto_fixo': []
+        },
+        'metodos_pagamento_disponiveis': [],
+        'gastos_fixos_ativos': [],
+        'dados_json': None,
+    }
+
 
+def json_dados_dashboard(dados, gastos_metodo_labels=(), gastos_metodo_data=()):
+    return json.dumps({
+        "gastos_categoria_labels": dados['gastos_categoria_labels'],
+        "gastos_categoria_data": dados['gastos_categoria_data'],
+        "gastos_fixos_categoria_labels": dados.get('gastos_fixos_categoria_labels', []),
+        "gastos_fixos_categoria_data": dados.get('gastos_fixos_categoria_data', []),
+        "gastos_tempo_labels": dados['gastos_tempo_labels'],
+        "gastos_tempo_data": dados['gastos_tempo_data'],
+        "gastos_fixos_tempo_data": dados.get('gastos_fixos_tempo_data', []),
+        "gastos_metodo_labels": list(gastos_metodo_labels),
+        "gastos_metodo_data": list(gastos_metodo_data)
+    }, default=json_converter)
+
+
+def chave_dados_dashboard(user_schema, hoje):
+    return f"dashboard_dados/{user_schema}/{versao_cache_tenant(user_schema)}/{hoje.isoformat()}"
+
+
+def buscar_dados_dashboard(user_schema, hoje):
+    """(chave, payloads, estado) do cache; payload velho dispara a revalidação em segundo plano."""
+    chave = chave_dados_dashboard(user_schema, hoje)
+    payloads, estado = consultar_dados_dashboard(chave)
+    if estado == 'velho':
+        revalidar_dados_dashboard(chave, user_schema)
+    return chave, payloads, estado
+
+
+def consultar_dados_dashboard(chave):
+    """({periodo: payload}, 'fresco' | 'velho') do cache, ou (None, None) se não houver ou já tiver expirado."""
+    if DASHBOARD_FRESCO_SEGUNDOS <= 0:
+        return None, None
+    entrada = cache.get(chave)
+    if entrada is None:
+        return None, None
+    idade = time.time() - entrada['gerado_em']
+    if idade < DASHBOARD_FRESCO_SEGUNDOS:
+        return entrada['payloads'], 'fresco'
+    if idade < DASHBOARD_FRESCO_SEGUNDOS + DASHBOARD_GRACA_SEGUNDOS:
+        return entrada['payloads'], 'velho'
+    return None, None
+
+
+def dashboard_nao_cacheavel():
+    return DASHBOARD_FRESCO_SEGUNDOS > 0 or pagina_nao_cacheavel()
+
+
+def guardar_dados_dashboard(chave, payloads):
+    if DASHBOARD_FRESCO_SEGUNDOS <= 0 or g.get('prazo_excedido') or g.get('banco_indisponivel') or g.get('tenant_indisponivel'):
+        return
+    if g.get('grupo_opcional_falhou'):  # payload parcial: o próximo acesso recalcula
+        return
+    cache.set(chave, {'payloads': payloads, 'gerado_em': time.time()},
+              timeout=DASHBOARD_FRESCO_SEGUNDOS + DASHBOARD_GRACA_SEGUNDOS)
+
+
+def revalidar_dados_dashboard(chave, user_schema, em_segundo_plano=True):
+    """
+    Recalcula a chave numa thread de fundo (ou aqui mesmo, com em_segundo_plano=False), se ninguém neste
+    ou noutro processo já estiver recalculando. Devolve False se já havia um recálculo em andamento.
+    """
+    with _revalidando_lock:
+        if chave in _revalidando:
+            return False
+        _revalidando.add(chave)
+    prazo = getattr(app.view_functions['dashboard'], 'prazo_segundos', PRAZO_PADRAO_SEGUNDOS)
+    if not cache.add(f"{chave}/revalidando", os.getpid(), timeout=ceil(prazo) + 1):
+        with _revalidando_lock:
+            _revalidando.discard(chave)
+        return False
+    if not em_segundo_plano:
+        recalcular_dados_dashboard(chave, user_schema, prazo)
+        return True
+    threading.Thread(target=recalcular_dados_dashboard, args=(chave, user_schema, prazo),
+                     name='revalidar-dashboard', daemon=True).start()
+    return True
+
+
+def recalcular_dados_dashboard(chave, user_schema, prazo):
+    inicio = time.perf_counter()
+    try:
+        # Mesma checagem do verificar_tenant(): schema incompleto não tem payload a calcular
+        registro = registro_tenants.obter(user_schema)
+        if registro is not None and registro.faltando(REQUISITOS_TENANT.get('dashboard', {})):
+            logging.info("Recálculo do dashboard de %s pulado: schema incompleto", user_schema)
+            return
+        # Contexto próprio: a requisição original já respondeu. O teardown fecha a unidade de trabalho.
+        with app.test_request_context('/dashboard'):
+            session['user_schema'] = user_schema
+            g.prazo = time.monotonic() + prazo
+            payloads = conduzir_plano(plano_dados_dashboard(user_schema, date.today()), executar_lote_da_requisicao)
+            guardar_dados_dashboard(chave, payloads)
+        incrementar_metrica('dashboard_swr', 'revalidacoes')
+        logging.info("Dashboard de %s revalidado em segundo plano em %.0fms", user_schema, (time.perf_counter() - inicio) * 1000)
+    except Exception as e:
+        incrementar_metrica('dashboard_swr', 'revalidacoes_falhas')
+        logging.warning("Revalidação do dashboard de %s falhou (o payload antigo segue até expirar): %s", user_schema, e)
+    finally:
+        cache.delete(f"{chave}/revalidando")
+        with _revalidando_lock:
+            _revalidando.discard(chave)
 
-@app.route('/dashboard')
-@cache.cached(timeout=300)  # Cache for 5 minutes
-def dashboard():
-    if 'user_assinatura_id' not in session:
-        flash('Você precisa fazer login para acessar esta página.', 'warning')
-        return redirect(url_for('login'))
 
-    user_schema = session.get('user_schema')
-    user_nome = session.get('user_nome', session.get('user_email'))
+PERIODOS_DASHBOARD = ('mes_atual', '15d', '7d')
 
-    if not user_schema:
-        logging.error(f"Schema não encontrado na sessão para usuário {user_nome} (ID: {session.get('user_assinatura_id')}) ao acessar /dashboard. Deslogando.")
-        flash('Erro interno: Informações do usuário incompletas. Por favor, faça login novamente.', 'danger')
-        session.clear()
-        return redirect(url_for('login'))
 
-    # --- INÍCIO DA LÓGICA DE SELEÇÃO DE PERÍODO ---
-    periodo_selecionado = request.args.get('periodo', 'mes_atual')
-    hoje = date.today()
-    data_fim_periodo = hoje
-
-    if periodo_selecionado == 'mes_atual':
-        data_inicio_periodo = hoje.replace(day=1)
-    elif periodo_selecionado == '15d':
-        data_inicio_periodo = hoje - timedelta(days=14)
-    elif periodo_selecionado == '7d':
-        data_inicio_periodo = hoje - timedelta(days=6)
-    else: # Fallback
-        periodo_selecionado = 'mes_atual'
-        data_inicio_periodo = hoje.replace(day=1)
-
-    logging.info(f"Acessando dashboard: Schema {user_schema}, Período: {periodo_selecionado} ({data_inicio_periodo} a {data_fim_periodo})")
-    # --- FIM DA LÓGICA DE SELEÇÃO DE PERÍODO ---
-
-    dados = {
-        "total_receitas_mes": Decimal('0.00'),
-        "total_despesas_mes": Decimal('0.00'),
-        "saldo_mes": Decimal('0.00'),
-        "movimentacoes_recentes": [],
-        "proximos_lembretes": [],
-        "gastos_categoria_labels": [],
-        "gastos_categoria_data": [],
-        "gastos_fixos_categoria_labels": [],
-        "gastos_fixos_categoria_data": [],
-        "gastos_tempo_labels": [],
-        "gastos_tempo_data": []
-    }
-    meta_ativa = None
+def plano_dados_dashboard(user_schema, hoje):
+    """
+    Plano (ver plano_leitura) que monta o payload dos três períodos do dashboard numa passada só. Todas as
+    janelas terminam hoje, então as linhas que dependem do período vêm uma vez para a união delas (do início
+    mais antigo até hoje) e cada período é recortado em Python. Devolve {periodo: payload}; erros de banco
+    saem para quem conduz.
+    """
+    inicios = {periodo: periodo_dashboard(periodo, hoje)[1] for periodo in PERIODOS_DASHBOARD}
+    inicio_uniao = min(inicios.values())
+    uniao = (inicio_uniao, hoje)
+    schema = sql.Identifier(user_schema)
     categorias_por_tipo = {
         'receita': [],
         'gasto_variavel': [],
         'gasto_fixo': []
     }
-    metodos_pagamento_disponiveis = []
 
-    conn = get_db_connection()
-    if not conn:
-        flash('Erro de conexão com o banco ao carregar dashboard.', 'danger')
-        dados_json_string = json.dumps({
-            "gastos_categoria_labels": [], "gastos_categoria_data": [],
-            "gastos_tempo_labels": [], "gastos_tempo_data": []
-        }, default=json_converter)
-        return render_template('dashboard.html', user_nome=user_nome, dados=dados, meta_ativa=meta_ativa,
-                               dados_json=dados_json_string, categorias_por_tipo=categorias_por_tipo,
-                               periodo_ativo=periodo_selecionado) # Passa periodo_ativo no fallback
-
-    cur = None
-    try:
-        cur = conn.cursor(cursor_factory=DictCursor)
-
-        for tipo_cat_loop in categorias_por_tipo.keys():
-            categorias_por_tipo[tipo_cat_loop] = buscar_categorias_por_tipo(conn, user_schema, tipo_cat_loop)
-        
+    # Consultas independentes entre si: rodam em paralelo (ver plano_leitura) e o processamento
+    # abaixo só usa os resultados.
+    grupos = {
+        'categorias': grupo_categorias(user_schema, list(categorias_por_tipo)),
         # Buscar métodos de pagamento ativos para os formulários
-        metodos_pagamento_disponiveis = buscar_metodos_pagamento_ativos(conn, user_schema)
-
-        # --- Buscar Dados Financeiros para o PERÍODO SELECIONADO ---
-        
-        # Inicializar variáveis importantes
-        gastos_fixos_ativos = []
-        gastos_metodo_labels = []
-        gastos_metodo_data = []
-        
-        # Gerar lista de dias no período
-        dias_no_periodo_list = []
-        if data_inicio_periodo <= data_fim_periodo:
-            query_dias = sql.SQL("SELECT generate_series(%s::date, %s::date, '1 day'::interval)::date as dia")
-            cur.execute(query_dias, (data_inicio_periodo, data_fim_periodo))
-            dias_no_periodo_list = [r['dia'] for r in cur.fetchall()]
-
-        # 1. Receitas do Período (Salário da config já foi removido)
-        soma_outras_receitas_periodo = Decimal('0.00')
-        query_soma_outras_receitas = sql.SQL(
-            "SELECT COALESCE(SUM(valor), 0) as total_outras_receitas FROM {schema}.outras_receitas "
-            "WHERE fecha BETWEEN %s AND %s"
-        ).format(schema=sql.Identifier(user_schema))
-        cur.execute(query_soma_outras_receitas, (data_inicio_periodo, data_fim_periodo))
-        outras_receitas_result = cur.fetchone()
-        if outras_receitas_result and outras_receitas_result['total_outras_receitas'] is not None:
-            soma_outras_receitas_periodo = outras_receitas_result['total_outras_receitas']
-
-        dados['total_receitas_mes'] = soma_outras_receitas_periodo
-
-        # 2. Gastos Variáveis do Período
-        total_gastos_variaveis_periodo = Decimal('0.00')
-        query_total_gastos_variaveis = sql.SQL(
-            "SELECT COALESCE(SUM(valor), 0) as total_gastos_mes FROM {schema}.gastos "
-            "WHERE data BETWEEN %s AND %s"
-        ).format(schema=sql.Identifier(user_schema))
-        cur.execute(query_total_gastos_variaveis, (data_inicio_periodo, data_fim_periodo))
-        total_gastos_var_result = cur.fetchone()
-        if total_gastos_var_result and total_gastos_var_result['total_gastos_mes'] is not None:
-            total_gastos_variaveis_periodo = total_gastos_var_result['total_gastos_mes']
-
-        # 3. Calcular Total de Gastos Fixos do Período
-        total_gastos_fixos_periodo = Decimal('0.00')
-        query_base_fixos_dash = sql.SQL(
-            "SELECT id, fecha_inicio, valor, recurrencia FROM {schema}.gastos_fixos "
-            "WHERE activo = TRUE AND fecha_inicio <= %s" 
-        ).format(schema=sql.Identifier(user_schema))
-        cur.execute(query_base_fixos_dash, (data_fim_periodo,))
-        gastos_fixos_ativos_para_periodo = cur.fetchall()
-
-        for gf_fixo in gastos_fixos_ativos_para_periodo:
-            rrule_params = get_rrule_params(gf_fixo['recurrencia'])
-            if rrule_params:
-                try:
-                    dtstart_gf_fixo = gf_fixo['fecha_inicio']
-                    if isinstance(dtstart_gf_fixo, datetime):
-                        dtstart_gf_fixo = dtstart_gf_fixo.date()
-
-                    occurrences = list(rrule(dtstart=dtstart_gf_fixo, until=data_fim_periodo, **rrule_params))
-                    for occ_dt in occurrences:
-                        occ_date = occ_dt.date()
-                        if data_inicio_periodo <= occ_date <= data_fim_periodo:
-                            total_gastos_fixos_periodo += gf_fixo['valor']
-                except Exception as e_rrule:
-                    logging.error(f"Dashboard Gasto Fixo ID {gf_fixo['id']} rrule error: {e_rrule} para o período {data_inicio_periodo} a {data_fim_periodo}")
-            else: 
-                if gf_fixo['recurrencia'].lower().strip() in ['unico', 'único', 'única']:
-                    if data_inicio_periodo <= gf_fixo['fecha_inicio'] <= data_fim_periodo:
-                        total_gastos_fixos_periodo += gf_fixo['valor']
-
-        logging.info(f"Dashboard: Gastos Fixos (período {data_inicio_periodo}-{data_fim_periodo}): {total_gastos_fixos_periodo}")
-
-        # 4. Calcular Totais e Saldo para o período
-        dados['total_despesas_mes'] = total_gastos_variaveis_periodo + total_gastos_fixos_periodo
-        dados['saldo_mes'] = dados['total_receitas_mes'] - dados['total_despesas_mes']
-        
-        # 5. Calcular limite diário para poupança (70% das receitas dividido por 30 dias)
-        if dados['total_receitas_mes'] > 0:
-            dados['limite_diario_poupanca'] = (dados['total_receitas_mes'] * Decimal('0.7')) / Decimal('30')
-        else:
-            dados['limite_diario_poupanca'] = Decimal('0.00')
-
-        # --- Buscar Movimentações Recentes (Mantido como antes - os últimos X, independente do período do card) ---
-        movimentacoes = []
-        query_gastos_ultimos = sql.SQL(
+        'metodos_pagamento': grupo_metodos_pagamento(user_schema),
+        # Por dia na união das janelas: totais, gráficos por categoria/método e séries diárias de cada período
+        'receitas_por_dia': GrupoConsulta(sql.SQL(
+            "SELECT fecha AS dia, SUM(valor) AS total FROM {schema}.outras_receitas "
+            "WHERE fecha BETWEEN %s AND %s GROUP BY fecha"
+        ).format(schema=schema), uniao),
+        'gastos_por_dia': GrupoConsulta(sql.SQL(
+            "SELECT data AS dia, categoria, SUM(valor) AS total FROM {schema}.gastos "
+            "WHERE data BETWEEN %s AND %s GROUP BY data, categoria"
+        ).format(schema=schema), uniao),
+        'gastos_metodo_por_dia': GrupoConsulta(sql.SQL("""
+            SELECT
+                g.data AS dia,
+                COALESCE(mp.nome, 'Sin Método Especificado') as metodo_nome,
+                SUM(g.valor) as total_gasto
+            FROM {schema}.gastos g
+            LEFT JOIN {schema}.metodos_pagamento mp ON g.metodo_pagamento_id = mp.id
+            WHERE g.data BETWEEN %s AND %s
+            GROUP BY g.data, mp.nome
+        """).format(schema=schema), uniao, opcional=True),
+        # A mesma base de gastos fixos atende o total, o gráfico por categoria e a série diária
+        'gastos_fixos_base': GrupoConsulta(sql.SQL(
+            "SELECT id, categoria, fecha_inicio, valor, recurrencia FROM {schema}.gastos_fixos "
+            "WHERE activo = TRUE AND fecha_inicio <= %s"
+        ).format(schema=schema), (hoje,)),
+        'ultimos_gastos': GrupoConsulta(sql.SQL(
             "SELECT id, data, descripcion, valor, categoria FROM {schema}.gastos "
             "ORDER BY data DESC, id DESC LIMIT 3"
-        ).format(schema=sql.Identifier(user_schema))
-        cur.execute(query_gastos_ultimos)
-        ultimos_gastos = cur.fetchall()
-        for g_mov in ultimos_gastos:
-            movimentacoes.append({
-                'id': g_mov['id'], 'data': g_mov['data'], 'descricao': g_mov['descripcion'],
-                'valor': g_mov['valor'], 'categoria': g_mov['categoria'], 'tipo_movimentacao': 'gasto_variavel'
-            })
-
-        query_gastos_fixos_ultimos = sql.SQL(
+        ).format(schema=schema)),
+        'ultimos_gastos_fixos': GrupoConsulta(sql.SQL(
             "SELECT id, fecha_inicio as data, descripcion, valor, categoria FROM {schema}.gastos_fixos "
             "WHERE activo = TRUE ORDER BY fecha_inicio DESC, id DESC LIMIT 2"
-        ).format(schema=sql.Identifier(user_schema))
-        cur.execute(query_gastos_fixos_ultimos)
-        ultimos_gastos_fixos = cur.fetchall()
-        for gf_mov in ultimos_gastos_fixos:
-            movimentacoes.append({
-                'id': gf_mov['id'], 'data': gf_mov['data'], 'descricao': gf_mov['descripcion'],
-                'valor': gf_mov['valor'], 'categoria': gf_mov['categoria'], 'tipo_movimentacao': 'gasto_fixo'
-            })
-
-        query_receitas_ultimas = sql.SQL(
+        ).format(schema=schema)),
+        'ultimas_receitas': GrupoConsulta(sql.SQL(
             "SELECT id, fecha as data, descripcion, valor, categoria FROM {schema}.outras_receitas "
             "ORDER BY fecha DESC, id DESC LIMIT 2"
-        ).format(schema=sql.Identifier(user_schema))
-        cur.execute(query_receitas_ultimas)
-        ultimas_outras_receitas = cur.fetchall()
-        for r_mov in ultimas_outras_receitas:
-            movimentacoes.append({
-                'id': r_mov['id'], 'data': r_mov['data'], 'descricao': r_mov['descripcion'],
-                'valor': r_mov['valor'], 'categoria': r_mov['categoria'], 'tipo_movimentacao': 'receita'
-            })
-        # Filtrar movimientos sin fecha y ordenar
-        movimentacoes = [m for m in movimentacoes if m.get('data') is not None]
-        movimentacoes.sort(key=lambda x: x['data'], reverse=True)
-        dados['movimentacoes_recentes'] = movimentacoes[:5]
-
-        # --- Buscar Próximos Lembretes (Não depende do período do card) ---
-        query_lembretes_dashboard = sql.SQL(
+        ).format(schema=schema)),
+        'lembretes': GrupoConsulta(sql.SQL(
             "SELECT id, descripcion, data, valor FROM {schema}.lembretes "
             "WHERE data >= CURRENT_DATE ORDER BY data ASC LIMIT 5"
-        ).format(schema=sql.Identifier(user_schema))
-        cur.execute(query_lembretes_dashboard)
-        dados['proximos_lembretes'] = [dict(l_rem) for l_rem in cur.fetchall()]
-
-        # --- Buscar Dados para Gráficos ---
-        # Gráfico de Gastos por Categoria (MANTIDO MENSAL POR SIMPLICIDADE INICIAL)
-        query_gastos_cat_chart = sql.SQL("""
-            SELECT categoria, SUM(valor) as total 
-            FROM {schema}.gastos
-            WHERE data BETWEEN %(data_inicio)s AND %(data_fim)s
-            AND categoria IS NOT NULL 
-            GROUP BY categoria 
-            ORDER BY total DESC
-        """).format(schema=sql.Identifier(user_schema))
-        cur.execute(query_gastos_cat_chart, {'data_inicio': data_inicio_periodo, 'data_fim': data_fim_periodo})
-        gastos_por_categoria_chart = cur.fetchall()
-        dados['gastos_categoria_labels'] = [g_cat['categoria'] for g_cat in gastos_por_categoria_chart]
-        dados['gastos_categoria_data'] = [g_cat['total'] for g_cat in gastos_por_categoria_chart]
+        ).format(schema=schema)),
+        'metas': GrupoConsulta(sql.SQL(
+            "SELECT * FROM {schema}.metas WHERE status = 'ativa' ORDER BY criado_em DESC"
+        ).format(schema=schema), opcional=True),
+        'gastos_fixos_proximos': GrupoConsulta(sql.SQL(
+            "SELECT id, fecha_inicio, descripcion, categoria, valor, recurrencia FROM {schema}.gastos_fixos "
+            "WHERE activo = TRUE ORDER BY fecha_inicio ASC"
+        ).format(schema=schema), opcional=True),
+    }
+    # Categorias, métodos, metas, gráfico por método e próximos gastos fixos são opcionais
+    # ("melhor esforço", como antes): falham sem derrubar a página
+    resultados = yield grupos
+
+    categorias_por_tipo.update(resultados['categorias'] or {})
+    metodos_pagamento_disponiveis = resultados['metodos_pagamento'] or []
+
+    # --- Partes que não dependem do período ---
+    # Movimentações recentes (os últimos X, independente do período do card)
+    movimentacoes = []
+    for g_mov in resultados['ultimos_gastos']:
+        movimentacoes.append({
+            'id': g_mov['id'], 'data': g_mov['data'], 'descricao': g_mov['descripcion'],
+            'valor': g_mov['valor'], 'categoria': g_mov['categoria'], 'tipo_movimentacao': 'gasto_variavel'
+        })
+
+    for gf_mov in resultados['ultimos_gastos_fixos']:
+        movimentacoes.append({
+            'id': gf_mov['id'], 'data': gf_mov['data'], 'descricao': gf_mov['descripcion'],
+            'valor': gf_mov['valor'], 'categoria': gf_mov['categoria'], 'tipo_movimentacao': 'gasto_fixo'
+        })
+
+    for r_mov in resultados['ultimas_receitas']:
+        movimentacoes.append({
+            'id': r_mov['id'], 'data': r_mov['data'], 'descricao': r_mov['descripcion'],
+            'valor': r_mov['valor'], 'categoria': r_mov['categoria'], 'tipo_movimentacao': 'receita'
+        })
+    # Filtrar movimientos sin fecha y ordenar
+    movimentacoes = [m for m in movimentacoes if m.get('data') is not None]
+    movimentacoes.sort(key=lambda x: x['data'], reverse=True)
+    movimentacoes_recentes = movimentacoes[:5]
+
+    proximos_lembretes = [dict(l_rem) for l_rem in resultados['lembretes']]
+
+    metas_ativas = resultados['metas'] or []
+    # Para compatibilidade com o template existente, mantém meta_ativa como a primeira
+    meta_ativa = metas_ativas[0] if metas_ativas else None
+
+    # Gastos Fijos Activos para el gráfico de próximos gastos (lista de dicionários para serialização JSON)
+    gastos_fixos_ativos = []
+    for gf in resultados['gastos_fixos_proximos'] or []:
+        gastos_fixos_ativos.append({
+            'id': gf['id'],
+            'fecha_inicio': gf['fecha_inicio'].isoformat() if gf['fecha_inicio'] else None,
+            'descripcion': gf['descripcion'],
+            'categoria': gf['categoria'],
+            'valor': float(gf['valor']) if gf['valor'] else 0,
+            'recurrencia': gf['recurrencia']
+        })
+
+    # --- Dados por dia na união das janelas ---
+    gastos_fixos_base = resultados['gastos_fixos_base']
+    ocorrencias_fixos = list(expandir_gastos_fixos(gastos_fixos_base, inicio_uniao, hoje))
+    receitas_por_dia = resultados['receitas_por_dia']
+    gastos_por_dia = resultados['gastos_por_dia']
+    gastos_metodo_por_dia = resultados['gastos_metodo_por_dia'] or []
+
+    payloads = {}
+    for periodo, data_inicio_periodo in inicios.items():
+        verificar_prazo()
+        dias_no_periodo = [data_inicio_periodo + timedelta(days=i) for i in range((hoje - data_inicio_periodo).days + 1)]
+
+        # 1. Receitas do Período (Salário da config já foi removido)
+        total_receitas = sum((r['total'] for r in receitas_por_dia if r['dia'] >= data_inicio_periodo), Decimal('0.00'))
+
+        # 2. Gastos Variáveis do Período: total, por categoria e por dia
+        gastos_variaveis_por_dia = defaultdict(Decimal)
+        gastos_por_categoria = defaultdict(Decimal)
+        for linha in gastos_por_dia:
+            if linha['dia'] >= data_inicio_periodo:
+                gastos_variaveis_por_dia[linha['dia']] += linha['total']
+                if linha['categoria'] is not None:
+                    gastos_por_categoria[linha['categoria']] += linha['total']
+        total_gastos_variaveis = sum(gastos_variaveis_por_dia.values(), Decimal('0.00'))
+
+        # 3. Gastos Fixos do Período: total, por categoria e por dia
+        gastos_fixos_por_dia = defaultdict(Decimal)
+        gastos_fixos_por_categoria = {gf['categoria']: Decimal('0.00') for gf in gastos_fixos_base if gf['categoria'] is not None}
+        for gf, occ_date in ocorrencias_fixos:
+            if occ_date >= data_inicio_periodo:
+                gastos_fixos_por_dia[occ_date] += gf['valor']
+                if gf['categoria'] is not None:
+                    gastos_fixos_por_categoria[gf['categoria']] += gf['valor']
+        total_gastos_fixos = sum(gastos_fixos_por_dia.values(), Decimal('0.00'))
+
+        # 4. Totais, saldo e limite diário para poupança (70% das receitas dividido por 30 dias)
+        dados = {
+            "total_receitas_mes": total_receitas,
+            "total_despesas_mes": total_gastos_variaveis + total_gastos_fixos,
+            "movimentacoes_recentes": movimentacoes_recentes,
+            "proximos_lembretes": proximos_lembretes,
+        }
+        dados['saldo_mes'] = dados['total_receitas_mes'] - dados['total_despesas_mes']
+        if dados['total_receitas_mes'] > 0:
+            dados['limite_diario_poupanca'] = (dados['total_receitas_mes'] * Decimal('0.7')) / Decimal('30')
+        else:
+            dados['limite_diario_poupanca'] = Decimal('0.00')
+
+        # --- Dados para Gráficos ---
+        categorias_ordenadas = sorted(gastos_por_categoria.items(), key=lambda x: x[1], reverse=True)
+        dados['gastos_categoria_labels'] = [cat for cat, _ in categorias_ordenadas]
+        dados['gastos_categoria_data'] = [val for _, val in categorias_ordenadas]
 
-        # Gráfico de Gastos Fixos por Categoria (baseado no período selecionado)
-        gastos_fixos_por_categoria_periodo = {}
-        
-        # Buscar gastos fixos ativos para calcular por categoria no período
-        query_gastos_fixos_periodo_cat = sql.SQL("""
-            SELECT id, categoria, valor, fecha_inicio, recurrencia 
-            FROM {schema}.gastos_fixos 
-            WHERE activo = TRUE AND fecha_inicio <= %s
-            AND categoria IS NOT NULL
-        """).format(schema=sql.Identifier(user_schema))
-        cur.execute(query_gastos_fixos_periodo_cat, (data_fim_periodo,))
-        gastos_fixos_ativos_cat = cur.fetchall()
-        
-        logging.info(f"Processando {len(gastos_fixos_ativos_cat)} gastos fixos para categoria no período {data_inicio_periodo} - {data_fim_periodo}")
-        
-        for gf_cat in gastos_fixos_ativos_cat:
-            categoria_gf = gf_cat['categoria']
-            if categoria_gf not in gastos_fixos_por_categoria_periodo:
-                gastos_fixos_por_categoria_periodo[categoria_gf] = Decimal('0.00')
-                
-            rrule_params = get_rrule_params(gf_cat['recurrencia'])
-            if rrule_params:
-                try:
-                    dtstart_gf_cat = gf_cat['fecha_inicio']
-                    if isinstance(dtstart_gf_cat, datetime):
-                        dtstart_gf_cat = dtstart_gf_cat.date()
-
-                    occurrences = list(rrule(dtstart=dtstart_gf_cat, until=data_fim_periodo, **rrule_params))
-                    for occ_dt in occurrences:
-                        occ_date = occ_dt.date()
-                        if data_inicio_periodo <= occ_date <= data_fim_periodo:
-                            gastos_fixos_por_categoria_periodo[categoria_gf] += gf_cat['valor']
-                            logging.debug(f"Gasto fixo ID {gf_cat['id']} categoria {categoria_gf}: +{gf_cat['valor']} em {occ_date}")
-                except Exception as e_rrule:
-                    logging.error(f"Dashboard Gasto Fixo Categoria ID {gf_cat.get('id', 'N/A')} rrule error: {e_rrule}")
-            else:
-                if gf_cat['recurrencia'].lower().strip() in ['unico', 'único', 'única']:
-                    if data_inicio_periodo <= gf_cat['fecha_inicio'] <= data_fim_periodo:
-                        gastos_fixos_por_categoria_periodo[categoria_gf] += gf_cat['valor']
-                        logging.debug(f"Gasto fixo único ID {gf_cat['id']} categoria {categoria_gf}: +{gf_cat['valor']} em {gf_cat['fecha_inicio']}")
-        
         # Ordenar por valor total e filtrar valores maiores que zero
-        gastos_fixos_ordenados = sorted(gastos_fixos_por_categoria_periodo.items(), key=lambda x: x[1], reverse=True)
+        gastos_fixos_ordenados = sorted(gastos_fixos_por_categoria.items(), key=lambda x: x[1], reverse=True)
         dados['gastos_fixos_categoria_labels'] = [cat for cat, val in gastos_fixos_ordenados if val > 0]
         dados['gastos_fixos_categoria_data'] = [float(val) for cat, val in gastos_fixos_ordenados if val > 0]
-        
-        logging.info(f"Gastos fixos por categoria (período): {len(dados['gastos_fixos_categoria_labels'])} categorias encontradas com valores: {dict(zip(dados['gastos_fixos_categoria_labels'], dados['gastos_fixos_categoria_data']))}")
-
-        # Gráfico de Gastos ao Longo do Tempo (AGORA USA O PERÍODO SELECIONADO)
-        query_gastos_tempo_chart = sql.SQL(
-            "SELECT dias.dia::date, COALESCE(SUM(g.valor), 0) as total_gasto "
-            "FROM generate_series(%s::date, %s::date, '1 day'::interval) AS dias(dia) "
-            "LEFT JOIN {schema}.gastos g ON dias.dia = g.data " # APENAS GASTOS VARIÁVEIS
-            "GROUP BY dias.dia ORDER BY dias.dia ASC"
-        ).format(schema=sql.Identifier(user_schema))
-        cur.execute(query_gastos_tempo_chart, (data_inicio_periodo, data_fim_periodo))
-        gastos_ultimos_dias_chart = cur.fetchall()
-        dados['gastos_tempo_labels'] = [d_chart['dia'].strftime('%d/%m') for d_chart in gastos_ultimos_dias_chart]
-        dados['gastos_tempo_data'] = [d_chart['total_gasto'] for d_chart in gastos_ultimos_dias_chart]
-
-        # Calcular gastos fixos por dia para o mesmo período
-        gastos_fixos_por_dia = {}
-        for dia in dias_no_periodo_list:
-            gastos_fixos_por_dia[dia] = Decimal('0.00')
-
-        # Query para buscar gastos fixos ativos no período
-        query_gastos_fixos_periodo = sql.SQL(
-            "SELECT id, fecha_inicio, valor, recurrencia FROM {schema}.gastos_fixos "
-            "WHERE activo = TRUE AND fecha_inicio <= %s"
-        ).format(schema=sql.Identifier(user_schema))
-        cur.execute(query_gastos_fixos_periodo, (data_fim_periodo,))
-        gastos_fixos_periodo = cur.fetchall()
-
-        for gf in gastos_fixos_periodo:
-            rrule_params = get_rrule_params(gf['recurrencia'])
-            if rrule_params:
-                try:
-                    dtstart_gf = gf['fecha_inicio']
-                    if isinstance(dtstart_gf, datetime):
-                        dtstart_gf = dtstart_gf.date()
-
-                    occurrences = list(rrule(dtstart=dtstart_gf, until=data_fim_periodo, **rrule_params))
-                    for occ_dt in occurrences:
-                        occ_date = occ_dt.date()
-                        if data_inicio_periodo <= occ_date <= data_fim_periodo:
-                            gastos_fixos_por_dia[occ_date] += gf['valor']
-                except Exception as e_rrule:
-                    logging.error(f"Dashboard Gasto Fixo Tempo ID {gf['id']} rrule error: {e_rrule}")
-            else:
-                if gf['recurrencia'].lower().strip() in ['unico', 'único', 'única']:
-                    if data_inicio_periodo <= gf['fecha_inicio'] <= data_fim_periodo:
-                        gastos_fixos_por_dia[gf['fecha_inicio']] += gf['valor']
-
-        # Converter dados de gastos fixos para a mesma ordem dos labels
-        dados['gastos_fixos_tempo_data'] = []
-        if dados.get('gastos_tempo_labels'):
-            for label in dados['gastos_tempo_labels']:
-                dia_str = label + '/' + str(data_inicio_periodo.year)
-                try:
-                    dia_obj = datetime.strptime(dia_str, '%d/%m/%Y').date()
-                    dados['gastos_fixos_tempo_data'].append(gastos_fixos_por_dia.get(dia_obj, Decimal('0.00')))
-                except ValueError:
-                    dados['gastos_fixos_tempo_data'].append(Decimal('0.00'))
-
-        # --- Buscar Metas Ativas (Não depende do período do card) ---
-        metas_ativas = []
-        meta_ativa = None
-        try:
-            query_metas_ativas = sql.SQL(
-                "SELECT * FROM {schema}.metas WHERE status = 'ativa' ORDER BY criado_em DESC"
-            ).format(schema=sql.Identifier(user_schema))
-            cur.execute(query_metas_ativas)
-            metas_ativas = cur.fetchall()
-            
-            # Para compatibilidade com o template existente, mantém meta_ativa como a primeira
-            meta_ativa = metas_ativas[0] if metas_ativas else None
-        except Exception as e:
-            logging.error(f"Erro ao buscar metas ativas: {e}")
-            metas_ativas = []
-            meta_ativa = None
-
-        # --- Buscar Gastos por Método de Pagamento para Gráfico (usando período selecionado) ---
-        gastos_metodo_labels = []
-        gastos_metodo_data = []
-        try:
-            query_gastos_metodo_chart = sql.SQL("""
-                SELECT 
-                    COALESCE(mp.nome, 'Sin Método Especificado') as metodo_nome,
-                    SUM(g.valor) as total_gasto
-                FROM {schema}.gastos g
-                LEFT JOIN {schema}.metodos_pagamento mp ON g.metodo_pagamento_id = mp.id
-                WHERE g.data BETWEEN %s AND %s
-                GROUP BY mp.nome
-                HAVING SUM(g.valor) > 0
-                ORDER BY total_gasto DESC
-            """).format(schema=sql.Identifier(user_schema))
-            cur.execute(query_gastos_metodo_chart, (data_inicio_periodo, data_fim_periodo))
-            gastos_por_metodo_chart = cur.fetchall()
-            
-            gastos_metodo_labels = [item['metodo_nome'] for item in gastos_por_metodo_chart]
-            gastos_metodo_data = [item['total_gasto'] for item in gastos_por_metodo_chart]
-            
-            logging.info(f"Gastos por método de pagamento encontrados para período {periodo_selecionado}: {len(gastos_por_metodo_chart)} métodos")
-        except Exception as e:
-            logging.error(f"Error al buscar gastos por método de pagamento: {e}")
-            gastos_metodo_labels = []
-            gastos_metodo_data = []
 
-        # --- Buscar Gastos Fijos Activos para el gráfico de próximos gastos ---
-        try:
-            query_gastos_fixos_proximos = sql.SQL(
-                "SELECT id, fecha_inicio, descripcion, categoria, valor, recurrencia FROM {schema}.gastos_fixos "
-                "WHERE activo = TRUE ORDER BY fecha_inicio ASC"
-            ).format(schema=sql.Identifier(user_schema))
-            cur.execute(query_gastos_fixos_proximos)
-            gastos_fixos_raw = cur.fetchall()
-            
-            # Converter para lista de dicionários para serialização JSON
-            gastos_fixos_ativos = []
-            for gf in gastos_fixos_raw:
-                gastos_fixos_ativos.append({
-                    'id': gf['id'],
-                    'fecha_inicio': gf['fecha_inicio'].isoformat() if gf['fecha_inicio'] else None,
-                    'descripcion': gf['descripcion'],
-                    'categoria': gf['categoria'],
-                    'valor': float(gf['valor']) if gf['valor'] else 0,
-                    'recurrencia': gf['recurrencia']
-                })
-            
-            logging.info(f"Gastos fijos activos encontrados: {len(gastos_fixos_ativos)}")
-        except Exception as e:
-            logging.error(f"Error al buscar gastos fijos activos: {e}")
-            gastos_fixos_ativos = []
+        dados['gastos_tempo_labels'] = [dia.strftime('%d/%m') for dia in dias_no_periodo]
+        dados['gastos_tempo_data'] = [gastos_variaveis_por_dia.get(dia, Decimal('0')) for dia in dias_no_periodo]
+        dados['gastos_fixos_tempo_data'] = [gastos_fixos_por_dia.get(dia, Decimal('0.00')) for dia in dias_no_periodo]
+
+        gastos_por_metodo = defaultdict(Decimal)
+        for linha in gastos_metodo_por_dia:
+            if linha['dia'] >= data_inicio_periodo:
+                gastos_por_metodo[linha['metodo_nome']] += linha['total_gasto']
+        metodos_ordenados = sorted(((nome, total) for nome, total in gastos_por_metodo.items() if total > 0),
+                                   key=lambda x: x[1], reverse=True)
+
+        payloads[periodo] = {
+            'dados': dados,
+            'meta_ativa': meta_ativa,
+            'metas_ativas': metas_ativas,
+            'categorias_por_tipo': categorias_por_tipo,
+            'metodos_pagamento_disponiveis': metodos_pagamento_disponiveis,
+            'gastos_fixos_ativos': gastos_fixos_ativos,
+            'dados_json': json_dados_dashboard(dados, [nome for nome, _ in metodos_ordenados], [total for _, total in metodos_ordenados]),
+        }
+        logging.info("Dashboard: período %s (%s a %s) - receitas %s, gastos variáveis %s, gastos fixos %s",
+                     periodo, data_inicio_periodo, hoje, total_receitas, total_gastos_variaveis, total_gastos_fixos)
+
+    logging.info("Dashboard data calculated for schema %s (%d períodos). Meta ativa: %s", user_schema, len(payloads), 'Sim' if meta_ativa else 'Não')
+    return payloads
+
+
+# --- Aquecimento do cache (login e deploy) ---
+# Assim que o login dá certo, o payload do dashboard (todos os períodos, já com categorias e métodos de pagamento)
+# começa a ser calculado em segundo plano, junto do registro do schema; o GET /dashboard do redirect pega
+# carona nos mesmos lotes (coalescer) ou já encontra o payload pronto. AQUECER_NO_LOGIN: 1 (padrão) liga.
+# Depois de um deploy, aquecer_tenants_ativos() pré-calcula o dashboard dos tenants mais ativos segundo as
+# estatísticas de acesso do PostgreSQL (leituras e escritas por schema em pg_stat_user_tables):
+#     flask --app app aquecer-tenants --top 50       (no pipeline, antes de virar o tráfego)
+# ou no criar_app() do master, com AQUECER_TENANTS_TOP > 0 (padrão 0). AQUECER_TENANTS_THREADS (padrão 4).
+# Só faz sentido com cache compartilhado (ex.: RedisCache): o SimpleCache é por processo e cada worker começa vazio.
+AQUECER_NO_LOGIN = os.environ.get('AQUECER_NO_LOGIN', '1') == '1'
+AQUECER_TENANTS_TOP = int(os.environ.get('AQUECER_TENANTS_TOP', '0'))
+AQUECER_TENANTS_THREADS = int(os.environ.get('AQUECER_TENANTS_THREADS', '4'))
+
+
+def aquecer_dashboard(user_schema, em_segundo_plano=True):
+    """Calcula os payloads do dashboard do tenant se não houver um fresco no cache; True se um cálculo foi feito ou agendado."""
+    if DASHBOARD_FRESCO_SEGUNDOS <= 0:
+        return False
+    chave = chave_dados_dashboard(user_schema, date.today())
+    if consultar_dados_dashboard(chave)[1] == 'fresco':
+        return False
+    aquecido = revalidar_dados_dashboard(chave, user_schema, em_segundo_plano)
+    if aquecido:
+        incrementar_metrica('aquecimento', 'agendados' if em_segundo_plano else 'calculados')
+    return aquecido
 
-        logging.info(f"Dashboard data calculated for schema {user_schema}. Meta ativa: {'Sim' if meta_ativa else 'Não'}")
 
+def tenants_mais_ativos(limite):
+    """Schemas de tenant com mais leituras e escritas desde o último reset das estatísticas do PostgreSQL."""
+    conn = get_db_connection()
+    if not conn:
+        return []
+    cur = None
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT schemaname
+            FROM pg_stat_user_tables
+            WHERE schemaname ~ '^user[0-9]+$'
+            GROUP BY schemaname
+            ORDER BY SUM(COALESCE(seq_scan, 0) + COALESCE(idx_scan, 0) + n_tup_ins + n_tup_upd + n_tup_del) DESC
+            LIMIT %s
+        """, (limite,))
+        return [linha[0] for linha in cur.fetchall()]
     except psycopg2.Error as e:
-        logging.error(f"Erro DB ao carregar dashboard para schema {user_schema}, período {periodo_selecionado}: {e}")
-        flash('Erro ao buscar dados para o dashboard.', 'danger')
-        meta_ativa = None
-    except Exception as e:
-        logging.error(f"Erro inesperado ao carregar dashboard para schema {user_schema}, período {periodo_selecionado}: {e}", exc_info=True)
-        flash('Ocorreu um erro inesperado ao carregar o dashboard.', 'danger')
-        meta_ativa = None
+        logging.error("Erro ao buscar os tenants mais ativos: %s", e)
+        return []
     finally:
         if cur: cur.close()
-        if conn: conn.close()
+        conn.close()
 
-    dados_json_string = json.dumps({
-        "gastos_categoria_labels": dados['gastos_categoria_labels'],
-        "gastos_categoria_data": dados['gastos_categoria_data'],
-        "gastos_fixos_categoria_labels": dados['gastos_fixos_categoria_labels'],
-        "gastos_fixos_categoria_data": dados['gastos_fixos_categoria_data'],
-        "gastos_tempo_labels": dados['gastos_tempo_labels'],
-        "gastos_tempo_data": dados['gastos_tempo_data'],
-        "gastos_fixos_tempo_data": dados.get('gastos_fixos_tempo_data', []),
-        "gastos_metodo_labels": gastos_metodo_labels if 'gastos_metodo_labels' in locals() else [],
-        "gastos_metodo_data": gastos_metodo_data if 'gastos_metodo_data' in locals() else []
-    }, default=json_converter)
 
-    return render_template('dashboard.html',
-                           user_nome=user_nome,
-                           dados=dados,
-                           meta_ativa=meta_ativa,
-                           metas_ativas=metas_ativas if 'metas_ativas' in locals() else [],
-                           dados_json=dados_json_string,
-                           categorias_por_tipo=categorias_por_tipo,
-                           metodos_pagamento_disponiveis=metodos_pagamento_disponiveis,
-                           gastos_fixos_ativos=gastos_fixos_ativos,
-                           periodo_ativo=periodo_selecionado) # Passa o período ativo para o template
+def aquecer_tenants_ativos(limite=None):
+    """Pré-calcula o dashboard dos `limite` tenants mais ativos; devolve quantos foram calculados."""
+    limite = limite or AQUECER_TENANTS_TOP
+    if limite <= 0:
+        return 0
+    if app.config['CACHE_TYPE'] == 'SimpleCache':
+        logging.warning("Aquecimento de tenants pulado: CACHE_TYPE=SimpleCache não é compartilhado com os workers")
+        return 0
+    inicio = time.perf_counter()
+    schemas = tenants_mais_ativos(limite)
+
+    def aquecer(schema):
+        with app.app_context():
+            return aquecer_dashboard(schema, em_segundo_plano=False)
+
+    with ThreadPoolExecutor(max_workers=max(1, AQUECER_TENANTS_THREADS), thread_name_prefix='aquecer') as pool:
+        calculados = sum(pool.map(aquecer, schemas))
+    logging.info("Aquecimento: %d de %d tenants mais ativos calculados em %.1fs", calculados, len(schemas), time.perf_counter() - inicio)
+    return calculados
+
+
+@app.cli.command('aquecer-tenants')
+@click.option('--top', type=int, default=lambda: AQUECER_TENANTS_TOP or 50, help='quantos tenants aquecer')
+def comando_aquecer_tenants(top):
+    """Pré-calcula o dashboard dos tenants mais ativos (rode antes de virar o tráfego para o deploy novo)."""
+    click.echo(f"{aquecer_tenants_ativos(top)} tenant(s) aquecido(s)")
+
+
+@app.route('/dashboard')
+@cache.cached(timeout=CACHE_PAGINAS_SEGUNDOS, key_prefix=chave_cache_pagina, unless=dashboard_nao_cacheavel, response_filter=pagina_cacheavel)
+@prazo_rota(8)
+@plano_leitura
+def dashboard():
+    if 'user_assinatura_id' not in session:
+        flash('Você precisa fazer login para acessar esta página.', 'warning')
+        return redirect(url_for('login'))
+
+    user_schema = session.get('user_schema')
+    user_nome = session.get('user_nome', session.get('user_email'))
+
+    if not user_schema:
+        logging.error(f"Schema não encontrado na sessão para usuário {user_nome} (ID: {session.get('user_assinatura_id')}) ao acessar /dashboard. Deslogando.")
+        flash('Erro interno: Informações do usuário incompletas. Por favor, faça login novamente.', 'danger')
+        session.clear()
+        return redirect(url_for('login'))
+
+    hoje = date.today()
+    periodo_selecionado, data_inicio_periodo, data_fim_periodo = periodo_dashboard(request.args.get('periodo', 'mes_atual'), hoje)
+    logging.info("Acessando dashboard: Schema %s, Período: %s (%s a %s)", user_schema, periodo_selecionado, data_inicio_periodo, data_fim_periodo)
+
+    # Os três períodos são calculados e cacheados juntos: trocar de período não vai ao banco.
+    # O cache é I/O bloqueante (Redis): no caminho ASGI vai para uma thread (ver ChamadaBloqueante).
+    chave, payloads, estado = yield ChamadaBloqueante(buscar_dados_dashboard, user_schema, hoje)
+    incrementar_metrica('dashboard_swr', estado or 'recalculado')
+
+    if payloads is None:
+        conn = conexao_da_requisicao()
+        if not conn:
+            flash('Erro de conexão com o banco ao carregar dashboard.', 'danger')
+        else:
+            try:
+                payloads = yield from plano_dados_dashboard(user_schema, hoje)
+                yield ChamadaBloqueante(guardar_dados_dashboard, chave, payloads)
+            except psycopg2.Error as e:
+                logging.error(f"Erro DB ao carregar dashboard para schema {user_schema}, período {periodo_selecionado}: {e}")
+                flash('Erro ao buscar dados para o dashboard.', 'danger')
+            except Exception as e:
+                logging.error(f"Erro inesperado ao carregar dashboard para schema {user_schema}, período {periodo_selecionado}: {e}", exc_info=True)
+                flash('Ocorreu um erro inesperado ao carregar o dashboard.', 'danger')
+            finally:
+                conn.close()
 
+    if payloads is None:
+        g.erro_banco = True
+        payload = payload_dashboard_vazio()
+        payload['dados_json'] = json_dados_dashboard(payload['dados'])
+    else:
+        payload = payloads[periodo_selecionado]
 
+    return render_template('dashboard.html', user_nome=user_nome, periodo_ativo=periodo_selecionado, **payload) # Passa o período ativo para o template
 
 
 @app.route('/logout')
@@ -1984,6 +3993,8 @@ def logout():
 # No seu app.py, substitua a função gastos() por esta versão mais limpa:
 
 @app.route('/gastos', methods=['GET'])
+@prazo_rota(5)
+@plano_leitura
 def gastos():
     if 'user_assinatura_id' not in session:
         flash('Necesitas iniciar sesión para acceder a esta página.', 'warning')
@@ -2032,14 +4043,7 @@ def gastos():
     
     where_sql = sql.SQL(" WHERE ") + sql.SQL(" AND ").join(where_clauses) if where_clauses else sql.SQL("")
     
-    order_options = {
-        'fecha_desc': sql.SQL("{alias}.{date_col} DESC").format(alias=main_alias, date_col=date_column),
-        'fecha_asc': sql.SQL("{alias}.{date_col} ASC").format(alias=main_alias, date_col=date_column),
-        'valor_desc': sql.SQL("{alias}.valor DESC").format(alias=main_alias),
-        'valor_asc': sql.SQL("{alias}.valor ASC").format(alias=main_alias),
-        'descricao_asc': sql.SQL("{alias}.descripcion ASC").format(alias=main_alias)
-    }
-    order_by_clause = order_options.get(sort_by, order_options['fecha_desc'])
+    order_by_clause = ORDENACOES_GASTOS.get(sort_by, ORDENACOES_GASTOS['fecha_desc']).format(alias=main_alias, date_col=date_column)
 
     # --- 2. Inicialização dos Dados ---
     lista_itens, stats_gastos = [], {'total': Decimal('0.00'), 'promedio_diario': Decimal('0.00'), 'top_categoria': 'N/A'}
@@ -2048,53 +4052,64 @@ def gastos():
     categorias_para_filtro, categorias_add_edit, metodos_pagamento = [], [], []
     total_items, total_pages, current_page = 0, 1, page
 
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         flash('Error de conexión con la base de datos.', 'danger'); return render_template('gastos.html', **locals())
 
-    cur = None
     try:
-        cur = conn.cursor(cursor_factory=DictCursor)
+        schema = sql.Identifier(user_schema)
         table_name = sql.Identifier('gastos_fixos') if tipo_gasto_ativo == 'fixos' else sql.Identifier('gastos')
         
         cat_tipo = 'gasto_fixo' if tipo_gasto_ativo == 'fixos' else 'gasto_variavel'
-        categorias_add_edit = buscar_categorias_por_tipo(conn, user_schema, cat_tipo)
-        categorias_para_filtro = buscar_categorias_por_tipo(conn, user_schema, 'gasto_variavel') + buscar_categorias_por_tipo(conn, user_schema, 'gasto_fixo')
-        metodos_pagamento = buscar_metodos_pagamento_ativos(conn, user_schema)
 
         if tipo_gasto_ativo == 'variaveis':
             select_sql = sql.SQL("SELECT {alias}.*, mp.nome as metodo_pagamento_nome FROM {schema}.{table} {alias} LEFT JOIN {schema}.metodos_pagamento mp ON {alias}.metodo_pagamento_id = mp.id").format(
-                alias=main_alias, schema=sql.Identifier(user_schema), table=table_name)
+                alias=main_alias, schema=schema, table=table_name)
         else: # fixos
             select_sql = sql.SQL("SELECT {alias}.*, NULL as metodo_pagamento_nome FROM {schema}.{table} {alias}").format(
-                alias=main_alias, schema=sql.Identifier(user_schema), table=table_name)
+                alias=main_alias, schema=schema, table=table_name)
 
-        count_query = sql.SQL("SELECT COUNT(*) FROM {schema}.{table} {alias} {where}").format(schema=sql.Identifier(user_schema), table=table_name, alias=main_alias, where=where_sql)
-        cur.execute(count_query, params)
-        total_items = cur.fetchone()[0]
-        total_pages = ceil(total_items / ITEMS_PER_PAGE) if total_items > 0 else 1
-        current_page = min(page, total_pages) if total_pages > 0 else 1
-        offset = (current_page - 1) * ITEMS_PER_PAGE
-        
+        count_query = sql.SQL("SELECT COUNT(*) AS total FROM {schema}.{table} {alias} {where}").format(schema=schema, table=table_name, alias=main_alias, where=where_sql)
         main_query_sql = sql.SQL("{select} {where} ORDER BY {order} LIMIT %s OFFSET %s").format(select=select_sql, where=where_sql, order=order_by_clause)
-        cur.execute(main_query_sql, params + [ITEMS_PER_PAGE, offset])
-        lista_itens = cur.fetchall()
 
+        # Tudo num lote só (ver plano_leitura): a página pedida vai junto da contagem e só é buscada
+        # de novo se passar da última página.
+        grupos = {
+            'categorias': grupo_categorias(user_schema, ['gasto_variavel', 'gasto_fixo']),
+            'metodos_pagamento': grupo_metodos_pagamento(user_schema),
+            'total_items': GrupoConsulta(count_query, params, um=True),
+            'itens': GrupoConsulta(main_query_sql, params + [ITEMS_PER_PAGE, (max(page, 1) - 1) * ITEMS_PER_PAGE]),
+        }
         if where_clauses: 
-            stats_query = sql.SQL("SELECT COALESCE(SUM({alias}.valor), 0) as total, (SELECT categoria FROM {schema}.{table} {alias} {where} GROUP BY {alias}.categoria ORDER BY SUM({alias}.valor) DESC LIMIT 1) as top_cat FROM {schema}.{table} {alias} {where}").format(alias=main_alias, schema=sql.Identifier(user_schema), table=table_name, where=where_sql)
-            cur.execute(stats_query, params * 2)
-            stats_result = cur.fetchone();
-            if stats_result:
-                stats_gastos['total'] = stats_result['total']
-                if 'data_inicio' in filtros_aplicados and 'data_fim' in filtros_aplicados:
-                    dias_periodo = (datetime.strptime(filtros_aplicados['data_fim'], '%Y-%m-%d').date() - datetime.strptime(filtros_aplicados['data_inicio'], '%Y-%m-%d').date()).days + 1
-                    stats_gastos['promedio_diario'] = stats_result['total'] / dias_periodo if dias_periodo > 0 else Decimal('0.00')
-                stats_gastos['top_categoria'] = stats_result['top_cat'] or 'N/A'
+            stats_query = sql.SQL("SELECT COALESCE(SUM({alias}.valor), 0) as total, (SELECT categoria FROM {schema}.{table} {alias} {where} GROUP BY {alias}.categoria ORDER BY SUM({alias}.valor) DESC LIMIT 1) as top_cat FROM {schema}.{table} {alias} {where}").format(alias=main_alias, schema=schema, table=table_name, where=where_sql)
+            grupos['stats'] = GrupoConsulta(stats_query, params * 2, um=True)
+        if tipo_gasto_ativo == 'fixos':
+            grupos['todos_gastos_fixos'] = GrupoConsulta(sql.SQL("SELECT * FROM {schema}.gastos_fixos WHERE activo = TRUE").format(schema=schema))
+        resultados = yield grupos
+
+        categorias = resultados['categorias'] or {}
+        categorias_add_edit = categorias.get(cat_tipo, [])
+        categorias_para_filtro = categorias.get('gasto_variavel', []) + categorias.get('gasto_fixo', [])
+        metodos_pagamento = resultados['metodos_pagamento'] or []
+
+        total_items = resultados['total_items']['total']
+        total_pages = ceil(total_items / ITEMS_PER_PAGE) if total_items > 0 else 1
+        current_page = min(page, total_pages) if total_pages > 0 else 1
+        lista_itens = resultados['itens']
+        if current_page != page:
+            offset = (current_page - 1) * ITEMS_PER_PAGE
+            lista_itens = (yield {'itens': GrupoConsulta(main_query_sql, params + [ITEMS_PER_PAGE, offset])})['itens']
+
+        stats_result = resultados.get('stats')
+        if stats_result:
+            stats_gastos['total'] = stats_result['total']
+            if 'data_inicio' in filtros_aplicados and 'data_fim' in filtros_aplicados:
+                dias_periodo = (datetime.strptime(filtros_aplicados['data_fim'], '%Y-%m-%d').date() - datetime.strptime(filtros_aplicados['data_inicio'], '%Y-%m-%d').date()).days + 1
+                stats_gastos['promedio_diario'] = stats_result['total'] / dias_periodo if dias_periodo > 0 else Decimal('0.00')
+            stats_gastos['top_categoria'] = stats_result['top_cat'] or 'N/A'
         
         if tipo_gasto_ativo == 'fixos':
-            query_all_fixos = sql.SQL("SELECT * FROM {schema}.gastos_fixos WHERE activo = TRUE").format(schema=sql.Identifier(user_schema))
-            cur.execute(query_all_fixos)
-            todos_gastos_fixos = cur.fetchall()
+            todos_gastos_fixos = resultados['todos_gastos_fixos']
             primeiro_dia_mes_atual = today.replace(day=1)
             ultimo_dia_mes_atual = (primeiro_dia_mes_atual + relativedelta(months=1)) - timedelta(days=1)
             for gf in todos_gastos_fixos:
@@ -2114,7 +4129,6 @@ def gastos():
     except Exception as e:
         flash('Ocurrió un error al procesar los datos de gastos.', 'danger'); logging.error(f"Error al procesar gastos para {user_schema}: {e}", exc_info=True)
     finally:
-        if cur: cur.close()
         if conn: conn.close()
 
     # Passando as variáveis para o template, agora sem 'proximo_gasto_a_vencer'
@@ -2179,7 +4193,7 @@ def add_gasto():
         return redirect(redirect_url)
 
     # Conexão com o banco
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         flash('Erro de conexão com o banco de dados.', 'danger')
         return redirect(redirect_url)
@@ -2279,7 +4293,7 @@ def add_gasto_fixo():
         flash('Data de início inválida. Use o formato AAAA-MM-DD.', 'danger')
         return redirect(redirect_url)
         
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         flash('Erro de conexão com o banco de dados.', 'danger')
         return redirect(redirect_url)
@@ -2334,7 +4348,7 @@ def lembretes():
         session.clear()
         return redirect(url_for('login'))
 
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         flash('Erro conexão DB.', 'danger')
         return render_template('lembretes.html', user_nome=user_nome, lembretes_agrupados={})
@@ -2357,57 +4371,7 @@ def lembretes():
         if conn: conn.close()
 
     # --- Lógica de Agrupamento Inteligente ---
-    hoje = date.today()
-    limite_proximos_dias = hoje + timedelta(days=7)
-    
-    lembretes_agrupados = {
-        'vencidos': [],
-        'para_hoje': [],
-        'proximos_7_dias': [],
-        'futuros': []
-    }
-
-    for lembrete in lista_de_lembretes:
-        lembrete_dict = dict(lembrete) # Converte para um dicionário mutável
-        data_lembrete = lembrete_dict['data']
-        is_repeating_monthly = lembrete_dict.get('repetir') and lembrete_dict.get('tipo_repeticion') == 'mensal'
-
-        if is_repeating_monthly:
-            # Calcula a próxima ocorrência a partir de hoje
-            dia_lembrete = data_lembrete.day
-            try:
-                proxima_ocorrencia = hoje.replace(day=dia_lembrete)
-            except ValueError: # Caso o dia não exista no mês atual (ex: dia 31 em fevereiro)
-                ultimo_dia_mes_atual = (hoje.replace(day=1) + relativedelta(months=1)) - timedelta(days=1)
-                proxima_ocorrencia = ultimo_dia_mes_atual
-            
-            if proxima_ocorrencia < hoje:
-                proxima_ocorrencia = proxima_ocorrencia + relativedelta(months=1)
-
-            lembrete_dict['data_exibicao'] = proxima_ocorrencia # Adiciona data para exibição
-            
-            # Agrupa baseado na próxima ocorrência
-            if proxima_ocorrencia == hoje:
-                lembretes_agrupados['para_hoje'].append(lembrete_dict)
-            elif hoje < proxima_ocorrencia <= limite_proximos_dias:
-                lembretes_agrupados['proximos_7_dias'].append(lembrete_dict)
-            else:
-                lembretes_agrupados['futuros'].append(lembrete_dict)
-        
-        else: # Lembretes não repetitivos
-            lembrete_dict['data_exibicao'] = data_lembrete
-            if data_lembrete < hoje:
-                lembretes_agrupados['vencidos'].append(lembrete_dict)
-            elif data_lembrete == hoje:
-                lembretes_agrupados['para_hoje'].append(lembrete_dict)
-            elif hoje < data_lembrete <= limite_proximos_dias:
-                lembretes_agrupados['proximos_7_dias'].append(lembrete_dict)
-            else: # data_lembrete > limite_proximos_dias
-                lembretes_agrupados['futuros'].append(lembrete_dict)
-    
-    # Ordena cada grupo pela data de exibição
-    for grupo in lembretes_agrupados.values():
-        grupo.sort(key=lambda x: x['data_exibicao'])
+    lembretes_agrupados = agrupar_lembretes(lista_de_lembretes, date.today())
 
     return render_template('lembretes.html', 
                            user_nome=user_nome, 
@@ -2480,7 +4444,7 @@ def add_lembrete_from_modal():
     # Se 'repetir' for False, tipo_rep continua None
 
     # --- 5. Conexão e Inserção no Banco ---
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         flash('Erro conexão DB.', 'danger')
         return redirect(redirect_url)
@@ -2496,7 +4460,8 @@ def add_lembrete_from_modal():
         # Parâmetros agora incluem valor, repetição e tipo
         params = (descricao, data_lembrete_obj, valor_decimal, repetir, tipo_rep)
 
-        logging.debug(f"Executando INSERT Lembrete (Modal): Query={query.as_string(conn)} Params={params}")
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("Executando INSERT Lembrete (Modal): Query=%s Params=%s", query.as_string(cur), params)
         cur.execute(query, params)
         conn.commit()
         flash('¡Recordatorio agregado con éxito!', 'success')
@@ -2523,6 +4488,8 @@ def add_lembrete_from_modal():
 # No seu app.py, substitua a função receitas() inteira por esta:
 
 @app.route('/receitas', methods=['GET'])
+@prazo_rota(5)
+@plano_leitura
 def receitas():
     if 'user_assinatura_id' not in session:
         flash('Você precisa fazer login para acessar esta página.', 'warning')
@@ -2566,15 +4533,15 @@ def receitas():
     categorias_receitas_formulario = []
     total_items = 0
     total_pages = 1
+    current_page = 1
 
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         flash('Erro de conexão com o banco de dados.', 'danger')
         return render_template('receitas.html', user_nome=user_nome, receitas=[], stats_receitas=stats_receitas, categorias_disponiveis=[], categorias_receitas_formulario=[], filtros_aplicados=filtros_aplicados, current_page=1, total_pages=1)
 
-    cur = None
     try:
-        cur = conn.cursor(cursor_factory=DictCursor)
+        schema = sql.Identifier(user_schema)
 
         # --- 3. Construir Query com Filtros ---
         where_clauses = [sql.SQL("fecha BETWEEN %s AND %s")]
@@ -2586,50 +4553,48 @@ def receitas():
         
         where_sql = sql.SQL(" WHERE ") + sql.SQL(" AND ").join(where_clauses)
 
-        # --- 4. Calcular Estatísticas para o Mini-Dashboard ---
-        stats_query = sql.SQL("""
-            SELECT 
-                COALESCE(SUM(valor), 0) as total,
-                COALESCE(AVG(valor), 0) as promedio,
-                (SELECT categoria FROM {schema}.outras_receitas {where} GROUP BY categoria ORDER BY SUM(valor) DESC LIMIT 1) as categoria_principal
-            FROM {schema}.outras_receitas {where}
-        """).format(schema=sql.Identifier(user_schema), where=where_sql)
-        cur.execute(stats_query, query_params * 2) # Parâmetros são necessários para a subquery também
-        stats_result = cur.fetchone()
+        order_by_clause = ORDENACOES_RECEITAS.get(sort_by, ORDENACOES_RECEITAS['fecha_desc'])
+        main_query = sql.SQL("SELECT id, fecha, categoria, descripcion, valor FROM {schema}.outras_receitas {where} {order} LIMIT %s OFFSET %s").format(
+            schema=schema, where=where_sql, order=order_by_clause)
+
+        # Estatísticas, contagem, página pedida e categorias num lote só (ver plano_leitura)
+        resultados = yield {
+            # --- 4. Calcular Estatísticas para o Mini-Dashboard ---
+            'stats': GrupoConsulta(sql.SQL("""
+                SELECT 
+                    COALESCE(SUM(valor), 0) as total,
+                    COALESCE(AVG(valor), 0) as promedio,
+                    (SELECT categoria FROM {schema}.outras_receitas {where} GROUP BY categoria ORDER BY SUM(valor) DESC LIMIT 1) as categoria_principal
+                FROM {schema}.outras_receitas {where}
+            """).format(schema=schema, where=where_sql), query_params * 2, um=True), # Parâmetros são necessários para a subquery também
+            # --- 5. Buscar Lista Paginada de Transações ---
+            'total_items': GrupoConsulta(sql.SQL("SELECT COUNT(*) AS total FROM {schema}.outras_receitas {where}").format(schema=schema, where=where_sql), query_params, um=True),
+            'receitas': GrupoConsulta(main_query, query_params + [ITEMS_PER_PAGE, (max(page, 1) - 1) * ITEMS_PER_PAGE]),
+            # --- 6. Buscar Categorias para os Filtros ---
+            'categorias': grupo_categorias(user_schema, ['receita']),
+        }
+
+        stats_result = resultados['stats']
         if stats_result:
             stats_receitas['total'] = stats_result['total']
             stats_receitas['promedio'] = stats_result['promedio']
             stats_receitas['categoria_principal'] = stats_result['categoria_principal'] or 'N/A'
 
-        # --- 5. Buscar Lista Paginada de Transações ---
-        count_query = sql.SQL("SELECT COUNT(*) FROM {schema}.outras_receitas {where}").format(schema=sql.Identifier(user_schema), where=where_sql)
-        cur.execute(count_query, query_params)
-        total_items = cur.fetchone()[0]
+        total_items = resultados['total_items']['total']
         total_pages = ceil(total_items / ITEMS_PER_PAGE) if total_items > 0 else 1
         current_page = min(page, total_pages) if total_pages > 0 else 1
-        offset = (current_page - 1) * ITEMS_PER_PAGE
-
-        order_by_options = {
-            'fecha_desc': sql.SQL("ORDER BY fecha DESC, id DESC"), 'fecha_asc': sql.SQL("ORDER BY fecha ASC, id ASC"),
-            'valor_desc': sql.SQL("ORDER BY valor DESC, fecha DESC"), 'valor_asc': sql.SQL("ORDER BY valor ASC, fecha DESC"),
-            'categoria_asc': sql.SQL("ORDER BY categoria ASC, fecha DESC")
-        }
-        order_by_clause = order_by_options.get(sort_by, order_by_options['fecha_desc'])
-        
-        main_query = sql.SQL("SELECT id, fecha, categoria, descripcion, valor FROM {schema}.outras_receitas {where} {order} LIMIT %s OFFSET %s").format(
-            schema=sql.Identifier(user_schema), where=where_sql, order=order_by_clause)
-        cur.execute(main_query, query_params + [ITEMS_PER_PAGE, offset])
-        lista_receitas = cur.fetchall()
+        lista_receitas = resultados['receitas']
+        if current_page != page:
+            offset = (current_page - 1) * ITEMS_PER_PAGE
+            lista_receitas = (yield {'receitas': GrupoConsulta(main_query, query_params + [ITEMS_PER_PAGE, offset])})['receitas']
 
-        # --- 6. Buscar Categorias para os Filtros ---
-        categorias_disponiveis = buscar_categorias_por_tipo(conn, user_schema, 'receita')
+        categorias_disponiveis = (resultados['categorias'] or {}).get('receita', [])
         categorias_receitas_formulario = categorias_disponiveis # Reutiliza a mesma lista
 
     except psycopg2.Error as e:
         flash('Erro de banco de dados na página de receitas.', 'danger')
         logging.error(f"Erro DB /receitas {user_schema}: {e}")
     finally:
-        if cur: cur.close()
         if conn: conn.close()
 
     return render_template('receitas.html',
@@ -2690,7 +4655,7 @@ def add_outra_receita():
         return redirect(redirect_url)
 
     # Conexão com o banco
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         flash('Erro de conexão com o banco de dados.', 'danger')
         return redirect(redirect_url)
@@ -2746,7 +4711,7 @@ def metas():
 
     if request.method == 'POST':
         # Procesamiento del formulario de creación/edición de meta
-        conn = get_db_connection()
+        conn = conexao_da_requisicao()
         if not conn:
             flash('Error de conexión con la base de datos.', 'danger')
             return redirect(url_for('metas'))
@@ -2845,7 +4810,7 @@ def metas():
 
     # GET - Mostrar página de metas
     lista_metas = []
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if conn:
         cur = None
         try:
@@ -2859,7 +4824,7 @@ def metas():
             """).format(schema=sql.Identifier(user_schema))
             cur.execute(query_metas)
             lista_metas = cur.fetchall()
-            logging.info(f"Metas consultadas para schema {user_schema}: {len(lista_metas)} encontradas.")
+            logging.info("Metas consultadas para schema %s: %d encontradas.", user_schema, len(lista_metas))
         except psycopg2.Error as e:
             flash('Error al consultar metas en la base de datos.', 'danger')
             logging.error(f"Error DB al consultar metas (schema {user_schema}): {e}")
@@ -2898,7 +4863,7 @@ def add_progresso_meta(meta_id):
         flash(f'Error: Valor de progreso inválido. {e}', 'danger')
         return redirect(redirect_url)
 
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         flash('Error de conexión con la base de datos.', 'danger')
         return redirect(redirect_url)
@@ -2964,7 +4929,7 @@ def cancelar_meta(meta_id):
         session.clear()
         return redirect(url_for('login'))
 
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         flash('Error de conexión con la base de datos.', 'danger')
         return redirect(redirect_url)
@@ -3026,7 +4991,7 @@ def delete_meta(meta_id):
         session.clear()
         return redirect(url_for('login'))
 
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         flash('Error de conexión con la base de datos.', 'danger')
         return redirect(redirect_url)
@@ -3086,7 +5051,7 @@ def metodos_pagamento():
         session.clear(); return redirect(url_for('login'))
 
     lista_metodos = []
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         flash('Erro de conexão com o banco de dados.', 'danger')
     else:
@@ -3100,7 +5065,7 @@ def metodos_pagamento():
             """).format(schema=sql.Identifier(user_schema))
             cur.execute(query)
             lista_metodos = cur.fetchall()
-            logging.info(f"Métodos de pagamento buscados para schema {user_schema}: {len(lista_metodos)} encontrados.")
+            logging.info("Métodos de pagamento buscados para schema %s: %d encontrados.", user_schema, len(lista_metodos))
         except psycopg2.Error as e:
             flash('Erro ao buscar métodos de pagamento no banco de dados.', 'danger')
             logging.error(f"Erro DB ao buscar métodos de pagamento (schema {user_schema}): {e}")
@@ -3149,7 +5114,7 @@ def add_metodo_pagamento():
     if not modalidad_metodo:
         modalidad_metodo = 'na'
 
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         flash('Erro de conexão com o banco.', 'danger'); return redirect(redirect_url)
 
@@ -3216,7 +5181,7 @@ def edit_metodo_pagamento(metodo_id):
     if not modalidad_metodo:
         modalidad_metodo = 'na'
 
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         flash('Erro de conexão.', 'danger'); return redirect(redirect_url)
 
@@ -3266,7 +5231,7 @@ def delete_metodo_pagamento(metodo_id):
     if not user_schema:
         flash('Erro interno.', 'danger'); return redirect(url_for('login'))
 
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         flash('Erro de conexão.', 'danger'); return redirect(redirect_url)
 
@@ -3332,7 +5297,7 @@ def numeros_compartilhados():
         return redirect(url_for('login'))
 
     lista_numeros = []
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         # MENSAGEM ATUALIZADA
         flash('Error de conexión con la base de datos.', 'danger')
@@ -3367,7 +5332,7 @@ def numeros_compartilhados():
             """).format(schema=sql.Identifier(user_schema))
             cur.execute(query)
             lista_numeros = cur.fetchall()
-            logging.info(f"Números compartilhados buscados para schema {user_schema}: {len(lista_numeros)} encontrados.")
+            logging.info("Números compartilhados buscados para schema %s: %d encontrados.", user_schema, len(lista_numeros))
         except psycopg2.Error as e:
             conn.rollback()
             # MENSAGEM ATUALIZADA
@@ -3410,7 +5375,7 @@ def add_numero_compartilhado():
         flash('El número de WhatsApp y el Nombre son obligatorios.', 'danger')
         return redirect(redirect_url)
 
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         # MENSAGEM ATUALIZADA
         flash('Error de conexión con la base de datos.', 'danger')
@@ -3471,7 +5436,7 @@ def edit_numero_compartilhado(numero_id):
         flash('El número de WhatsApp y el Nombre son obligatorios para editar.', 'danger')
         return redirect(redirect_url)
 
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         # MENSAGEM ATUALIZADA
         flash('Error de conexión.', 'danger')
@@ -3527,7 +5492,7 @@ def delete_numero_compartilhado(numero_id):
         flash('Error interno.', 'danger')
         return redirect(url_for('login'))
 
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         # MENSAGEM ATUALIZADA
         flash('Error de conexión.', 'danger')
@@ -3565,7 +5530,20 @@ def delete_numero_compartilhado(numero_id):
     return redirect(redirect_url)
 
 
+def custo_relatorios():
+    """Meses (1 a 24) do intervalo pedido ao /relatorios: cada mês é mais uma leva de transações expandidas."""
+    try:
+        inicio = datetime.strptime(request.args.get('data_inicio', ''), '%Y-%m-%d').date()
+        fim = datetime.strptime(request.args.get('data_fim', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return 1  # sem filtro: o mês corrente
+    return min(24, max(1, (fim.year - inicio.year) * 12 + fim.month - inicio.month + 1))
+
+
 @app.route('/relatorios')
+@rota_pesada(custo_relatorios)
+@prazo_rota(15)
+@plano_leitura
 def relatorios():
     if 'user_assinatura_id' not in session:
         flash('Você precisa fazer login para acessar esta página.', 'warning')
@@ -3610,78 +5588,76 @@ def relatorios():
     categorias_disponiveis = {'receitas': [], 'variaveis': [], 'fixas': []}
     transacoes_raw = []
     
-    conn = get_db_connection()
+    conn = conexao_da_requisicao()
     if not conn:
         flash('Erro de conexão com o banco.', 'danger')
         return render_template('relatorios.html', user_nome=user_nome, filtros_aplicados=filtros_aplicados, transacoes_agrupadas={}, dados_relatorio=dados_relatorio, dados_grafico=dados_grafico, categorias_disponiveis=categorias_disponiveis)
 
-    cur = None
     try:
-        cur = conn.cursor(cursor_factory=DictCursor)
-        
+        schema = sql.Identifier(user_schema)
+        filtrar_categoria = categoria_filtro != 'todas' and len(tipos_transacao_selecionados) == 1
+
         # --- 3. Buscar Dados com Base nos Filtros (Lógica de Múltipla Seleção) ---
-        # Popula as categorias para o modal de filtro
-        categorias_disponiveis['receitas'] = buscar_categorias_por_tipo(conn, user_schema, 'receita')
-        categorias_disponiveis['variaveis'] = buscar_categorias_por_tipo(conn, user_schema, 'gasto_variavel')
-        categorias_disponiveis['fixas'] = buscar_categorias_por_tipo(conn, user_schema, 'gasto_fixo')
+        # Todas as consultas são independentes: rodam em paralelo (ver plano_leitura).
+        grupos = {
+            # Popula as categorias para o modal de filtro
+            'categorias': grupo_categorias(user_schema, ['receita', 'gasto_variavel', 'gasto_fixo']),
+            # Totais e gráfico (lógica inalterada, já busca tudo); a lista de gastos fixos serve também para a listagem
+            'receitas_periodo': GrupoConsulta(sql.SQL("SELECT fecha, valor FROM {schema}.outras_receitas WHERE fecha BETWEEN %s AND %s").format(schema=schema), (data_inicio, data_fim)),
+            'gastos_periodo': GrupoConsulta(sql.SQL("SELECT data, valor FROM {schema}.gastos WHERE data BETWEEN %s AND %s").format(schema=schema), (data_inicio, data_fim)),
+            'gastos_fixos': GrupoConsulta(sql.SQL("SELECT id, fecha_inicio, descripcion, categoria, valor, recurrencia FROM {schema}.gastos_fixos WHERE activo = TRUE AND fecha_inicio <= %s").format(schema=schema), (data_fim,)),
+        }
 
         # Constrói a lista de transações baseada nos checkboxes selecionados
         if 'receitas' in tipos_transacao_selecionados:
             where = [sql.SQL("fecha BETWEEN %s AND %s")]; params = [data_inicio, data_fim]
-            if categoria_filtro != 'todas' and len(tipos_transacao_selecionados) == 1:
+            if filtrar_categoria:
                 where.append(sql.SQL("categoria = %s")); params.append(categoria_filtro)
-            query = sql.SQL("SELECT id, fecha as data, descripcion, categoria, valor, 'receita' as tipo FROM {schema}.outras_receitas WHERE {where}").format(schema=sql.Identifier(user_schema), where=sql.SQL(' AND ').join(where))
-            cur.execute(query, params)
-            transacoes_raw.extend([dict(r) for r in cur.fetchall()])
+            query = sql.SQL("SELECT id, fecha as data, descripcion, categoria, valor, 'receita' as tipo FROM {schema}.outras_receitas WHERE {where}").format(schema=schema, where=sql.SQL(' AND ').join(where))
+            grupos['lista_receitas'] = GrupoConsulta(query, params)
 
         if 'gastos_variaveis' in tipos_transacao_selecionados:
             where = [sql.SQL("data BETWEEN %s AND %s")]; params = [data_inicio, data_fim]
-            if categoria_filtro != 'todas' and len(tipos_transacao_selecionados) == 1:
+            if filtrar_categoria:
                 where.append(sql.SQL("categoria = %s")); params.append(categoria_filtro)
-            query = sql.SQL("SELECT id, data, descripcion, categoria, valor, 'gasto_variavel' as tipo FROM {schema}.gastos WHERE {where}").format(schema=sql.Identifier(user_schema), where=sql.SQL(' AND ').join(where))
-            cur.execute(query, params)
-            transacoes_raw.extend([dict(r) for r in cur.fetchall()])
+            query = sql.SQL("SELECT id, data, descripcion, categoria, valor, 'gasto_variavel' as tipo FROM {schema}.gastos WHERE {where}").format(schema=schema, where=sql.SQL(' AND ').join(where))
+            grupos['lista_gastos'] = GrupoConsulta(query, params)
+
+        resultados = yield grupos
+        categorias = resultados['categorias'] or {}
+        categorias_disponiveis['receitas'] = categorias.get('receita', [])
+        categorias_disponiveis['variaveis'] = categorias.get('gasto_variavel', [])
+        categorias_disponiveis['fixas'] = categorias.get('gasto_fixo', [])
+
+        transacoes_raw.extend([dict(r) for r in resultados.get('lista_receitas', [])])
+        transacoes_raw.extend([dict(r) for r in resultados.get('lista_gastos', [])])
 
         if 'gastos_fixos' in tipos_transacao_selecionados:
-            query = sql.SQL("SELECT id, fecha_inicio, descripcion, categoria, valor, recurrencia FROM {schema}.gastos_fixos WHERE activo = TRUE AND fecha_inicio <= %s").format(schema=sql.Identifier(user_schema))
-            cur.execute(query, (data_fim,))
-            for gf in cur.fetchall():
-                if categoria_filtro != 'todas' and len(tipos_transacao_selecionados) == 1 and gf['categoria'] != categoria_filtro: continue
-                rrule_params = get_rrule_params(gf['recurrencia'])
-                if rrule_params:
-                    for occ in rrule(dtstart=gf['fecha_inicio'], until=data_fim, **rrule_params):
-                        if occ.date() >= data_inicio:
-                            transacoes_raw.append({'id': gf['id'], 'data': occ.date(), 'descripcion': gf['descripcion'], 'categoria': gf['categoria'], 'valor': gf['valor'], 'tipo': 'gasto_fixo'})
+            gastos_fixos_filtrados = [gf for gf in resultados['gastos_fixos'] if not (filtrar_categoria and gf['categoria'] != categoria_filtro)]
+            for gf, occ_date in expandir_gastos_fixos(gastos_fixos_filtrados, data_inicio, data_fim, incluir_unicos=False):
+                transacoes_raw.append({'id': gf['id'], 'data': occ_date, 'descripcion': gf['descripcion'], 'categoria': gf['categoria'], 'valor': gf['valor'], 'tipo': 'gasto_fixo'})
         
         # --- 4. Calcular Totais para Stat Cards e Gráfico (lógica inalterada, já busca tudo) ---
         # (O código para calcular totais e dados do gráfico permanece o mesmo da sua versão original)
         dias_no_periodo = [data_inicio + timedelta(days=i) for i in range((data_fim - data_inicio).days + 1)]
         receitas_diarias = {d: Decimal(0) for d in dias_no_periodo}
         despesas_diarias = {d: Decimal(0) for d in dias_no_periodo}
-        cur.execute(sql.SQL("SELECT fecha, valor FROM {schema}.outras_receitas WHERE fecha BETWEEN %s AND %s").format(schema=sql.Identifier(user_schema)), (data_inicio, data_fim))
-        for r in cur.fetchall(): dados_relatorio['total_receitas'] += r['valor']; receitas_diarias[r['fecha']] += r['valor']
-        cur.execute(sql.SQL("SELECT data, valor FROM {schema}.gastos WHERE data BETWEEN %s AND %s").format(schema=sql.Identifier(user_schema)), (data_inicio, data_fim))
-        for gv in cur.fetchall(): dados_relatorio['total_despesas'] += gv['valor']; despesas_diarias[gv['data']] += gv['valor']
-        cur.execute(sql.SQL("SELECT valor, fecha_inicio, recurrencia FROM {schema}.gastos_fixos WHERE activo = TRUE AND fecha_inicio <= %s").format(schema=sql.Identifier(user_schema)), (data_fim,))
-        for gf in cur.fetchall():
-            rrule_params = get_rrule_params(gf['recurrencia'])
-            if rrule_params:
-                for occ in rrule(dtstart=gf['fecha_inicio'], until=data_fim, **rrule_params):
-                    if occ.date() >= data_inicio: dados_relatorio['total_despesas'] += gf['valor']; despesas_diarias[occ.date()] += gf['valor']
+        for r in resultados['receitas_periodo']: dados_relatorio['total_receitas'] += r['valor']; receitas_diarias[r['fecha']] += r['valor']
+        for gv in resultados['gastos_periodo']: dados_relatorio['total_despesas'] += gv['valor']; despesas_diarias[gv['data']] += gv['valor']
+        for gf, occ_date in expandir_gastos_fixos(resultados['gastos_fixos'], data_inicio, data_fim, incluir_unicos=False):
+            dados_relatorio['total_despesas'] += gf['valor']; despesas_diarias[occ_date] += gf['valor']
         dados_grafico['labels'] = [d.strftime('%d/%m') for d in dias_no_periodo]
         dados_grafico['datasets']['receitas'] = [float(v) for v in receitas_diarias.values()]
         dados_grafico['datasets']['despesas'] = [float(v) for v in despesas_diarias.values()]
         
         # --- 5. Agrupar Resultados para a Lista ---
-        transacoes_raw.sort(key=itemgetter('data'), reverse=True)
-        transacoes_agrupadas = {data: list(grupo) for data, grupo in groupby(transacoes_raw, key=itemgetter('data'))}
+        transacoes_agrupadas = agrupar_transacoes_por_data(transacoes_raw)
 
     except Exception as e:
         flash('Ocorreu um erro ao gerar o relatório.', 'danger')
         logging.error(f"Erro ao gerar relatório para {user_schema}: {e}", exc_info=True)
         transacoes_agrupadas = {}
     finally:
-        if cur: cur.close()
         if conn: conn.close()
 
     return render_template('relatorios.html',
@@ -3697,8 +5673,115 @@ def relatorios():
 
 
 
+# --- Rotas Administrativas ---
+@app.route('/admin/profiler')
+@admin_obrigatorio
+def admin_profiler():
+    """
+    Executa o profiler por amostragem neste worker por N segundos e devolve collapsed stacks (text/plain).
+    Parâmetros: segundos (padrão 10, máx. 60), intervalo_ms (padrão 10), rota (endpoint), schema, todas_threads=1.
+    """
+    segundos = min(max(request.args.get('segundos', 10, type=float), 0.1), PROFILER_MAX_SEGUNDOS)
+    intervalo = max(request.args.get('intervalo_ms', 10, type=float), 1) / 1000
+    rota = request.args.get('rota') or None
+    schema = request.args.get('schema') or None
+    todas_threads = request.args.get('todas_threads') == '1'
+
+    if not _profiler_lock.acquire(blocking=False):
+        return jsonify({'erro': 'já existe um profiling em andamento neste worker'}), 409
+    try:
+        logging.info("Profiler iniciado: %ss, intervalo %.0fms, rota=%s, schema=%s", segundos, intervalo * 1000, rota, schema)
+        contagens = amostrar_pilhas(segundos, intervalo, rota=rota, schema=schema, todas_threads=todas_threads)
+    finally:
+        _profiler_lock.release()
+
+    corpo = '\n'.join(f"{pilha} {total}" for pilha, total in contagens.most_common())
+    return corpo + '\n', 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
+
+@app.route('/admin/tenants')
+@admin_obrigatorio
+def admin_tenants():
+    """Conteúdo do registro de schemas deste worker."""
+    return jsonify({'pid': os.getpid(), 'ttl_s': registro_tenants.ttl, 'tenants': registro_tenants.resumo()})
+
+
+@app.route('/admin/tenants/atualizar', methods=['POST'])
+@admin_obrigatorio
+def admin_tenants_atualizar():
+    """Invalida o registro (de um schema, com ?schema=, ou de todos) neste worker."""
+    schema = request.args.get('schema') or None
+    registro_tenants.invalidar(schema)
+    return jsonify({'pid': os.getpid(), 'invalidado': schema or 'todos'})
+
+
+@app.route('/admin/metricas')
+@admin_obrigatorio
+def admin_metricas():
+    """Métricas em memória deste worker (profiling de memória, contadores, etc.)."""
+    definir_metrica('logs', 'descartados', filtro_amostragem_logs.descartados)
+    for chave, valor in controle_admissao.estado().items():
+        definir_metrica('admissao', chave, valor)
+    with _metricas_lock:
+        copia = json.loads(json.dumps(_metricas, default=json_converter))
+    copia['pid'] = os.getpid()
+    return jsonify(copia)
+
+
+# --- Ciclo de vida do processo (produção: gunicorn.conf.py / servidor.py) ---
+# O app é pré-carregado uma vez no processo master e os workers nascem por fork já com templates
+# compilados e dados de locale carregados. Onde não há pré-carga (gevent, ASGI) cada worker aquece
+# sozinho, lendo o bytecode que o primeiro gravou no JINJA_CACHE_DIR. Conexões e threads não atravessam o fork: o master
+# descarta as conexões ociosas antes de cada fork e o worker refaz a thread de log e o cliente de cache.
+def aquecer_app():
+    """Compila (ou lê do JINJA_CACHE_DIR) todos os templates e carrega o locale do babel antes de aceitar tráfego."""
+    inicio = time.perf_counter()
+    templates = app.jinja_env.list_templates(extensions=('html', 'jinja', 'j2'))
+    for nome in templates:
+        app.jinja_env.get_template(nome)
+    format_date_locale(date.today())
+    format_currency(0, 'MXN', locale='es_MX')
+    logging.info("App aquecido em %.0fms: %d templates compilados", (time.perf_counter() - inicio) * 1000, len(templates))
+
+
+def criar_app(aquecer=True):
+    """
+    Ponto de entrada de produção. As rotas são registradas no import deste módulo, então a fábrica
+    só conclui a preparação do app (único) e o devolve.
+    """
+    configurar_rate_limit()
+    if aquecer:
+        aquecer_app()
+        if AQUECER_TENANTS_TOP > 0:
+            with app.app_context():
+                aquecer_tenants_ativos()
+    return app
+
+
+def antes_do_fork():
+    """No master: uma conexão herdada pelo fork teria o socket dividido entre dois processos."""
+    descartar_conexoes_ociosas()
+
+
+def apos_fork():
+    """No worker recém-criado: threads de fundo e clientes de rede do master não servem aqui."""
+    global filtro_amostragem_logs
+    filtro_amostragem_logs = configurar_logging()
+    _requisicoes_ativas.clear()
+    cache.init_app(app)
+    logging.info("Worker %d pronto", os.getpid())
+
+
+def aguardar_requisicoes_ativas(segundos):
+    """Desligamento gracioso: espera as requisições em andamento; devolve quantas ainda restavam."""
+    limite = time.monotonic() + segundos
+    while _requisicoes_ativas and time.monotonic() < limite:
+        time.sleep(0.1)
+    return len(_requisicoes_ativas)
+
+
 # ... (resto do app.py, incluindo if __name__ == '__main__':) ...
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 3333))
     # Certifique-se de que debug=False em produção
-    app.run(host='0.0.0.0', port=port, debug=True)
+    criar_app(aquecer=False).run(host='0.0.0.0', port=port, debug=True)
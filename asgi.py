@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+"""
+Caminho assíncrono (ASGI) das rotas de leitura pesadas: /dashboard, /relatorios, /gastos e /receitas.
+
+As rotas decoradas com @plano_leitura em app.py são geradores que pedem lotes de GrupoConsulta; aqui
+o mesmo gerador é conduzido com asyncpg, então uma requisição esperando o PostgreSQL não prende uma
+thread. Templates, sessão, flash, hooks (prazo, tenant, request id, log de acesso) e o processamento
+em Python são os do app síncrono. Todo o resto (POSTs, login, admin) cai no app Flask via WsgiToAsgi.
+
+Uso (requer asyncpg e asgiref):
+    uvicorn asgi:aplicacao --host 0.0.0.0 --port 3333 --workers 4
+
+ASYNC_POOL_MIN / ASYNC_POOL_MAX: tamanho do pool asyncpg por processo (padrão 1 / 20). Os demais
+parâmetros (DB_*, FANOUT_MAX_CONEXOES, DB_MODO_CONEXAO, prazos e disjuntor) são os de app.py.
+O @cache.cached do dashboard não vale neste caminho. Contra um banco de verdade: python perf/compat_asgi.py.
+"""
+import asyncio
+import copy
+import io
+import logging
+import os
+import sys
+
+import asyncpg
+import psycopg2
+from asgiref.wsgi import WsgiToAsgi
+from flask import g, request, session
+from werkzeug.exceptions import HTTPException
+
+from app import (app as flask_app, aquecer_app, criar_app, PLANOS_LEITURA, FANOUT_MAX_CONEXOES, DB_MODO_CONEXAO,
+                 DB_POOL_OCIOSA_MAX, DB_PREPARED_STATEMENTS, DB_PREPARED_MAX, SINGLE_FLIGHT, ChamadaBloqueante,
+                 GrupoConsulta, PrazoExcedido, ResultadosLote, chave_lote, converter_placeholders, disjuntor_banco,
+                 incrementar_metrica, marcar_banco_indisponivel, parametros_conexao, registrar_prazo_excedido,
+                 repassar_erro_do_lider, segundos_para_esperar, tempo_restante_ms, texto_sql, versao_cache_tenant)
+
+ASYNC_POOL_MIN = int(os.environ.get('ASYNC_POOL_MIN', '1'))
+ASYNC_POOL_MAX = int(os.environ.get('ASYNC_POOL_MAX', '20'))
+
+# Falhas de conexão: contam para o disjuntor e viram OperationalError, como no caminho síncrono
+ERROS_CONEXAO = (OSError, asyncpg.PostgresConnectionError, asyncpg.ConnectionDoesNotExistError, asyncpg.CannotConnectNowError)
+
+criar_app(aquecer=False)  # rate limit etc. antes da primeira requisição; o aquecimento fica para o lifespan
+app_wsgi = WsgiToAsgi(flask_app)
+_pool = None
+_pool_lock = None
+
+
+# --- Pool asyncpg ---
+async def obter_pool():
+    global _pool, _pool_lock
+    if _pool is None:
+        if _pool_lock is None:
+            _pool_lock = asyncio.Lock()
+        async with _pool_lock:
+            if _pool is None:
+                parametros = parametros_conexao()
+                _pool = await asyncpg.create_pool(
+                    host=parametros['host'], port=int(parametros['port']), database=parametros['database'],
+                    user=parametros['user'], password=parametros['password'], timeout=parametros['connect_timeout'],
+                    min_size=ASYNC_POOL_MIN, max_size=ASYNC_POOL_MAX,
+                    max_inactive_connection_lifetime=DB_POOL_OCIOSA_MAX,
+                    # statements nomeados do asyncpg não sobrevivem ao PgBouncer em modo transação
+                    statement_cache_size=DB_PREPARED_MAX if DB_PREPARED_STATEMENTS else 0,
+                )
+                logging.info("Pool asyncpg criado (%d-%d conexões, modo %s)", ASYNC_POOL_MIN, ASYNC_POOL_MAX, DB_MODO_CONEXAO)
+    return _pool
+
+
+async def adquirir(pool, restante_ms):
+    """Conexão do pool; esperar além do prazo da rota é prazo excedido, não banco fora do ar."""
+    try:
+        return await pool.acquire(timeout=None if restante_ms is None else max(restante_ms, 1) / 1000)
+    except asyncio.TimeoutError:
+        registrar_prazo_excedido('pool')
+        raise PrazoExcedido("Prazo excedido esperando conexão do pool assíncrono")
+
+
+async def abrir_transacao(conexao, restante_ms, snapshot=None):
+    transacao = conexao.transaction(isolation='repeatable_read', readonly=True)
+    await transacao.start()
+    if snapshot:
+        await conexao.execute("SET TRANSACTION SNAPSHOT '{}'".format(snapshot.replace("'", "''")))
+    if restante_ms is not None:
+        await conexao.execute("SELECT set_config('statement_timeout', $1, true)", str(max(1, int(restante_ms))))
+    return transacao
+
+
+# --- Execução dos lotes ---
+async def executar_grupo(conexao, grupo):
+    if not isinstance(grupo, GrupoConsulta):
+        raise TypeError(f"O caminho ASGI só executa GrupoConsulta (recebeu {type(grupo).__name__})")
+    texto, ordem = converter_placeholders(texto_sql(grupo.query))
+    valores = [grupo.params[chave] for chave in ordem]
+    # asyncpg.Record não aceita deepcopy nem pickle: o single-flight copia os resultados e o cache os serializa
+    return grupo.finalizar([dict(linha) for linha in await conexao.fetch(texto, *valores)])
+
+
+async def rodar_lote(conexao, lote, resultados):
+    for nome, grupo in lote:
+        if not grupo.opcional:
+            resultados[nome] = await executar_grupo(conexao, grupo)
+            continue
+        try:
+            async with conexao.transaction():  # SAVEPOINT dentro da transação do lote
+                resultados[nome] = await executar_grupo(conexao, grupo)
+        except asyncpg.PostgresError as e:
+            logging.error("Grupo opcional %s falhou: %s", nome, e)
+            resultados[nome] = None
+            resultados.opcionais_falhos.append(nome)
+
+
+async def rodar_lote_em_conexao_propria(pool, lote, resultados, snapshot, restante_ms):
+    conexao = await adquirir(pool, restante_ms)
+    try:
+        transacao = await abrir_transacao(conexao, restante_ms, snapshot)
+        try:
+            await rodar_lote(conexao, lote, resultados)
+        finally:
+            await transacao.rollback()
+    finally:
+        await pool.release(conexao)
+
+
+async def executar_grupos_async(grupos):
+    """
+    Equivalente de executar_grupos_paralelos(): até FANOUT_MAX_CONEXOES conexões do pool por lote,
+    todas no snapshot da primeira, com o prazo restante como statement_timeout. Erros saem como
+    exceções do psycopg2 para que os `except psycopg2.Error` das rotas continuem valendo.
+    """
+    restante_ms = tempo_restante_ms()
+    if restante_ms is not None and restante_ms <= 0:
+        registrar_prazo_excedido('banco')
+        raise PrazoExcedido("Prazo da requisição excedido antes da consulta")
+    tentativa = disjuntor_banco.permitir()
+    if tentativa is None:
+        incrementar_metrica('disjuntor_banco', 'rejeicoes')
+        g.banco_indisponivel = True
+        raise psycopg2.OperationalError("Disjuntor do banco aberto")
+    itens = list(grupos.items())
+    quantidade = max(1, min(FANOUT_MAX_CONEXOES, len(itens)))
+    lotes = [itens[i::quantidade] for i in range(quantidade)]
+
+    resultados = ResultadosLote()
+    try:
+        try:
+            pool = await obter_pool()
+            principal = await adquirir(pool, restante_ms)
+        except BaseException:
+            if tentativa == 'sonda':
+                disjuntor_banco.liberar_sonda()  # como em get_db_connection(): sem conexão, outra requisição sonda
+            raise
+        try:
+            disjuntor_banco.registrar_sucesso()
+            transacao = await abrir_transacao(principal, restante_ms)
+            try:
+                snapshot = await principal.fetchval("SELECT pg_export_snapshot()") if quantidade > 1 else None
+                retornos = await asyncio.gather(
+                    rodar_lote(principal, lotes[0], resultados),
+                    *(rodar_lote_em_conexao_propria(pool, lote, resultados, snapshot, restante_ms) for lote in lotes[1:]),
+                    return_exceptions=True,
+                )
+            finally:
+                await transacao.rollback()  # só leitura; o snapshot precisa viver até todos os lotes terminarem
+        finally:
+            await pool.release(principal)
+        erros = [retorno for retorno in retornos if isinstance(retorno, BaseException)]
+        if erros:
+            raise erros[0]
+    except psycopg2.Error:
+        raise
+    except asyncpg.QueryCanceledError as e:
+        registrar_prazo_excedido('banco')
+        raise PrazoExcedido(str(e)) from e
+    except ERROS_CONEXAO as e:
+        logging.error("Erro de conexão no caminho ASGI: %s", e)
+        marcar_banco_indisponivel()
+        raise psycopg2.OperationalError(str(e)) from e
+    except asyncpg.PostgresError as e:
+        raise psycopg2.DatabaseError(str(e)) from e
+
+    incrementar_metrica('fanout', 'grupos', len(itens))
+    incrementar_metrica('fanout', 'conexoes_extras', quantidade - 1)
+    return resultados
+
+
+# Single-flight no event loop: como coalescer() de app.py, lotes idênticos concorrentes neste processo
+# compartilham uma execução. SINGLE_FLIGHT_COMPARTILHADO (entre processos) não vale neste caminho.
+class VooAsync:
+    __slots__ = ('futuro', 'seguidores')
+
+    def __init__(self):
+        self.futuro = asyncio.get_running_loop().create_future()
+        self.seguidores = 0
+
+
+_voos_async = {}
+
+
+async def coalescer_async(chave, calcular):
+    voo = _voos_async.get(chave)
+    if voo is not None:
+        voo.seguidores += 1
+        incrementar_metrica('single_flight', 'seguidores')
+        try:
+            resultado = await asyncio.wait_for(asyncio.shield(voo.futuro), segundos_para_esperar())
+        except asyncio.TimeoutError:
+            registrar_prazo_excedido('single_flight')
+            raise PrazoExcedido("Prazo excedido esperando computação idêntica em andamento") from None
+        except asyncio.CancelledError:
+            if not voo.futuro.cancelled():
+                raise  # quem foi cancelado é este seguidor
+            # o líder foi cancelado (ex.: o cliente dele desconectou): o primeiro seguidor a acordar assume
+            incrementar_metrica('single_flight', 'lider_cancelado')
+            return await coalescer_async(chave, calcular)
+        except Exception as e:
+            repassar_erro_do_lider(e)
+        return copy.deepcopy(resultado)
+
+    voo = _voos_async[chave] = VooAsync()
+    try:
+        resultado = await calcular()
+    except BaseException as e:
+        if isinstance(e, asyncio.CancelledError):
+            voo.futuro.cancel()
+        else:
+            voo.futuro.set_exception(e)
+            voo.futuro.exception()  # sem seguidores ninguém lê o erro: evita o aviso de exceção não recuperada
+        raise
+    finally:
+        del _voos_async[chave]
+    voo.futuro.set_result(resultado)
+    # o plano do líder continua rodando antes dos seguidores acordarem: ele fica com uma cópia
+    return copy.deepcopy(resultado) if voo.seguidores else resultado
+
+
+async def executar_lote_async(grupos):
+    chave = chave_lote(grupos) if SINGLE_FLIGHT else None
+    if chave is None:
+        return await executar_grupos_async(grupos)
+    schema = session.get('user_schema') or '-'
+    versao = await asyncio.to_thread(versao_cache_tenant, schema)
+    return await coalescer_async(f"{schema}/{versao}/{chave}", lambda: executar_grupos_async(grupos))
+
+
+async def conduzir_plano_async(plano):
+    """Como conduzir_plano() de app.py, mas cada lote é aguardado no event loop e cada ChamadaBloqueante vai para uma thread."""
+    try:
+        pedido = next(plano)
+        while True:
+            if isinstance(pedido, ChamadaBloqueante):
+                try:
+                    valor = await asyncio.to_thread(pedido)
+                except Exception as e:  # volta para o plano, como faria se a rota chamasse direto
+                    pedido = plano.throw(e)
+                else:
+                    pedido = plano.send(valor)
+                continue
+            try:
+                resultados = await executar_lote_async(pedido)
+            except psycopg2.Error as e:
+                g.erro_banco = True
+                pedido = plano.throw(e)
+            else:
+                if resultados.opcionais_falhos:
+                    g.grupo_opcional_falhou = True
+                pedido = plano.send(resultados)
+    except StopIteration as fim:
+        return fim.value
+    finally:
+        plano.close()
+
+
+# --- Adaptação ASGI -> request do Flask ---
+def environ_de_escopo(scope, corpo=b''):
+    """Environ WSGI (PEP 3333) a partir do scope HTTP, para reaproveitar request, sessão e url_for do Flask."""
+    servidor = scope.get('server') or ('localhost', 80)
+    cliente = scope.get('client') or ('', 0)
+    script_name = scope.get('root_path', '')
+    path_info = scope['path']
+    if script_name and path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path_info.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': servidor[0],
+        'SERVER_PORT': str(servidor[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': cliente[0],
+        'REMOTE_PORT': str(cliente[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(corpo),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for nome, valor in scope.get('headers', []):
+        nome = nome.decode('latin-1').upper().replace('-', '_')
+        chave = nome if nome in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f"HTTP_{nome}"
+        valor = valor.decode('latin-1')
+        environ[chave] = f"{environ[chave]},{valor}" if chave in environ else valor
+    return environ
+
+
+def endpoint_de_leitura(environ):
+    adaptador = flask_app.url_map.bind_to_environ(environ)
+    try:
+        endpoint, _ = adaptador.match()
+    except HTTPException:
+        return None
+    return endpoint if endpoint in PLANOS_LEITURA else None
+
+
+async def atender_plano(environ, send):
+    """O equivalente a wsgi_app() + full_dispatch_request() do Flask, com a view conduzida no event loop."""
+    with flask_app.request_context(environ):
+        try:
+            try:
+                # hooks síncronos: o do registro de tenants pode ir ao banco quando o TTL vence
+                resposta = await asyncio.to_thread(flask_app.preprocess_request)
+                if resposta is None:
+                    incrementar_metrica('asgi', f"planos[{request.endpoint}]")
+                    resposta = await conduzir_plano_async(PLANOS_LEITURA[request.endpoint](**request.view_args))
+            except Exception as e:
+                resposta = flask_app.handle_user_exception(e)
+            resposta = flask_app.finalize_request(resposta)
+        except Exception as e:
+            resposta = flask_app.handle_exception(e)
+
+    corpo = b'' if environ['REQUEST_METHOD'] == 'HEAD' else resposta.get_data()
+    cabecalhos = [(nome.lower().encode('latin-1'), valor.encode('latin-1')) for nome, valor in resposta.headers.items()]
+    await send({'type': 'http.response.start', 'status': resposta.status_code, 'headers': cabecalhos})
+    await send({'type': 'http.response.body', 'body': corpo})
+    resposta.close()
+
+
+async def ciclo_de_vida(receive, send):
+    while True:
+        mensagem = await receive()
+        if mensagem['type'] == 'lifespan.startup':
+            await asyncio.to_thread(aquecer_app)
+            try:
+                await obter_pool()
+            except (ERROS_CONEXAO + (asyncpg.PostgresError,)) as e:
+                logging.error("Pool asyncpg não criado no startup (%s); nova tentativa na primeira requisição", e)
+            await send({'type': 'lifespan.startup.complete'})
+        elif mensagem['type'] == 'lifespan.shutdown':
+            if _pool is not None:
+                await _pool.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def aplicacao(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await ciclo_de_vida(receive, send)
+    if scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD'):
+        environ = environ_de_escopo(scope)
+        if endpoint_de_leitura(environ):
+            return await atender_plano(environ, send)
+    return await app_wsgi(scope, receive, send)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Configuração do gunicorn para produção:
+
+    gunicorn -c gunicorn.conf.py
+
+O app é pré-carregado no master (app:criar_app(), que cria o rate limit, compila templates e carrega o
+locale) e os workers nascem por fork já aquecidos; pre_fork/post_fork cuidam do que não pode atravessar o fork
+(conexões do pool, thread de log, cliente de cache). No SIGTERM cada worker para de aceitar conexões
+e termina as requisições em andamento por até WEB_GRACEFUL_TIMEOUT segundos.
+
+WEB_WORKERS (padrão: núcleos), WEB_THREADS (padrão 8), WEB_WORKER_CLASS (padrão gthread),
+WEB_TIMEOUT (30), WEB_GRACEFUL_TIMEOUT (30), WEB_MAX_REQUESTS (0 = sem reciclagem), PORT (3333).
+Com WEB_WORKER_CLASS=gevent o app vem de verde.py e sem pré-carga: o patch do gevent precisa
+acontecer no worker antes de app.py ser importado.
+Com AQUECER_TENANTS_TOP > 0 (e cache compartilhado) o master pré-calcula o dashboard dos tenants mais
+ativos antes de subir os workers; no pipeline, `flask --app app aquecer-tenants` faz o mesmo antes do deploy.
+"""
+import logging
+import multiprocessing
+import os
+
+worker_class = os.environ.get('WEB_WORKER_CLASS', 'gthread')
+if worker_class == 'gevent':
+    wsgi_app = 'verde:app'
+    preload_app = False
+    worker_connections = int(os.environ.get('WEB_WORKER_CONNECTIONS', '500'))
+else:
+    wsgi_app = 'app:criar_app()'
+    preload_app = True
+    threads = int(os.environ.get('WEB_THREADS', '8'))
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '3333')}"
+workers = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count()))
+timeout = int(os.environ.get('WEB_TIMEOUT', '30'))
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', '30'))
+keepalive = 5
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
+accesslog = None  # o app já registra "Requisição concluída" no log estruturado
+
+
+def when_ready(server):
+    if preload_app and workers > 1 and os.environ.get('CACHE_TYPE', 'SimpleCache') == 'SimpleCache':
+        server.log.warning("CACHE_TYPE=SimpleCache com %d workers: cada worker tem o próprio cache de páginas "
+                           "e a invalidação por escrita não chega aos outros", workers)
+    if workers > 1 and os.environ.get('LIMITES_STORAGE_URI', 'memory://').startswith('memory://'):
+        server.log.warning("LIMITES_STORAGE_URI=memory:// com %d workers: cada worker conta o rate limit "
+                           "sozinho e o limite efetivo vira %dx o configurado", workers, workers)
+
+
+def pre_fork(server, worker):
+    if preload_app:
+        import app
+        app.antes_do_fork()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        import app
+        app.apos_fork()
+
+
+def worker_exit(server, worker):
+    if preload_app:
+        import app
+        restantes = len(app._requisicoes_ativas)
+        if restantes:
+            logging.warning("Worker %d saindo com %d requisição(ões) em andamento", worker.pid, restantes)
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks dos caminhos quentes em Python puro do app.py.
+
+Uso:
+    python perf/benchmark.py executar [--saida perf/resultados/atual.json] [--filtro expandir] [--repeticoes 5]
+    python perf/benchmark.py comparar perf/resultados/baseline.json perf/resultados/atual.json [--limite 0.10]
+    python perf/benchmark.py importacao [--saida perf/resultados/import.json] [--top 15] [--repeticoes 5]
+
+`executar` roda cada benchmark em entradas sintéticas parametrizadas (nº de gastos fixos, anos de
+histórico, tamanho do intervalo) e grava os tempos em JSON. `comparar` confronta dois arquivos e
+termina com código 1 se algum caso ficou mais lento que o limite (fração, padrão 10%).
+`importacao` mede o startup: roda `python -X importtime -c "import app"` em processos novos e lista
+o custo acumulado de cada import direto do app.py; o JSON tem o mesmo formato e entra no `comparar`.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import timeit
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+SEMENTE = 20250521
+HOJE = date(2025, 5, 21)
+RECORRENCIAS = ['mensual', 'Mensual', 'mensal', 'bimestral', 'trimestral', 'semestral', 'anual', 'unico', 'Quincenal']
+CATEGORIAS = [f"Categoria {i}" for i in range(20)]
+
+
+# --- Geradores de entradas sintéticas ---
+def gerar_gastos_fixos(rng, quantidade, anos_historico):
+    inicio_mais_antigo = HOJE - timedelta(days=365 * anos_historico)
+    return [{
+        'id': i,
+        'descripcion': f"Gasto fixo {i}",
+        'categoria': rng.choice(CATEGORIAS),
+        'valor': Decimal(rng.randint(100, 500000)) / 100,
+        'fecha_inicio': inicio_mais_antigo + timedelta(days=rng.randint(0, 365 * anos_historico)),
+        'recurrencia': rng.choice(RECORRENCIAS),
+    } for i in range(quantidade)]
+
+
+def gerar_lembretes(rng, quantidade):
+    return [{
+        'id': i,
+        'descripcion': f"Lembrete {i}",
+        'data': HOJE + timedelta(days=rng.randint(-60, 120)),
+        'valor': Decimal(rng.randint(0, 100000)) / 100,
+        'repetir': rng.random() < 0.4,
+        'tipo_repeticion': 'mensal',
+    } for i in range(quantidade)]
+
+
+def gerar_transacoes(rng, quantidade, dias_intervalo):
+    tipos = ['receita', 'gasto_variavel', 'gasto_fixo']
+    return [{
+        'id': i,
+        'data': HOJE - timedelta(days=rng.randint(0, dias_intervalo - 1)),
+        'descripcion': f"Transação {i}",
+        'categoria': rng.choice(CATEGORIAS),
+        'valor': Decimal(rng.randint(100, 500000)) / 100,
+        'tipo': rng.choice(tipos),
+    } for i in range(quantidade)]
+
+
+def gerar_payload_dashboard(rng, dias_intervalo):
+    dias = [HOJE - timedelta(days=i) for i in range(dias_intervalo)][::-1]
+    return {
+        "gastos_categoria_labels": CATEGORIAS,
+        "gastos_categoria_data": [Decimal(rng.randint(100, 500000)) / 100 for _ in CATEGORIAS],
+        "gastos_fixos_categoria_labels": CATEGORIAS[:10],
+        "gastos_fixos_categoria_data": [float(rng.randint(100, 500000)) / 100 for _ in range(10)],
+        "gastos_tempo_labels": [d.strftime('%d/%m') for d in dias],
+        "gastos_tempo_data": [Decimal(rng.randint(0, 50000)) / 100 for _ in dias],
+        "gastos_fixos_tempo_data": [Decimal(rng.randint(0, 50000)) / 100 for _ in dias],
+        "gastos_metodo_labels": ['Efectivo', 'Tarjeta', 'Sin Método Especificado'],
+        "gastos_metodo_data": [Decimal('1234.50'), Decimal('99.90'), Decimal('10.00')],
+    }
+
+
+# --- Definição dos casos ---
+def casos_benchmark():
+    """Gera (nome, parametros, funcao) para cada caso; as entradas são criadas uma única vez por caso."""
+    rng = random.Random(SEMENTE)
+
+    recorrencias = RECORRENCIAS * 100
+    yield 'get_rrule_params', {'entradas': len(recorrencias)}, lambda: [app.get_rrule_params(r) for r in recorrencias]
+
+    for quantidade in (10, 100):
+        for anos in (1, 5):
+            gastos_fixos = gerar_gastos_fixos(rng, quantidade, anos)
+            for dias in (7, 31, 365):
+                inicio = HOJE - timedelta(days=dias - 1)
+                yield ('expandir_gastos_fixos', {'gastos_fixos': quantidade, 'anos_historico': anos, 'dias_intervalo': dias},
+                       lambda gf=gastos_fixos, i=inicio: sum(1 for _ in app.expandir_gastos_fixos(gf, i, HOJE)))
+
+    valores = [Decimal(rng.randint(0, 10000000)) / 100 for _ in range(1000)]
+    yield 'format_currency_filter', {'valores': len(valores)}, lambda: [app.format_currency_filter(v) for v in valores]
+
+    datas = [HOJE - timedelta(days=i) for i in range(500)]
+    datas += [d.strftime('%Y-%m-%d') for d in datas]
+    yield 'format_date_filter', {'valores': len(datas)}, lambda: [app.format_date_filter(d) for d in datas]
+
+    for dias in (7, 31, 365):
+        payload = gerar_payload_dashboard(rng, dias)
+        yield ('json_dumps_dashboard', {'dias_intervalo': dias},
+               lambda p=payload: json.dumps(p, default=app.json_converter))
+
+    for quantidade in (50, 500):
+        lembretes = gerar_lembretes(rng, quantidade)
+        yield 'agrupar_lembretes', {'lembretes': quantidade}, lambda lst=lembretes: app.agrupar_lembretes(lst, HOJE)
+
+    for anos in (1, 5):
+        for linhas_por_ano in (2000, 10000):
+            transacoes = gerar_transacoes(rng, anos * linhas_por_ano, 365 * anos)
+            yield ('agrupar_transacoes_por_data', {'anos_historico': anos, 'linhas_por_ano': linhas_por_ano},
+                   lambda t=transacoes: app.agrupar_transacoes_por_data(list(t)))
+
+
+def chave_caso(nome, parametros):
+    return nome + ''.join(f"[{k}={v}]" for k, v in sorted(parametros.items()))
+
+
+def executar(args):
+    logging.disable(logging.WARNING)  # Mede o cálculo, não o I/O de logs (ex.: avisos de recorrência desconhecida)
+    resultados = {}
+    for nome, parametros, funcao in casos_benchmark():
+        chave = chave_caso(nome, parametros)
+        if args.filtro and args.filtro not in chave:
+            continue
+        timer = timeit.Timer(funcao)
+        numero, _ = timer.autorange()
+        tempos = [t / numero for t in timer.repeat(repeat=args.repeticoes, number=numero)]
+        resultados[chave] = {
+            'nome': nome,
+            'parametros': parametros,
+            'min_us': round(min(tempos) * 1e6, 2),
+            'mediana_us': round(statistics.median(tempos) * 1e6, 2),
+            'numero': numero,
+            'repeticoes': args.repeticoes,
+        }
+        print(f"{chave:<90} min {resultados[chave]['min_us']:>12.2f} us   mediana {resultados[chave]['mediana_us']:>12.2f} us")
+
+    saida = {
+        'gerado_em': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'resultados': resultados,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.saida)), exist_ok=True)
+    with open(args.saida, 'w', encoding='utf-8') as f:
+        json.dump(saida, f, indent=2, ensure_ascii=False)
+    print(f"\nResultados gravados em {args.saida}")
+    return 0
+
+
+def comparar(args):
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)['resultados']
+    with open(args.atual, encoding='utf-8') as f:
+        atual = json.load(f)['resultados']
+
+    regressoes = 0
+    for chave in sorted(set(baseline) | set(atual)):
+        if chave not in atual:
+            print(f"  ausente   {chave}")
+            continue
+        if chave not in baseline:
+            print(f"  novo      {chave}")
+            continue
+        antes, depois = baseline[chave]['min_us'], atual[chave]['min_us']
+        variacao = (depois - antes) / antes if antes else 0.0
+        if variacao > args.limite:
+            marcador = 'REGRESSÃO'
+            regressoes += 1
+        elif variacao < -args.limite:
+            marcador = 'melhora'
+        else:
+            marcador = 'ok'
+        print(f"  {marcador:<9} {chave:<90} {antes:>12.2f} -> {depois:>12.2f} us ({variacao:+.1%})")
+
+    if regressoes:
+        print(f"\n{regressoes} caso(s) acima do limite de {args.limite:.0%}.")
+        return 1
+    print(f"\nNenhuma regressão acima de {args.limite:.0%}.")
+    return 0
+
+
+# --- Tempo de import (startup do worker) ---
+def medir_importacao(modulo):
+    """Um `python -X importtime` num processo novo; devolve [(profundidade, nome, proprio_us, acumulado_us)]."""
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    processo = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {modulo}'], cwd=raiz,
+                              env=dict(os.environ, LOG_NIVEL='ERROR'), capture_output=True, text=True)
+    if processo.returncode != 0:
+        raise SystemExit(f"import {modulo} falhou:\n{processo.stderr[-2000:]}")
+    linhas = []
+    for linha in processo.stderr.splitlines():
+        partes = linha.removeprefix('import time:').split('|')
+        if len(partes) != 3 or not partes[0].strip().isdigit():
+            continue  # cabeçalho ou saída que não é do importtime
+        nome = partes[2].rstrip()
+        profundidade = (len(nome) - len(nome.lstrip()) - 1) // 2
+        linhas.append((profundidade, nome.strip(), int(partes[0]), int(partes[1])))
+    return linhas
+
+
+def importacao(args):
+    # Cada import direto do módulo conta com tudo o que ele puxou e que ainda não estava carregado
+    tempos = {}
+    for _ in range(args.repeticoes):
+        linhas = medir_importacao(args.modulo)
+        # O importtime imprime os filhos antes do pai: os imports do módulo vêm logo acima da linha dele
+        i = max(i for i, linha in enumerate(linhas) if linha[0] == 0 and linha[1] == args.modulo)
+        tempos.setdefault(args.modulo, []).append(linhas[i][3])
+        for profundidade, nome, _proprio, acumulado in reversed(linhas[:i]):
+            if profundidade == 0:
+                break
+            if profundidade == 1:
+                tempos.setdefault(nome, []).append(acumulado)
+
+    resultados = {}
+    for nome, amostras in tempos.items():
+        parametros = {'modulo': nome}
+        resultados[chave_caso('import', parametros)] = {
+            'nome': 'import',
+            'parametros': parametros,
+            'min_us': min(amostras),
+            'mediana_us': statistics.median(amostras),
+            'numero': 1,
+            'repeticoes': len(amostras),
+        }
+
+    total = min(tempos[args.modulo])
+    print(f"import {args.modulo}: min {total / 1000:.1f} ms em {args.repeticoes} processo(s)\n")
+    diretos = sorted((r for r in resultados.values() if r['parametros']['modulo'] != args.modulo),
+                     key=lambda r: r['min_us'], reverse=True)
+    for r in diretos[:args.top]:
+        print(f"  {r['parametros']['modulo']:<40} {r['min_us'] / 1000:>8.1f} ms  {r['min_us'] / total:>6.1%}")
+
+    if args.saida:
+        saida = {
+            'gerado_em': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'plataforma': platform.platform(),
+            'resultados': resultados,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.saida)), exist_ok=True)
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(saida, f, indent=2, ensure_ascii=False)
+        print(f"\nResultados gravados em {args.saida}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='comando', required=True)
+
+    p_exec = sub.add_parser('executar', help='roda os benchmarks e grava um JSON de resultados')
+    p_exec.add_argument('--saida', default=os.path.join('perf', 'resultados', 'atual.json'))
+    p_exec.add_argument('--filtro', help='só roda casos cujo nome contém este texto')
+    p_exec.add_argument('--repeticoes', type=int, default=5)
+    p_exec.set_defaults(func=executar)
+
+    p_comp = sub.add_parser('comparar', help='compara dois JSONs de resultados e acusa regressões')
+    p_comp.add_argument('baseline')
+    p_comp.add_argument('atual')
+    p_comp.add_argument('--limite', type=float, default=0.10, help='regressão tolerada (fração, padrão 0.10)')
+    p_comp.set_defaults(func=comparar)
+
+    p_imp = sub.add_parser('importacao', help='mede o tempo de import do app (python -X importtime)')
+    p_imp.add_argument('--modulo', default='app')
+    p_imp.add_argument('--saida', help='grava um JSON de resultados no formato do executar')
+    p_imp.add_argument('--top', type=int, default=15)
+    p_imp.add_argument('--repeticoes', type=int, default=5)
+    p_imp.set_defaults(func=importacao)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Suíte do caminho ASGI (asgi.py) contra um PostgreSQL de verdade, com asyncpg.
+
+Conduz os planos de leitura no event loop, como o uvicorn faria, e verifica:
+  * coalescencia         --clientes planos idênticos do dashboard ao mesmo tempo (o caso de várias abas):
+                         nenhum erra, uma execução atende os outros (single-flight) e cada um recebe a
+                         própria cópia, sem objetos compartilhados;
+  * resultados_simples   as linhas chegam ao plano como dicts (asyncpg.Record não aceita deepcopy nem pickle);
+  * dashboard_cache      a rota /dashboard inteira duas vezes: a 1ª calcula e guarda o payload no cache sem
+                         erro, a 2ª o encontra fresco, e o cache nunca é lido ou escrito na thread do event loop.
+
+Uso:
+    python perf/compat_asgi.py [--host 127.0.0.1] [--porta 5432] [--manifesto perf/resultados/tenants.json]
+        [--schema user1] [--clientes 4]
+
+Termina com código 1 se alguma verificação falhar.
+"""
+import argparse
+import asyncio
+import copy
+import json
+import os
+import pickle
+import sys
+import threading
+import time
+from datetime import date
+
+import psycopg2
+from flask import g, session
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PRAZO_SEGUNDOS = 30
+
+
+async def rodar_plano(app, asgi, schema, fabricar_plano, caminho='/dashboard', flashes=None):
+    """Um plano num contexto de requisição próprio, como atender_plano() faria para uma requisição."""
+    environ = asgi.environ_de_escopo({'type': 'http', 'method': 'GET', 'path': caminho, 'headers': []})
+    with app.app.request_context(environ):
+        session['user_schema'] = schema
+        session['user_assinatura_id'] = 0
+        g.prazo = time.monotonic() + PRAZO_SEGUNDOS
+        try:
+            return await asgi.conduzir_plano_async(fabricar_plano())
+        finally:
+            if flashes is not None:
+                flashes.extend(session.get('_flashes', []))
+
+
+def objetos_compartilhados(a, b):
+    """ids de dicts/listas que aparecem nos dois resultados (vazio = cópias independentes)."""
+    def conteineres(valor, vistos):
+        if isinstance(valor, (dict, list)):
+            vistos.add(id(valor))
+            for item in (valor.values() if isinstance(valor, dict) else valor):
+                conteineres(item, vistos)
+        return vistos
+    return conteineres(a, set()) & conteineres(b, set())
+
+
+# --- Verificações (corrotinas: todas no mesmo event loop, que é o dono do pool asyncpg) ---
+async def verificar_coalescencia(app, asgi, args):
+    if not args.schema:
+        return None, "sem tenant no manifesto (--schema)"
+    seguidores_antes = app._metricas['single_flight'].get('seguidores', 0)
+
+    planos = [rodar_plano(app, asgi, args.schema, lambda: app.plano_dados_dashboard(args.schema, date.today()))
+              for _ in range(args.clientes)]
+    retornos = await asyncio.gather(*planos, return_exceptions=True)
+    erros = [f"{type(r).__name__}: {r}" for r in retornos if isinstance(r, BaseException)]
+    if erros:
+        return False, "; ".join(erros[:3])
+    seguidores = app._metricas['single_flight'].get('seguidores', 0) - seguidores_antes
+    if seguidores < 1:
+        return False, "nenhum plano aguardou a execução idêntica em andamento"
+    if any(r != retornos[0] for r in retornos[1:]):
+        return False, "resultados divergentes entre os planos coalescidos"
+    for i, a in enumerate(retornos):
+        for b in retornos[i + 1:]:
+            if objetos_compartilhados(a, b):
+                return False, "planos coalescidos compartilham objetos mutáveis"
+    return True, f"{args.clientes} planos simultâneos em {args.schema}, {seguidores} seguidor(es), cópias independentes"
+
+
+async def verificar_resultados_simples(app, asgi, args):
+    if not args.schema:
+        return None, "sem tenant no manifesto (--schema)"
+
+    def plano():
+        resultados = yield {'metodos': app.grupo_metodos_pagamento(args.schema)}
+        return resultados
+
+    resultados = await rodar_plano(app, asgi, args.schema, plano)
+    linhas = resultados['metodos'] or []
+    tipos = {type(linha).__name__ for linha in linhas}
+    if tipos - {'dict'}:
+        return False, f"linhas do tipo {', '.join(sorted(tipos))}"
+    pickle.dumps(copy.deepcopy(resultados))
+    return True, f"{len(linhas)} linha(s) como dict, deepcopy e pickle ok"
+
+
+async def verificar_dashboard_cache(app, asgi, args):
+    if not args.schema:
+        return None, "sem tenant no manifesto (--schema)"
+    thread_do_loop = threading.get_ident()
+    no_loop = []
+    originais = {nome: getattr(app, nome) for nome in ('consultar_dados_dashboard', 'guardar_dados_dashboard')}
+
+    def vigiar(nome):
+        def chamada(*a, **kw):
+            if threading.get_ident() == thread_do_loop:
+                no_loop.append(nome)
+            return originais[nome](*a, **kw)
+        return chamada
+
+    estados = []
+    for nome in originais:
+        setattr(app, nome, vigiar(nome))
+    try:
+        for _ in range(2):
+            flashes = []
+            antes = dict(app._metricas['dashboard_swr'])
+            await rodar_plano(app, asgi, args.schema, app.PLANOS_LEITURA['dashboard'], flashes=flashes)
+            depois = app._metricas['dashboard_swr']
+            estados.append(next((k for k in depois if depois[k] != antes.get(k)), '?'))
+            if flashes:
+                return False, f"flash na {len(estados)}ª requisição: {flashes[0][1]}"
+    finally:
+        for nome, funcao in originais.items():
+            setattr(app, nome, funcao)
+    if no_loop:
+        return False, f"{', '.join(sorted(set(no_loop)))} na thread do event loop"
+    if estados[1] != 'fresco':
+        return False, f"2ª requisição não achou o payload no cache ({' -> '.join(estados)})"
+    return True, f"{' -> '.join(estados)}, cache fora do event loop"
+
+
+VERIFICACOES = [
+    ('coalescencia', verificar_coalescencia),
+    ('resultados_simples', verificar_resultados_simples),
+    ('dashboard_cache', verificar_dashboard_cache),
+]
+
+
+async def rodar_verificacoes(app, asgi, args):
+    falhas = 0
+    try:
+        for nome, verificacao in VERIFICACOES:
+            try:
+                ok, detalhe = await verificacao(app, asgi, args)
+            except (psycopg2.Error, OSError, TypeError) as e:
+                ok, detalhe = False, f"{type(e).__name__}: {e}".strip()
+            marcador = 'pulado' if ok is None else ('ok' if ok else 'FALHOU')
+            falhas += ok is False
+            print(f"  {marcador:<7} {nome:<20} {detalhe}")
+    finally:
+        if asgi._pool is not None:
+            await asgi._pool.close()
+    return falhas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=os.environ.get('DB_HOST', '127.0.0.1'))
+    parser.add_argument('--porta', default=os.environ.get('DB_PORT', '5432'))
+    parser.add_argument('--banco', default=os.environ.get('DB_NAME', 'postgres'))
+    parser.add_argument('--usuario', default=os.environ.get('DB_USER', 'postgres'))
+    parser.add_argument('--senha', default=os.environ.get('DB_PASSWORD', 'typebot'))
+    parser.add_argument('--manifesto', default=os.path.join('perf', 'resultados', 'tenants.json'))
+    parser.add_argument('--schema', help='tenant dos planos (padrão: o primeiro do manifesto)')
+    parser.add_argument('--clientes', type=int, default=4, help='planos idênticos simultâneos (padrão 4)')
+    args = parser.parse_args(argv)
+
+    if not args.schema and os.path.exists(args.manifesto):
+        with open(args.manifesto, encoding='utf-8') as f:
+            tenants = json.load(f)['tenants']
+        args.schema = tenants[0]['schema'] if tenants else None
+
+    os.environ.update({
+        'DB_HOST': args.host, 'DB_PORT': str(args.porta), 'DB_NAME': args.banco,
+        'DB_USER': args.usuario, 'DB_PASSWORD': args.senha,
+        'SINGLE_FLIGHT': '1',
+        'LOG_NIVEL': os.environ.get('LOG_NIVEL', 'WARNING'),
+    })
+    import app  # noqa: E402 -- precisa das variáveis acima já definidas
+    import asgi  # noqa: E402
+
+    falhas = asyncio.run(rodar_verificacoes(app, asgi, args))
+    if falhas:
+        print(f"\n{falhas} verificação(ões) falharam.")
+        return 1
+    print("\nCaminho ASGI ok.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Suíte de compatibilidade do app com PgBouncer em modo transação (pool_mode = transaction).
+
+Importa o app com DB_MODO_CONEXAO=pgbouncer_transacao apontando para um PgBouncer local e verifica
+que nenhum estado de sessão vaza entre transações:
+  * modo_conexao         o app desligou os statements preparados nomeados;
+  * pool_mode            (com --admin-dsn) o PgBouncer está mesmo em pool_mode=transaction;
+  * consultas_quentes    as consultas do dashboard rodam via executar_preparado() sem criar
+                         statements nomeados no servidor;
+  * parametros_locais    definir_parametros_transacao() vale dentro da transação e some depois do commit;
+  * concorrencia         muitas conexões de cliente multiplexadas em poucos backends: cada transação só
+                         enxerga o próprio contexto de tenant.
+
+Uso:
+    python perf/compat_pgbouncer.py --host 127.0.0.1 --porta 6432 [--admin-dsn "dbname=pgbouncer port=6432 user=postgres"]
+        [--manifesto perf/resultados/tenants.json] [--clientes 50] [--transacoes 20]
+
+Termina com código 1 se alguma verificação falhar.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import date
+
+import psycopg2
+from psycopg2 import sql
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# --- Verificações ---
+def obter_conexao(app):
+    conn = app.get_db_connection()
+    if conn is None:
+        raise psycopg2.OperationalError("get_db_connection() não conseguiu conectar (ver logs do app)")
+    return conn
+
+
+def verificar_modo_conexao(app, args):
+    if app.DB_MODO_CONEXAO != 'pgbouncer_transacao':
+        return False, f"DB_MODO_CONEXAO={app.DB_MODO_CONEXAO}"
+    if app.DB_PREPARED_STATEMENTS:
+        return False, "statements preparados nomeados continuam ligados"
+    return True, "pgbouncer_transacao, statements não nomeados"
+
+
+def verificar_pool_mode(app, args):
+    if not args.admin_dsn:
+        return None, "sem --admin-dsn"
+    conn = psycopg2.connect(args.admin_dsn)
+    conn.autocommit = True  # o console do PgBouncer não aceita BEGIN
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SHOW CONFIG")
+            config = {linha[0]: linha[1] for linha in cur.fetchall()}
+    finally:
+        conn.close()
+    pool_mode = config.get('pool_mode')
+    return pool_mode == 'transaction', f"pool_mode={pool_mode}, default_pool_size={config.get('default_pool_size')}"
+
+
+def verificar_consultas_quentes(app, args):
+    if not args.schema:
+        return None, "sem tenant no manifesto (--schema)"
+    hoje = date.today()
+    inicio = hoje.replace(day=1)
+    schema = sql.Identifier(args.schema)
+    consultas = [
+        (sql.SQL("SELECT COALESCE(SUM(valor), 0) FROM {schema}.gastos WHERE data BETWEEN %s AND %s").format(schema=schema), (inicio, hoje)),
+        (sql.SQL("SELECT categoria, SUM(valor) FROM {schema}.gastos WHERE data BETWEEN %(data_inicio)s AND %(data_fim)s "
+                 "GROUP BY categoria").format(schema=schema), {'data_inicio': inicio, 'data_fim': hoje}),
+        (sql.SQL("SELECT id, fecha_inicio, valor, recurrencia FROM {schema}.gastos_fixos "
+                 "WHERE activo = TRUE AND fecha_inicio <= %s").format(schema=schema), (hoje,)),
+    ]
+    for _ in range(3):  # repetido: em modo direto, a 2ª rodada já usaria EXECUTE
+        conn = obter_conexao(app)
+        try:
+            with conn.cursor() as cur:
+                for consulta, params in consultas:
+                    app.executar_preparado(cur, consulta, params)
+                    cur.fetchall()
+                cur.execute("SELECT count(*) FROM pg_prepared_statements WHERE name LIKE 'app_stmt_%'")
+                nomeados = cur.fetchone()[0]
+            conn.commit()
+        finally:
+            conn.close()
+        if nomeados:
+            return False, f"{nomeados} statement(s) nomeado(s) no backend"
+    return True, f"{len(consultas)} consultas x 3 rodadas em {args.schema}, nenhum statement nomeado"
+
+
+def verificar_parametros_locais(app, args):
+    conn = obter_conexao(app)
+    try:
+        with conn.cursor() as cur:
+            app.definir_parametros_transacao(cur, {'app.tenant': 'tenant_compat', 'statement_timeout': '1234ms'})
+            cur.execute("SELECT current_setting('app.tenant', true), current_setting('statement_timeout')")
+            dentro = cur.fetchone()
+            conn.commit()
+            cur.execute("SELECT current_setting('app.tenant', true), current_setting('statement_timeout')")
+            depois = cur.fetchone()
+            conn.commit()
+    finally:
+        conn.close()
+    if tuple(dentro) != ('tenant_compat', '1234ms'):
+        return False, f"dentro da transação: {tuple(dentro)}"
+    if depois[0] or depois[1] == '1234ms':
+        return False, f"vazou para a transação seguinte: {tuple(depois)}"
+    return True, "SET LOCAL restrito à transação"
+
+
+def verificar_concorrencia(app, args):
+    erros, divergencias = [], []
+    backends = Counter()
+    lock = threading.Lock()
+
+    def cliente(indice):
+        for transacao in range(args.transacoes):
+            contexto = f"cliente{indice}_tx{transacao}"
+            conn = app.get_db_connection()
+            if conn is None:
+                with lock:
+                    erros.append(f"{contexto}: sem conexão")
+                continue
+            try:
+                with conn.cursor() as cur:
+                    app.definir_parametros_transacao(cur, {'app.tenant': contexto})
+                    cur.execute("SELECT pg_backend_pid(), pg_sleep(%s)", (args.espera_ms / 1000.0,))
+                    pid = cur.fetchone()[0]
+                    cur.execute("SELECT current_setting('app.tenant', true)")
+                    visto = cur.fetchone()[0]
+                conn.commit()
+                with lock:
+                    backends[pid] += 1
+                    if visto != contexto:
+                        divergencias.append(f"{contexto} viu {visto!r}")
+            except psycopg2.Error as e:
+                with lock:
+                    erros.append(f"{contexto}: {e}".strip())
+            finally:
+                conn.close()
+
+    inicio = time.perf_counter()
+    threads = [threading.Thread(target=cliente, args=(i,)) for i in range(args.clientes)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    duracao = time.perf_counter() - inicio
+
+    detalhe = (f"{args.clientes} clientes x {args.transacoes} transações em {duracao:.1f}s, "
+               f"{len(backends)} backend(s) distintos")
+    if divergencias or erros:
+        return False, detalhe + "; " + "; ".join((divergencias + erros)[:5])
+    return True, detalhe
+
+
+VERIFICACOES = [
+    ('modo_conexao', verificar_modo_conexao),
+    ('pool_mode', verificar_pool_mode),
+    ('consultas_quentes', verificar_consultas_quentes),
+    ('parametros_locais', verificar_parametros_locais),
+    ('concorrencia', verificar_concorrencia),
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--porta', default='6432', help='porta do PgBouncer (padrão 6432)')
+    parser.add_argument('--banco', default=os.environ.get('DB_NAME', 'postgres'))
+    parser.add_argument('--usuario', default=os.environ.get('DB_USER', 'postgres'))
+    parser.add_argument('--senha', default=os.environ.get('DB_PASSWORD', 'typebot'))
+    parser.add_argument('--admin-dsn', help='DSN do console administrativo do PgBouncer (banco "pgbouncer")')
+    parser.add_argument('--manifesto', default=os.path.join('perf', 'resultados', 'tenants.json'))
+    parser.add_argument('--schema', help='tenant para as consultas quentes (padrão: o primeiro do manifesto)')
+    parser.add_argument('--clientes', type=int, default=50, help='threads/conexões de cliente simultâneas (padrão 50)')
+    parser.add_argument('--transacoes', type=int, default=20, help='transações por cliente (padrão 20)')
+    parser.add_argument('--espera-ms', type=float, default=5, help='pg_sleep dentro de cada transação (padrão 5)')
+    args = parser.parse_args(argv)
+
+    if not args.schema and os.path.exists(args.manifesto):
+        with open(args.manifesto, encoding='utf-8') as f:
+            tenants = json.load(f)['tenants']
+        args.schema = tenants[0]['schema'] if tenants else None
+
+    os.environ.update({
+        'DB_MODO_CONEXAO': 'pgbouncer_transacao',
+        'DB_HOST': args.host, 'DB_PORT': str(args.porta), 'DB_NAME': args.banco,
+        'DB_USER': args.usuario, 'DB_PASSWORD': args.senha,
+        'DB_POOL_MAX': str(args.clientes),  # mais conexões de cliente que o default_pool_size do PgBouncer
+        'LOG_NIVEL': os.environ.get('LOG_NIVEL', 'WARNING'),
+    })
+    import app  # noqa: E402 -- precisa das variáveis acima já definidas
+
+    falhas = 0
+    for nome, verificacao in VERIFICACOES:
+        try:
+            ok, detalhe = verificacao(app, args)
+        except (psycopg2.Error, OSError) as e:
+            ok, detalhe = False, f"{type(e).__name__}: {e}".strip()
+        marcador = 'pulado' if ok is None else ('ok' if ok else 'FALHOU')
+        falhas += ok is False
+        print(f"  {marcador:<7} {nome:<20} {detalhe}")
+
+    if falhas:
+        print(f"\n{falhas} verificação(ões) falharam.")
+        return 1
+    print("\nApp compatível com PgBouncer em modo transação.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
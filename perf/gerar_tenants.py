@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+"""
+Gerador de tenants sintéticos para benchmarks e testes de carga (PostgreSQL local).
+
+Cria N tenants completos: linhas em clientes.assinaturas / clientes.dashboard_usuarios e um schema
+user<telefone> com categorias, metodos_pagamento, gastos, gastos_fixos (recorrências variadas,
+incluindo 'Quincenal'), outras_receitas, lembretes e metas. Os dados são carregados com COPY e
+são determinísticos a partir da semente: a mesma linha de comando gera sempre o mesmo banco.
+
+Uso:
+    python perf/gerar_tenants.py --tenants 50 --anos 3 --linhas-por-ano 2000 --gastos-fixos 20 --semente 42
+    python perf/gerar_tenants.py --tenants 10 --escala 5          # 5x o volume padrão por tenant
+
+A conexão usa DB_HOST/DB_NAME/DB_USER/DB_PASSWORD (ou --dsn). NUNCA aponte para produção:
+os schemas dos tenants gerados são recriados (DROP SCHEMA ... CASCADE).
+Ao final é gravado um manifesto JSON (email, senha, schema) usado pelo teste de carga.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+import psycopg2
+from psycopg2 import sql
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import gerar_hash_senha, gerar_nome_schema, notificar_alteracao_schema  # noqa: E402
+
+VERSAO_SCHEMA = 1
+
+DDL_CLIENTES = """
+CREATE SCHEMA IF NOT EXISTS clientes;
+CREATE TABLE IF NOT EXISTS clientes.assinaturas (
+    id_interno SERIAL PRIMARY KEY,
+    telefone_whatsapp VARCHAR(30) NOT NULL,
+    nome_cliente VARCHAR(150),
+    email VARCHAR(200)
+);
+CREATE TABLE IF NOT EXISTS clientes.dashboard_usuarios (
+    id SERIAL PRIMARY KEY,
+    email VARCHAR(200) NOT NULL UNIQUE,
+    senha_hash TEXT NOT NULL,
+    id_cliente_assinatura INTEGER REFERENCES clientes.assinaturas(id_interno)
+);
+"""
+
+DDL_TENANT = """
+CREATE SCHEMA {schema};
+CREATE TABLE {schema}.categorias (
+    id SERIAL PRIMARY KEY,
+    nome VARCHAR(100) NOT NULL,
+    tipo VARCHAR(30) NOT NULL,
+    is_fixa BOOLEAN NOT NULL DEFAULT FALSE,
+    limite NUMERIC(12,2),
+    criado_em TIMESTAMPTZ DEFAULT NOW(),
+    atualizado_em TIMESTAMPTZ DEFAULT NOW(),
+    UNIQUE (nome, tipo)
+);
+CREATE TABLE {schema}.metodos_pagamento (
+    id SERIAL PRIMARY KEY,
+    nome VARCHAR(100) NOT NULL,
+    tipo VARCHAR(30) NOT NULL,
+    modalidad VARCHAR(20) DEFAULT 'na',
+    ativo BOOLEAN NOT NULL DEFAULT TRUE,
+    criado_em TIMESTAMPTZ DEFAULT NOW(),
+    atualizado_em TIMESTAMPTZ DEFAULT NOW()
+);
+CREATE TABLE {schema}.gastos (
+    id SERIAL PRIMARY KEY,
+    descripcion TEXT,
+    valor NUMERIC(12,2) NOT NULL,
+    categoria VARCHAR(100),
+    data DATE NOT NULL,
+    metodo_pagamento_id INTEGER REFERENCES {schema}.metodos_pagamento(id),
+    metodo_nome VARCHAR(100),
+    metodo_tipo VARCHAR(30),
+    metodo_modalidad VARCHAR(20)
+);
+CREATE TABLE {schema}.gastos_fixos (
+    id SERIAL PRIMARY KEY,
+    descripcion TEXT,
+    valor NUMERIC(12,2) NOT NULL,
+    categoria VARCHAR(100),
+    fecha_inicio DATE NOT NULL,
+    recurrencia VARCHAR(30) NOT NULL,
+    activo BOOLEAN NOT NULL DEFAULT TRUE,
+    metodo_pagamento_id INTEGER REFERENCES {schema}.metodos_pagamento(id)
+);
+CREATE TABLE {schema}.outras_receitas (
+    id SERIAL PRIMARY KEY,
+    fecha DATE NOT NULL,
+    categoria VARCHAR(100),
+    descripcion TEXT,
+    valor NUMERIC(12,2) NOT NULL
+);
+CREATE TABLE {schema}.lembretes (
+    id SERIAL PRIMARY KEY,
+    descripcion TEXT NOT NULL,
+    data DATE NOT NULL,
+    valor NUMERIC(12,2) DEFAULT 0,
+    repetir BOOLEAN DEFAULT FALSE,
+    tipo_repeticion VARCHAR(20)
+);
+CREATE TABLE {schema}.metas (
+    id SERIAL PRIMARY KEY,
+    descricao TEXT NOT NULL,
+    categoria VARCHAR(50),
+    prazo_meses INTEGER,
+    valor_alvo NUMERIC(12,2) NOT NULL,
+    valor_mensal_sugerido NUMERIC(12,2),
+    data_inicio DATE,
+    data_conclusao_prevista DATE,
+    valor_atual NUMERIC(12,2) NOT NULL DEFAULT 0,
+    status VARCHAR(20) NOT NULL DEFAULT 'ativa',
+    criado_em TIMESTAMPTZ DEFAULT NOW(),
+    atualizado_em TIMESTAMPTZ DEFAULT NOW()
+);
+CREATE INDEX ON {schema}.gastos (data);
+CREATE INDEX ON {schema}.gastos (categoria);
+CREATE INDEX ON {schema}.outras_receitas (fecha);
+CREATE INDEX ON {schema}.gastos_fixos (activo, fecha_inicio);
+CREATE INDEX ON {schema}.lembretes (data);
+"""
+
+CATEGORIAS = {
+    'receita': ['Salario', 'Freelance', 'Inversiones', 'Otros ingresos'],
+    'gasto_variavel': ['Supermercado', 'Restaurantes', 'Transporte', 'Entretenimiento', 'Salud',
+                       'Ropa', 'Hogar', 'Educación', 'Mascotas', 'Regalos'],
+    'gasto_fixo': ['Renta', 'Luz', 'Agua', 'Internet', 'Teléfono', 'Seguro', 'Gimnasio', 'Streaming', 'Colegiatura'],
+}
+CATEGORIAS_FIXAS = {'Salario', 'Supermercado', 'Renta'}
+METODOS_PAGAMENTO = [
+    ('Efectivo', 'efectivo', 'na'),
+    ('Tarjeta BBVA', 'tarjeta', 'credito'),
+    ('Tarjeta Nu', 'tarjeta', 'debito'),
+    ('Mercado Pago', 'digital', 'na'),
+    ('Transferencia SPEI', 'transferencia', 'na'),
+]
+# (recorrência, peso) — inclui variações de grafia e recorrências sem regra no app ('Quincenal').
+RECORRENCIAS = [('mensual', 55), ('Mensual', 5), ('mensal', 3), ('bimestral', 5), ('trimestral', 5),
+                ('semestral', 3), ('anual', 7), ('unico', 7), ('Quincenal', 10)]
+CATEGORIAS_METAS = ['Viaje', 'Compra', 'Ahorrar dinero', 'Otros']
+
+
+def valor_aleatorio(rng, minimo, maximo):
+    """Valor monetário com cauda longa (a maioria dos gastos é pequena)."""
+    bruto = minimo * (maximo / minimo) ** (rng.random() ** 2)
+    return Decimal(str(round(bruto, 2)))
+
+
+def data_aleatoria(rng, inicio, fim):
+    return inicio + timedelta(days=rng.randint(0, (fim - inicio).days))
+
+
+def copy_linhas(cur, schema, tabela, colunas, linhas):
+    """Carrega as linhas com COPY ... FROM STDIN (CSV)."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    for linha in linhas:
+        escritor.writerow(['' if v is None else v for v in linha])
+    buffer.seek(0)
+    comando = sql.SQL("COPY {schema}.{tabela} ({colunas}) FROM STDIN WITH (FORMAT csv)").format(
+        schema=sql.Identifier(schema), tabela=sql.Identifier(tabela),
+        colunas=sql.SQL(', ').join(sql.Identifier(c) for c in colunas))
+    cur.copy_expert(comando.as_string(cur), buffer)
+    return len(linhas)
+
+
+def gerar_dados_tenant(rng, hoje, anos, linhas_por_ano, qtd_gastos_fixos, receitas_por_ano, qtd_lembretes, qtd_metas):
+    inicio = hoje - timedelta(days=365 * anos)
+    dados = {}
+
+    categorias = []
+    for tipo, nomes in CATEGORIAS.items():
+        for nome in nomes:
+            limite = valor_aleatorio(rng, 500, 8000) if tipo == 'gasto_variavel' and rng.random() < 0.3 else None
+            categorias.append((len(categorias) + 1, nome, tipo, nome in CATEGORIAS_FIXAS, limite))
+    dados['categorias'] = (['id', 'nome', 'tipo', 'is_fixa', 'limite'], categorias)
+
+    metodos = [(i + 1, nome, tipo, modalidad, True) for i, (nome, tipo, modalidad) in enumerate(METODOS_PAGAMENTO)]
+    dados['metodos_pagamento'] = (['id', 'nome', 'tipo', 'modalidad', 'ativo'], metodos)
+
+    gastos = []
+    for _ in range(anos * linhas_por_ano):
+        categoria = rng.choice(CATEGORIAS['gasto_variavel'])
+        metodo = rng.choice(metodos) if rng.random() < 0.8 else None
+        gastos.append((f"{categoria} #{rng.randint(1, 9999)}", valor_aleatorio(rng, 15, 4000), categoria,
+                       data_aleatoria(rng, inicio, hoje), metodo[0] if metodo else None,
+                       metodo[1] if metodo else None, metodo[2] if metodo else None, metodo[3] if metodo else None))
+    dados['gastos'] = (['descripcion', 'valor', 'categoria', 'data', 'metodo_pagamento_id',
+                        'metodo_nome', 'metodo_tipo', 'metodo_modalidad'], gastos)
+
+    nomes_recorrencias = [r for r, _ in RECORRENCIAS]
+    pesos_recorrencias = [p for _, p in RECORRENCIAS]
+    gastos_fixos = []
+    for _ in range(qtd_gastos_fixos):
+        categoria = rng.choice(CATEGORIAS['gasto_fixo'])
+        recorrencia = rng.choices(nomes_recorrencias, pesos_recorrencias)[0]
+        gastos_fixos.append((categoria, valor_aleatorio(rng, 100, 15000), categoria, data_aleatoria(rng, inicio, hoje),
+                             recorrencia, rng.random() < 0.9, rng.choice(metodos)[0] if rng.random() < 0.5 else None))
+    dados['gastos_fixos'] = (['descripcion', 'valor', 'categoria', 'fecha_inicio', 'recurrencia', 'activo',
+                              'metodo_pagamento_id'], gastos_fixos)
+
+    receitas = []
+    salario = valor_aleatorio(rng, 6000, 40000)
+    mes = date(inicio.year, inicio.month, 15)
+    while mes <= hoje:  # Salário quinzenal: dias 15 e último dia do mês
+        receitas.append((mes, 'Salario', 'Quincena', salario))
+        fim_mes = (mes.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+        if fim_mes <= hoje:
+            receitas.append((fim_mes, 'Salario', 'Quincena', salario))
+        mes = fim_mes + timedelta(days=15)
+    for _ in range(anos * receitas_por_ano):
+        categoria = rng.choice(CATEGORIAS['receita'][1:])
+        receitas.append((data_aleatoria(rng, inicio, hoje), categoria, f"{categoria} extra", valor_aleatorio(rng, 200, 20000)))
+    dados['outras_receitas'] = (['fecha', 'categoria', 'descripcion', 'valor'], receitas)
+
+    lembretes = []
+    for i in range(qtd_lembretes):
+        repetir = rng.random() < 0.4
+        lembretes.append((f"Recordatorio {i + 1}", data_aleatoria(rng, hoje - timedelta(days=60), hoje + timedelta(days=120)),
+                          valor_aleatorio(rng, 50, 5000) if rng.random() < 0.7 else Decimal('0.00'),
+                          repetir, 'mensal' if repetir else None))
+    dados['lembretes'] = (['descripcion', 'data', 'valor', 'repetir', 'tipo_repeticion'], lembretes)
+
+    metas = []
+    for i in range(qtd_metas):
+        prazo = rng.choice([6, 12, 24, None])
+        alvo = valor_aleatorio(rng, 5000, 200000)
+        inicio_meta = data_aleatoria(rng, inicio, hoje)
+        atual = (alvo * Decimal(str(round(rng.random(), 2)))).quantize(Decimal('0.01'))
+        status = rng.choices(['ativa', 'concluida', 'cancelada'], [70, 20, 10])[0]
+        metas.append((f"Meta {i + 1}", rng.choice(CATEGORIAS_METAS), prazo, alvo,
+                      (alvo / prazo).quantize(Decimal('0.01')) if prazo else None, inicio_meta,
+                      inicio_meta + timedelta(days=30 * prazo) if prazo else None,
+                      alvo if status == 'concluida' else atual, status))
+    dados['metas'] = (['descricao', 'categoria', 'prazo_meses', 'valor_alvo', 'valor_mensal_sugerido', 'data_inicio',
+                       'data_conclusao_prevista', 'valor_atual', 'status'], metas)
+    return dados
+
+
+def provisionar_tenant(conn, indice, args, hoje, senha_hash):
+    rng = random.Random(f"{args.semente}:{indice}")
+    telefone = f"52{args.prefixo_telefone}{indice:06d}"
+    schema = gerar_nome_schema(telefone)
+    email = f"tenant{indice:05d}@{args.dominio}"
+    escala = args.escala
+
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("DROP SCHEMA IF EXISTS {} CASCADE").format(sql.Identifier(schema)))
+        cur.execute("DELETE FROM clientes.dashboard_usuarios WHERE email = %s", (email,))
+        cur.execute("DELETE FROM clientes.assinaturas WHERE email = %s", (email,))
+        cur.execute("INSERT INTO clientes.assinaturas (telefone_whatsapp, nome_cliente, email) VALUES (%s, %s, %s) RETURNING id_interno",
+                    (telefone, f"Tenant Sintético {indice}", email))
+        id_assinatura = cur.fetchone()[0]
+        cur.execute("INSERT INTO clientes.dashboard_usuarios (email, senha_hash, id_cliente_assinatura) VALUES (%s, %s, %s)",
+                    (email, senha_hash, id_assinatura))
+
+        cur.execute(sql.SQL(DDL_TENANT).format(schema=sql.Identifier(schema)))
+        dados = gerar_dados_tenant(
+            rng, hoje, args.anos,
+            linhas_por_ano=int(args.linhas_por_ano * escala),
+            qtd_gastos_fixos=int(args.gastos_fixos * escala),
+            receitas_por_ano=int(args.receitas_por_ano * escala),
+            qtd_lembretes=int(args.lembretes * escala),
+            qtd_metas=args.metas,
+        )
+        contagens = {}
+        for tabela, (colunas, linhas) in dados.items():
+            contagens[tabela] = copy_linhas(cur, schema, tabela, colunas, linhas)
+        for tabela in ('categorias', 'metodos_pagamento'):
+            cur.execute(sql.SQL("SELECT setval(pg_get_serial_sequence(%s, 'id'), (SELECT MAX(id) FROM {schema}.{tabela}))").format(
+                schema=sql.Identifier(schema), tabela=sql.Identifier(tabela)), (f"{schema}.{tabela}",))
+        cur.execute(sql.SQL("COMMENT ON SCHEMA {} IS %s").format(sql.Identifier(schema)),
+                    (json.dumps({'versao_schema': VERSAO_SCHEMA, 'sintetico': True, 'semente': args.semente}),))
+        for tabela in dados:
+            cur.execute(sql.SQL("ANALYZE {schema}.{tabela}").format(schema=sql.Identifier(schema), tabela=sql.Identifier(tabela)))
+        notificar_alteracao_schema(cur, schema)  # entregue no commit; workers com LISTEN recarregam o registro
+    conn.commit()
+    return {'indice': indice, 'email': email, 'senha': args.senha, 'schema': schema, 'telefone': telefone, 'linhas': contagens}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tenants', type=int, default=10, help='número de tenants (padrão 10)')
+    parser.add_argument('--escala', type=float, default=1.0, help='multiplicador do volume por tenant (padrão 1.0)')
+    parser.add_argument('--anos', type=int, default=2, help='anos de histórico (padrão 2)')
+    parser.add_argument('--linhas-por-ano', type=int, default=1500, help='gastos variáveis por ano (padrão 1500)')
+    parser.add_argument('--gastos-fixos', type=int, default=15, help='gastos fixos por tenant (padrão 15)')
+    parser.add_argument('--receitas-por-ano', type=int, default=24, help='receitas extras por ano, além do salário (padrão 24)')
+    parser.add_argument('--lembretes', type=int, default=20)
+    parser.add_argument('--metas', type=int, default=3)
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--hoje', type=date.fromisoformat, default=None,
+                        help='data de referência AAAA-MM-DD (padrão: hoje; fixe-a para bancos idênticos entre dias)')
+    parser.add_argument('--prefixo-telefone', default='1990', help='prefixo dos telefones/schemas sintéticos')
+    parser.add_argument('--dominio', default='sintetico.test')
+    parser.add_argument('--senha', default='senha-sintetica', help='senha de todos os usuários gerados')
+    parser.add_argument('--dsn', help='DSN do PostgreSQL (padrão: variáveis DB_*)')
+    parser.add_argument('--manifesto', default=os.path.join('perf', 'resultados', 'tenants.json'))
+    args = parser.parse_args(argv)
+
+    hoje = args.hoje or date.today()
+    if args.dsn:
+        conn = psycopg2.connect(args.dsn)
+    else:
+        conn = psycopg2.connect(host=os.environ.get('DB_HOST', 'localhost'), port=os.environ.get('DB_PORT', '5432'),
+                                database=os.environ.get('DB_NAME', 'postgres'), user=os.environ.get('DB_USER', 'postgres'),
+                                password=os.environ.get('DB_PASSWORD', 'typebot'))
+    try:
+        with conn.cursor() as cur:
+            cur.execute(DDL_CLIENTES)
+        conn.commit()
+
+        senha_hash = gerar_hash_senha(args.senha)
+        tenants = []
+        inicio = time.perf_counter()
+        for indice in range(args.tenants):
+            tenant = provisionar_tenant(conn, indice, args, hoje, senha_hash)
+            tenants.append(tenant)
+            print(f"[{indice + 1}/{args.tenants}] {tenant['schema']}: {sum(tenant['linhas'].values())} linhas")
+    finally:
+        conn.close()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.manifesto)), exist_ok=True)
+    with open(args.manifesto, 'w', encoding='utf-8') as f:
+        json.dump({'semente': args.semente, 'hoje': hoje.isoformat(), 'parametros': vars(args) | {'hoje': hoje.isoformat()},
+                   'tenants': tenants}, f, indent=2, ensure_ascii=False)
+    print(f"{len(tenants)} tenants em {time.perf_counter() - inicio:.1f}s. Manifesto: {args.manifesto}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
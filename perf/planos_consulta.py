@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+Teste de regressão de planos de consulta (PostgreSQL local com tenants sintéticos).
+
+Roda cada consulta nomeada do app com EXPLAIN (FORMAT JSON) contra um schema gerado por
+perf/gerar_tenants.py e reduz o plano a uma "impressão digital": tipos de nó, relações, índices
+usados, estratégias de junção e linhas estimadas.
+
+Uso:
+    python perf/planos_consulta.py capturar [--saida perf/planos/baseline.json]
+    python perf/planos_consulta.py verificar [--baseline perf/planos/baseline.json] [--estrito]
+    python perf/planos_consulta.py mostrar dashboard.gastos_metodo_por_dia
+
+`verificar` termina com código 1 quando uma consulta quente perde o caminho por índice de alguma
+relação (ex.: Seq Scan em gastos no filtro `data BETWEEN`) ou troca a estratégia de junção
+(ex.: o LEFT JOIN em metodos_pagamento virando Hash Join sobre a tabela inteira). Outras mudanças
+de forma e desvios grandes de linhas estimadas são avisos (falham só com --estrito).
+
+O schema e a data de referência vêm do manifesto do gerador (--manifesto), ou de --schema/--hoje.
+As páginas de /gastos e /receitas entram em cada ordenação aceita pelas rotas, com e sem filtro de
+categoria, montadas com ITEMS_PER_PAGE e as ordenações de app.py.
+Sempre regenere o baseline depois de mudar índices de propósito e faça commit do JSON junto.
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import date, timedelta
+
+import psycopg2
+from psycopg2 import sql
+
+NOS_COM_INDICE = {'Index Scan', 'Index Only Scan', 'Bitmap Heap Scan'}
+NOS_DE_JUNCAO = {'Nested Loop', 'Hash Join', 'Merge Join'}
+TABELAS_TENANT = ['categorias', 'metodos_pagamento', 'gastos', 'gastos_fixos', 'outras_receitas', 'lembretes', 'metas']
+CATEGORIA_FILTRO = 'Supermercado'
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# --- Catálogo de consultas do app ---
+def periodos(hoje):
+    """Intervalos usados pelas telas: mês corrente (gastos), união dos períodos do dashboard e último ano (relatórios)."""
+    return {
+        'inicio_mes': hoje.replace(day=1),
+        # o dashboard busca de uma vez mes_atual, 15d e 7d (ver plano_dados_dashboard)
+        'inicio_dashboard': min(hoje.replace(day=1), hoje - timedelta(days=14)),
+        'inicio_ano': hoje - timedelta(days=364),
+        'hoje': hoje,
+    }
+
+
+# (nome, quente, sql com {schema}, parâmetros nomeados). Mantenha em sincronia com app.py.
+CONSULTAS = [
+    ('dashboard.receitas_por_dia', True,
+     "SELECT fecha AS dia, SUM(valor) AS total FROM {schema}.outras_receitas "
+     "WHERE fecha BETWEEN %(inicio_dashboard)s AND %(hoje)s GROUP BY fecha"),
+    ('dashboard.gastos_por_dia', True,
+     "SELECT data AS dia, categoria, SUM(valor) AS total FROM {schema}.gastos "
+     "WHERE data BETWEEN %(inicio_dashboard)s AND %(hoje)s GROUP BY data, categoria"),
+    ('dashboard.gastos_metodo_por_dia', True,
+     "SELECT g.data AS dia, COALESCE(mp.nome, 'Sin Método Especificado') AS metodo_nome, SUM(g.valor) AS total_gasto "
+     "FROM {schema}.gastos g LEFT JOIN {schema}.metodos_pagamento mp ON g.metodo_pagamento_id = mp.id "
+     "WHERE g.data BETWEEN %(inicio_dashboard)s AND %(hoje)s GROUP BY g.data, mp.nome"),
+    ('dashboard.gastos_fixos_base', False,
+     "SELECT id, categoria, fecha_inicio, valor, recurrencia FROM {schema}.gastos_fixos "
+     "WHERE activo = TRUE AND fecha_inicio <= %(hoje)s"),
+    ('dashboard.ultimos_gastos', True,
+     "SELECT id, data, descripcion, valor, categoria FROM {schema}.gastos ORDER BY data DESC, id DESC LIMIT 3"),
+    ('dashboard.ultimos_gastos_fixos', False,
+     "SELECT id, fecha_inicio AS data, descripcion, valor, categoria FROM {schema}.gastos_fixos "
+     "WHERE activo = TRUE ORDER BY fecha_inicio DESC, id DESC LIMIT 2"),
+    ('dashboard.ultimas_receitas', False,
+     "SELECT id, fecha AS data, descripcion, valor, categoria FROM {schema}.outras_receitas ORDER BY fecha DESC, id DESC LIMIT 2"),
+    ('dashboard.proximos_lembretes', False,
+     "SELECT id, descripcion, data, valor FROM {schema}.lembretes WHERE data >= CURRENT_DATE ORDER BY data ASC LIMIT 5"),
+    ('dashboard.metas_ativas', False,
+     "SELECT * FROM {schema}.metas WHERE status = 'ativa' ORDER BY criado_em DESC"),
+    ('dashboard.gastos_fixos_proximos', False,
+     "SELECT id, fecha_inicio, descripcion, categoria, valor, recurrencia FROM {schema}.gastos_fixos "
+     "WHERE activo = TRUE ORDER BY fecha_inicio ASC"),
+    ('gastos.contagem_variaveis', True,
+     "SELECT COUNT(*) FROM {schema}.gastos g WHERE g.data BETWEEN %(inicio_mes)s AND %(hoje)s"),
+    ('gastos.estatisticas_variaveis', True,
+     "SELECT COALESCE(SUM(g.valor), 0) AS total, (SELECT categoria FROM {schema}.gastos g "
+     "WHERE g.data BETWEEN %(inicio_mes)s AND %(hoje)s GROUP BY g.categoria ORDER BY SUM(g.valor) DESC LIMIT 1) AS top_cat "
+     "FROM {schema}.gastos g WHERE g.data BETWEEN %(inicio_mes)s AND %(hoje)s"),
+    ('categorias.gastos_por_categoria', True,
+     "SELECT categoria, SUM(valor) AS total FROM {schema}.gastos WHERE data BETWEEN %(inicio_mes)s AND %(hoje)s GROUP BY categoria"),
+    ('categorias.uso_da_categoria', False,
+     "SELECT (SELECT COUNT(*) FROM {schema}.gastos WHERE categoria = 'Supermercado') + "
+     "(SELECT COUNT(*) FROM {schema}.gastos_fixos WHERE categoria = 'Supermercado') + "
+     "(SELECT COUNT(*) FROM {schema}.outras_receitas WHERE categoria = 'Supermercado')"),
+    ('lembretes.lista', False,
+     "SELECT id, descripcion, data, valor, repetir, tipo_repeticion FROM {schema}.lembretes ORDER BY data ASC, id ASC"),
+    ('relatorios.gastos_ano', True,
+     "SELECT data, valor FROM {schema}.gastos WHERE data BETWEEN %(inicio_ano)s AND %(hoje)s"),
+    ('relatorios.receitas_ano', False,
+     "SELECT fecha, valor FROM {schema}.outras_receitas WHERE fecha BETWEEN %(inicio_ano)s AND %(hoje)s"),
+]
+
+
+def consultas_das_paginas():
+    """
+    (nome, quente, função schema -> sql.Composed) das listagens paginadas, como gastos() e receitas() as montam:
+    cada ordenação de ORDENACOES_GASTOS/ORDENACOES_RECEITAS e, na ordenação padrão, o filtro de categoria.
+    """
+    import app  # noqa: E402 -- só para as constantes das rotas
+
+    g = sql.Identifier('g')
+    consultas = []
+    tipos_gasto = [
+        ('variaveis', 'gastos', 'data',
+         "SELECT {alias}.*, mp.nome as metodo_pagamento_nome FROM {schema}.{table} {alias} "
+         "LEFT JOIN {schema}.metodos_pagamento mp ON {alias}.metodo_pagamento_id = mp.id",
+         [sql.SQL("{alias}.data BETWEEN %(inicio_mes)s AND %(hoje)s")]),
+        ('fixos', 'gastos_fixos', 'fecha_inicio',
+         "SELECT {alias}.*, NULL as metodo_pagamento_nome FROM {schema}.{table} {alias}", []),
+    ]
+    for tipo, tabela, coluna, select, filtros in tipos_gasto:
+        for ordem_nome, ordem in app.ORDENACOES_GASTOS.items():
+            for por_categoria in (False, True):
+                if por_categoria and ordem_nome != 'fecha_desc':
+                    continue
+                condicoes = filtros + ([sql.SQL("{alias}.categoria = %(categoria)s")] if por_categoria else [])
+
+                def montar(schema, select=select, tabela=tabela, coluna=coluna, ordem=ordem, condicoes=condicoes):
+                    where = sql.SQL(" AND ").join(c.format(alias=g) for c in condicoes)
+                    return sql.SQL("{select} {where} ORDER BY {order} LIMIT %(itens_por_pagina)s OFFSET 0").format(
+                        select=sql.SQL(select).format(alias=g, schema=schema, table=sql.Identifier(tabela)),
+                        where=sql.SQL("WHERE ") + where if condicoes else sql.SQL(""),
+                        order=ordem.format(alias=g, date_col=sql.Identifier(coluna)))
+                nome = f"gastos.pagina_{tipo}" + ('' if ordem_nome == 'fecha_desc' else f".{ordem_nome}") + ('.categoria' if por_categoria else '')
+                consultas.append((nome, tipo == 'variaveis' and ordem_nome == 'fecha_desc' and not por_categoria, montar))
+
+    for ordem_nome, ordem in app.ORDENACOES_RECEITAS.items():
+        for por_categoria in (False, True):
+            if por_categoria and ordem_nome != 'fecha_desc':
+                continue
+            where = "WHERE fecha BETWEEN %(inicio_mes)s AND %(hoje)s" + (" AND categoria = %(categoria)s" if por_categoria else "")
+
+            def montar(schema, where=where, ordem=ordem):
+                return sql.SQL("SELECT id, fecha, categoria, descripcion, valor FROM {schema}.outras_receitas "
+                               "{where} {order} LIMIT %(itens_por_pagina)s OFFSET 0").format(
+                    schema=schema, where=sql.SQL(where), order=ordem)
+            nome = "receitas.pagina" + ('' if ordem_nome == 'fecha_desc' else f".{ordem_nome}") + ('.categoria' if por_categoria else '')
+            consultas.append((nome, False, montar))
+    return consultas
+
+
+# --- Captura e impressão digital ---
+def percorrer_plano(no, profundidade=0):
+    yield profundidade, no
+    for filho in no.get('Plans', []):
+        yield from percorrer_plano(filho, profundidade + 1)
+
+
+def impressao_digital(plano):
+    """Reduz o JSON do EXPLAIN ao que importa para regressões (sem custos, que variam à toa)."""
+    nos = []
+    for profundidade, no in percorrer_plano(plano):
+        nos.append({
+            'profundidade': profundidade,
+            'tipo': no['Node Type'],
+            'relacao': no.get('Relation Name'),
+            'indice': no.get('Index Name'),
+            'juncao': no.get('Join Type'),
+            'estrategia': no.get('Strategy'),
+            'linhas': no.get('Plan Rows'),
+        })
+    return {
+        'forma': ' > '.join(f"{n['tipo']}({n['relacao']})" if n['relacao'] else n['tipo'] for n in nos),
+        'relacoes_com_indice': sorted({n['relacao'] for n in nos if n['tipo'] in NOS_COM_INDICE and n['relacao']}),
+        'relacoes_seq_scan': sorted({n['relacao'] for n in nos if n['tipo'] == 'Seq Scan' and n['relacao']}),
+        'juncoes': [n['tipo'] for n in nos if n['tipo'] in NOS_DE_JUNCAO],
+        'linhas_estimadas': plano.get('Plan Rows'),
+        'nos': nos,
+    }
+
+
+def conectar(args):
+    if args.dsn:
+        return psycopg2.connect(args.dsn)
+    return psycopg2.connect(host=os.environ.get('DB_HOST', 'localhost'), port=os.environ.get('DB_PORT', '5432'),
+                            database=os.environ.get('DB_NAME', 'postgres'), user=os.environ.get('DB_USER', 'postgres'),
+                            password=os.environ.get('DB_PASSWORD', 'typebot'))
+
+
+def resolver_alvo(args):
+    """Escolhe schema e data de referência: flags explícitas ou o maior tenant do manifesto."""
+    schema, hoje = args.schema, args.hoje
+    if not schema or not hoje:
+        with open(args.manifesto, encoding='utf-8') as f:
+            manifesto = json.load(f)
+        if not schema:
+            maior = max(manifesto['tenants'], key=lambda t: sum(t['linhas'].values()))
+            schema = maior['schema']
+        hoje = hoje or date.fromisoformat(manifesto['hoje'])
+    return schema, hoje
+
+
+def capturar_planos(args, filtro=None):
+    import app  # noqa: E402
+
+    schema, hoje = resolver_alvo(args)
+    parametros = {**periodos(hoje), 'categoria': CATEGORIA_FILTRO, 'itens_por_pagina': app.ITEMS_PER_PAGE}
+    planos = {}
+    conn = conectar(args)
+    try:
+        conn.set_session(readonly=not args.analisar)
+        with conn.cursor() as cur:
+            if args.analisar:
+                for tabela in TABELAS_TENANT:
+                    cur.execute(sql.SQL("ANALYZE {schema}.{tabela}").format(schema=sql.Identifier(schema), tabela=sql.Identifier(tabela)))
+            for nome, quente, texto in CONSULTAS + consultas_das_paginas():
+                if filtro and filtro not in nome:
+                    continue
+                if callable(texto):
+                    consulta = sql.SQL("EXPLAIN (FORMAT JSON) {}").format(texto(sql.Identifier(schema)))
+                else:
+                    consulta = sql.SQL("EXPLAIN (FORMAT JSON) " + texto).format(schema=sql.Identifier(schema))
+                cur.execute(consulta, parametros)
+                plano = cur.fetchone()[0][0]['Plan']
+                planos[nome] = {'quente': quente, 'plano': plano, **impressao_digital(plano)}
+        conn.commit()
+    finally:
+        conn.close()
+    return schema, hoje, planos
+
+
+# --- Comparação ---
+def comparar_planos(nome, antes, depois, fator_linhas):
+    """Retorna (falhas, avisos) de uma consulta; falhas só contam para consultas quentes."""
+    problemas, avisos = [], []
+
+    perdidos = sorted(r for r in antes['relacoes_com_indice']
+                      if r not in depois['relacoes_com_indice'] and r in depois['relacoes_seq_scan'])
+    for relacao in perdidos:
+        problemas.append(f"perdeu o caminho por índice em {relacao} (agora Seq Scan)")
+
+    if antes['juncoes'] != depois['juncoes']:
+        problemas.append(f"estratégia de junção mudou: {antes['juncoes']} -> {depois['juncoes']}")
+
+    if not problemas and antes['forma'] != depois['forma']:
+        avisos.append(f"forma do plano mudou:\n      antes:  {antes['forma']}\n      depois: {depois['forma']}")
+
+    linhas_antes, linhas_depois = antes['linhas_estimadas'] or 1, depois['linhas_estimadas'] or 1
+    razao = max(linhas_antes, linhas_depois) / min(linhas_antes, linhas_depois)
+    if razao > fator_linhas:
+        avisos.append(f"linhas estimadas {antes['linhas_estimadas']} -> {depois['linhas_estimadas']} ({razao:.0f}x)")
+
+    if not antes['quente']:
+        return [], problemas + avisos
+    return problemas, avisos
+
+
+def capturar(args):
+    schema, hoje, planos = capturar_planos(args)
+    os.makedirs(os.path.dirname(os.path.abspath(args.saida)), exist_ok=True)
+    with open(args.saida, 'w', encoding='utf-8') as f:
+        json.dump({'schema': schema, 'hoje': hoje.isoformat(), 'planos': planos}, f, indent=2, ensure_ascii=False)
+    for nome, p in planos.items():
+        print(f"  {'*' if p['quente'] else ' '} {nome:<40} {p['forma']}")
+    print(f"\n{len(planos)} planos de {schema} gravados em {args.saida}")
+    return 0
+
+
+def verificar(args):
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    args.hoje = args.hoje or date.fromisoformat(baseline['hoje'])
+    _, _, atuais = capturar_planos(args)
+
+    total_falhas = total_avisos = 0
+    for nome in sorted(set(baseline['planos']) | set(atuais)):
+        if nome not in baseline['planos']:
+            print(f"  novo      {nome} (rode `capturar` para incluí-lo no baseline)")
+            continue
+        if nome not in atuais:
+            print(f"  ausente   {nome}")
+            continue
+        falhas, avisos = comparar_planos(nome, baseline['planos'][nome], atuais[nome], args.fator_linhas)
+        marcador = 'REGRESSÃO' if falhas else ('aviso' if avisos else 'ok')
+        print(f"  {marcador:<9} {nome}")
+        for mensagem in falhas + avisos:
+            print(f"      {mensagem}")
+        total_falhas += len(falhas)
+        total_avisos += len(avisos)
+
+    if total_falhas or (args.estrito and total_avisos):
+        print(f"\n{total_falhas} regressão(ões) e {total_avisos} aviso(s).")
+        return 1
+    print(f"\nNenhuma regressão de plano ({total_avisos} aviso(s)).")
+    return 0
+
+
+def mostrar(args):
+    _, _, planos = capturar_planos(args, filtro=args.consulta)
+    for nome, p in planos.items():
+        print(f"--- {nome} ---")
+        for n in p['nos']:
+            detalhes = ', '.join(f"{k}={n[k]}" for k in ('relacao', 'indice', 'juncao', 'estrategia', 'linhas') if n[k] is not None)
+            print(f"{'  ' * n['profundidade']}{n['tipo']} ({detalhes})")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', help='DSN do PostgreSQL (padrão: variáveis DB_*)')
+    parser.add_argument('--manifesto', default=os.path.join('perf', 'resultados', 'tenants.json'))
+    parser.add_argument('--schema', help='schema a usar (padrão: o maior tenant do manifesto)')
+    parser.add_argument('--hoje', type=date.fromisoformat, default=None, help='data de referência (padrão: a do manifesto)')
+    parser.add_argument('--sem-analyze', dest='analisar', action='store_false',
+                        help='não roda ANALYZE nas tabelas do tenant antes do EXPLAIN')
+    sub = parser.add_subparsers(dest='comando', required=True)
+
+    p_cap = sub.add_parser('capturar', help='grava as impressões digitais dos planos atuais')
+    p_cap.add_argument('--saida', default=os.path.join('perf', 'planos', 'baseline.json'))
+    p_cap.set_defaults(func=capturar)
+
+    p_ver = sub.add_parser('verificar', help='compara os planos atuais com o baseline')
+    p_ver.add_argument('--baseline', default=os.path.join('perf', 'planos', 'baseline.json'))
+    p_ver.add_argument('--fator-linhas', type=float, default=10.0, help='desvio de linhas estimadas tolerado (padrão 10x)')
+    p_ver.add_argument('--estrito', action='store_true', help='avisos também falham')
+    p_ver.set_defaults(func=verificar)
+
+    p_most = sub.add_parser('mostrar', help='imprime a árvore do plano das consultas que contêm o texto')
+    p_most.add_argument('consulta')
+    p_most.set_defaults(func=mostrar)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+Teste de carga por replay do tráfego de produção.
+
+Reconstrói o mix de requisições (rota, parâmetros e distribuição por tenant) a partir de:
+  * output.log no formato antigo ("Acessando dashboard: Schema ..., Período: ...",
+    "Dados de relatório calculados para ...", "Buscados N itens (variaveis) ...", etc.), ou
+  * o log estruturado em JSON (registros "Requisição concluída" com rota, path e schema).
+e reproduz esse mix contra uma instância local semeada com perf/gerar_tenants.py.
+
+Os tenants de produção são ordenados por volume e mapeados, na mesma ordem, para os tenants
+sintéticos do manifesto — o tenant mais ativo em produção vira o tenant sintético 0, e assim por diante.
+Intervalos de relatório são preservados em tamanho, mas deslocados para terminar hoje.
+
+Uso:
+    python perf/replay_carga.py --log output.log --manifesto perf/resultados/tenants.json \\
+        --url http://127.0.0.1:5000 --concorrencia 16 --duracao 60 --think-ms 500 [--saida resultado.json]
+
+Para cenários com banco degradado, suba o app com DB_INJECAO_FALHAS (latência, jitter, recusas de
+conexão e erros por padrão de SQL — ver app.py) e compare as latências de cauda com a execução normal.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+
+# --- Reconstrução do mix a partir dos logs ---
+PADROES_LEGADOS = [
+    (re.compile(r"Acessando dashboard: Schema (?P<schema>\S+), Período: (?P<periodo>\S+)"), 'dashboard'),
+    (re.compile(r"Dados de relatório calculados para (?P<schema>[^.\s]+)\. Período: (?P<inicio>\d{4}-\d{2}-\d{2}) a (?P<fim>\d{4}-\d{2}-\d{2})"), 'relatorios'),
+    (re.compile(r"Buscados \d+ itens \((?P<tipo>variaveis|fixos)\) para página (?P<pagina>\d+)"), 'gastos'),
+    (re.compile(r"Buscados \d+ itens \(receitas\) para página (?P<pagina>\d+)"), 'receitas'),
+    (re.compile(r"Categorias buscadas (?:e enriquecidas )?para schema (?P<schema>\S+):"), 'categorias'),
+    (re.compile(r"Metas consultadas para schema (?P<schema>\S+):"), 'metas'),
+    (re.compile(r"Métodos de pagamento buscados para schema (?P<schema>\S+):"), 'metodos_pagamento'),
+    (re.compile(r"Números compartilhados buscados para schema (?P<schema>\S+):"), 'numeros_compartilhados'),
+]
+ROTAS_IGNORADAS = {'static', 'login', 'logout', 'index', 'criar_conta', 'esqueci_senha_request'}
+
+
+def deslocar_intervalo(inicio, fim, hoje):
+    """Mantém o tamanho do intervalo, mas faz ele terminar hoje."""
+    dias = (fim - inicio).days
+    return hoje - timedelta(days=dias), hoje
+
+
+def requisicao_legada(rota, campos, hoje):
+    if rota == 'dashboard':
+        return f"/dashboard?periodo={campos['periodo']}"
+    if rota == 'relatorios':
+        inicio, fim = deslocar_intervalo(date.fromisoformat(campos['inicio']), date.fromisoformat(campos['fim']), hoje)
+        return f"/relatorios?data_inicio={inicio}&data_fim={fim}"
+    if rota == 'gastos':
+        return f"/gastos?tipo={campos['tipo']}&page={campos['pagina']}"
+    if rota == 'receitas':
+        return f"/receitas?page={campos['pagina']}"
+    return {'categorias': '/categorias', 'metas': '/metas', 'metodos_pagamento': '/metodos-pagamento',
+            'numeros_compartilhados': '/numeros-compartilhados'}[rota]
+
+
+def normalizar_path(path, hoje):
+    partes = urllib.parse.urlsplit(path)
+    query = dict(urllib.parse.parse_qsl(partes.query, keep_blank_values=True))
+    if 'data_inicio' in query and 'data_fim' in query:
+        try:
+            inicio, fim = deslocar_intervalo(date.fromisoformat(query['data_inicio']), date.fromisoformat(query['data_fim']), hoje)
+            query['data_inicio'], query['data_fim'] = inicio.isoformat(), fim.isoformat()
+        except ValueError:
+            pass
+    return urllib.parse.urlunsplit(('', '', partes.path, urllib.parse.urlencode(query), ''))
+
+
+def extrair_requisicoes(caminho_log, hoje):
+    """
+    Lê o log e devolve uma lista de (schema, rota, path) — uma entrada por requisição observada.
+    Linhas antigas sem schema (ex.: "Buscados N itens ...") herdam o último schema visto no log.
+    """
+    requisicoes = []
+    ultimo_schema = None
+    with open(caminho_log, encoding='utf-8', errors='replace') as f:
+        for linha in f:
+            linha = linha.strip()
+            if linha.startswith('{'):
+                try:
+                    registro = json.loads(linha)
+                except ValueError:
+                    continue
+                if registro.get('msg') != 'Requisição concluída' or registro.get('metodo') != 'GET':
+                    continue
+                rota = registro.get('rota')
+                if not rota or rota in ROTAS_IGNORADAS or rota.startswith('admin_') or not registro.get('schema'):
+                    continue
+                requisicoes.append((registro['schema'], rota, normalizar_path(registro.get('path', '/'), hoje)))
+                continue
+            for padrao, rota in PADROES_LEGADOS:
+                encontrado = padrao.search(linha)
+                if not encontrado:
+                    continue
+                campos = encontrado.groupdict()
+                schema = campos.get('schema') or ultimo_schema
+                if campos.get('schema'):
+                    ultimo_schema = campos['schema']
+                if schema:
+                    requisicoes.append((schema, rota, requisicao_legada(rota, campos, hoje)))
+                break
+    return requisicoes
+
+
+def mapear_tenants(requisicoes, tenants_sinteticos):
+    """Mapeia schemas de produção para tenants sintéticos por ordem de volume."""
+    volume = Counter(schema for schema, _, _ in requisicoes)
+    return {schema: tenants_sinteticos[i % len(tenants_sinteticos)] for i, (schema, _) in enumerate(volume.most_common())}
+
+
+# --- Execução ---
+class SemRedirecionamento(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class UsuarioVirtual:
+    """Mantém uma sessão (cookies) por tenant sintético."""
+    def __init__(self, url_base, timeout):
+        self.url_base = url_base.rstrip('/')
+        self.timeout = timeout
+        self.sessoes = {}
+
+    def _opener(self, tenant):
+        opener = self.sessoes.get(tenant['email'])
+        if opener is None:
+            opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), SemRedirecionamento())
+            corpo = urllib.parse.urlencode({'email': tenant['email'], 'senha': tenant['senha']}).encode()
+            try:
+                opener.open(self.url_base + '/login', data=corpo, timeout=self.timeout).read()
+            except urllib.error.HTTPError:
+                pass  # 302 é o login bem-sucedido; falhas aparecem como redirecionamentos nas requisições seguintes
+            self.sessoes[tenant['email']] = opener
+        return opener
+
+    def requisitar(self, tenant, path):
+        inicio = time.perf_counter()
+        try:
+            opener = self._opener(tenant)
+            inicio = time.perf_counter()
+            with opener.open(self.url_base + path, timeout=self.timeout) as resposta:
+                resposta.read()
+                status = resposta.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except (urllib.error.URLError, TimeoutError, ConnectionError):
+            status = 0
+        return status, time.perf_counter() - inicio
+
+
+def percentil(valores_ordenados, p):
+    if not valores_ordenados:
+        return 0.0
+    indice = max(0, min(len(valores_ordenados) - 1, int(round(p / 100 * len(valores_ordenados) + 0.5)) - 1))
+    return valores_ordenados[indice]
+
+
+def executar_carga(mix, args):
+    latencias = defaultdict(list)
+    erros = Counter()
+    lock = threading.Lock()
+    parar = threading.Event()
+    fim = time.monotonic() + args.duracao
+
+    def trabalhador(indice):
+        rng = random.Random(args.semente + indice)
+        usuario = UsuarioVirtual(args.url, args.timeout)
+        while not parar.is_set() and time.monotonic() < fim:
+            tenant, rota, path = rng.choice(mix)
+            status, duracao = usuario.requisitar(tenant, path)
+            with lock:
+                latencias[rota].append(duracao)
+                if status != 200:
+                    erros[(rota, status)] += 1
+            if args.think_ms:
+                time.sleep(rng.expovariate(1000 / args.think_ms))
+
+    threads = [threading.Thread(target=trabalhador, args=(i,), daemon=True) for i in range(args.concorrencia)]
+    inicio = time.monotonic()
+    for t in threads:
+        t.start()
+    try:
+        for t in threads:
+            t.join()
+    except KeyboardInterrupt:
+        parar.set()
+    return latencias, erros, time.monotonic() - inicio
+
+
+def relatorio(latencias, erros, duracao):
+    resultado = {'duracao_s': round(duracao, 1), 'rotas': {}}
+    todas = []
+    print(f"{'rota':<24}{'req':>7}{'req/s':>8}{'p50 ms':>9}{'p90 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'erros':>7}")
+    for rota in sorted(latencias, key=lambda r: -len(latencias[r])):
+        valores = sorted(latencias[rota])
+        todas.extend(valores)
+        erros_rota = sum(n for (r, _), n in erros.items() if r == rota)
+        linha = {
+            'requisicoes': len(valores), 'throughput_rps': round(len(valores) / duracao, 2),
+            'p50_ms': round(percentil(valores, 50) * 1000, 1), 'p90_ms': round(percentil(valores, 90) * 1000, 1),
+            'p95_ms': round(percentil(valores, 95) * 1000, 1), 'p99_ms': round(percentil(valores, 99) * 1000, 1),
+            'max_ms': round(valores[-1] * 1000, 1), 'erros': erros_rota,
+        }
+        resultado['rotas'][rota] = linha
+        print(f"{rota:<24}{linha['requisicoes']:>7}{linha['throughput_rps']:>8}{linha['p50_ms']:>9}{linha['p90_ms']:>9}"
+              f"{linha['p95_ms']:>9}{linha['p99_ms']:>9}{linha['max_ms']:>9}{erros_rota:>7}")
+    todas.sort()
+    resultado['total'] = {'requisicoes': len(todas), 'throughput_rps': round(len(todas) / duracao, 2) if duracao else 0,
+                          'p50_ms': round(percentil(todas, 50) * 1000, 1), 'p99_ms': round(percentil(todas, 99) * 1000, 1),
+                          'erros': sum(erros.values())}
+    resultado['erros_por_status'] = {f"{rota}:{status}": n for (rota, status), n in erros.items()}
+    print(f"\nTotal: {resultado['total']['requisicoes']} req em {duracao:.1f}s ({resultado['total']['throughput_rps']} req/s), "
+          f"p50 {resultado['total']['p50_ms']} ms, p99 {resultado['total']['p99_ms']} ms, erros {resultado['total']['erros']}")
+    return resultado
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--log', default='output.log', help='log de produção (formato antigo ou JSON)')
+    parser.add_argument('--manifesto', default=os.path.join('perf', 'resultados', 'tenants.json'),
+                        help='manifesto gerado por perf/gerar_tenants.py')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--concorrencia', type=int, default=8, help='usuários virtuais simultâneos')
+    parser.add_argument('--duracao', type=float, default=60, help='duração em segundos')
+    parser.add_argument('--think-ms', type=float, default=500, help='tempo médio de pensamento entre requisições (exponencial)')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--mostrar-mix', action='store_true', help='só mostra o mix reconstruído e sai')
+    parser.add_argument('--saida', help='grava o resultado em JSON')
+    args = parser.parse_args(argv)
+
+    hoje = date.today()
+    requisicoes = extrair_requisicoes(args.log, hoje)
+    if not requisicoes:
+        print(f"Nenhuma requisição reconhecida em {args.log}.")
+        return 1
+
+    volume_rotas = Counter(rota for _, rota, _ in requisicoes)
+    volume_tenants = Counter(schema for schema, _, _ in requisicoes)
+    print(f"{len(requisicoes)} requisições, {len(volume_tenants)} tenants de produção.")
+    for rota, n in volume_rotas.most_common():
+        print(f"  {rota:<24}{n:>7} ({n / len(requisicoes):.1%})")
+    if args.mostrar_mix:
+        return 0
+
+    with open(args.manifesto, encoding='utf-8') as f:
+        tenants_sinteticos = json.load(f)['tenants']
+    mapa = mapear_tenants(requisicoes, tenants_sinteticos)
+    mix = [(mapa[schema], rota, path) for schema, rota, path in requisicoes]
+
+    print(f"Replay em {args.url}: {args.concorrencia} usuários virtuais, {args.duracao:.0f}s, think time {args.think_ms:.0f} ms "
+          f"(início {datetime.now().isoformat(timespec='seconds')})\n")
+    latencias, erros, duracao = executar_carga(mix, args)
+    resultado = relatorio(latencias, erros, duracao)
+    if args.saida:
+        resultado['parametros'] = {k: v for k, v in vars(args).items()}
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
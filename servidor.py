@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Servidor de produção com waitress, para onde não há gunicorn (ex.: Windows):
+
+    python servidor.py
+
+Aquece o app (criar_app) antes de abrir a porta. No SIGTERM/SIGINT para de aceitar conexões,
+espera as requisições em andamento por até WEB_GRACEFUL_TIMEOUT segundos (padrão 30) e só então sai.
+PORT (3333), WEB_THREADS (8).
+"""
+import _thread
+import logging
+import os
+import signal
+import threading
+
+from waitress import create_server
+
+import app as app_modulo
+
+
+def main():
+    espera = float(os.environ.get('WEB_GRACEFUL_TIMEOUT', '30'))
+    servidor = create_server(
+        app_modulo.criar_app(),
+        host='0.0.0.0',
+        port=int(os.environ.get('PORT', 3333)),
+        threads=int(os.environ.get('WEB_THREADS', '8')),
+    )
+
+    drenado = threading.Event()
+
+    def drenar():
+        restantes = app_modulo.aguardar_requisicoes_ativas(espera)
+        if restantes:
+            logging.warning("Desligando com %d requisição(ões) ainda em andamento após %.0fs", restantes, espera)
+        drenado.set()
+        _thread.interrupt_main()  # volta para desligar() na thread principal
+
+    def desligar(signum, frame):
+        if drenado.is_set():
+            raise KeyboardInterrupt  # o loop do waitress encerra o dispatcher de tarefas
+        if not servidor.accepting:
+            return
+        logging.info("Sinal %d: parando de aceitar conexões e aguardando requisições em andamento", signum)
+        servidor.accepting = False
+        servidor.close()
+        threading.Thread(target=drenar, name='drenagem', daemon=True).start()
+
+    signal.signal(signal.SIGTERM, desligar)
+    signal.signal(signal.SIGINT, desligar)
+    logging.info("Servindo em %s:%s", servidor.effective_host, servidor.effective_port)
+    servidor.run()
+
+
+if __name__ == '__main__':
+    main()
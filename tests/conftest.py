@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+"""
+Testes das peças de concorrência do app (disjuntor, single-flight, controle de admissão), sem banco:
+as conexões são simuladas. Rode da raiz do repositório com: python -m pytest tests
+"""
+import os
+import sys
+
+os.environ.setdefault('LOG_NIVEL', 'CRITICAL')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""ControleAdmissao: rodízio justo entre tenants na fila e 429 (teto do tenant) vs 503 (worker cheio)."""
+import threading
+import time
+
+import app
+
+
+def esperar(condicao, limite=2.0):
+    fim = time.monotonic() + limite
+    while not condicao():
+        assert time.monotonic() < fim, "condição não atingida a tempo"
+        time.sleep(0.005)
+
+
+def enfileirar(controle, tenant, nome, admitidos):
+    """Thread que espera vaga para `tenant`; a ordem de entrada fica em `admitidos`."""
+    na_fila = controle.estado()['na_fila']
+
+    def entrar():
+        status, esperou = controle.entrar(tenant, espera=5)
+        admitidos.append((nome, status, esperou))
+
+    thread = threading.Thread(target=entrar)
+    thread.start()
+    esperar(lambda: controle.estado()['na_fila'] == na_fila + 1)
+    return thread
+
+
+def test_rodizio_entre_tenants():
+    controle = app.ControleAdmissao(max_global=1, max_por_tenant=2, fila_max=10)
+    assert controle.entrar('ocupante', espera=0) == (None, False)
+
+    admitidos = []
+    threads = [enfileirar(controle, 'a', 'a1', admitidos),
+               enfileirar(controle, 'a', 'a2', admitidos),
+               enfileirar(controle, 'b', 'b1', admitidos)]
+
+    anterior = 'ocupante'
+    for quantidade in range(1, 4):
+        controle.sair(anterior)
+        esperar(lambda: len(admitidos) == quantidade)
+        anterior = admitidos[-1][0][0]
+    for thread in threads:
+        thread.join()
+    controle.sair(anterior)
+
+    # 'a' tinha duas na fila, mas depois de atendida vai para o fim: 'b' não espera as duas
+    assert [nome for nome, _, _ in admitidos] == ['a1', 'b1', 'a2']
+    assert all(status is None and esperou for _, status, esperou in admitidos)
+    assert controle.estado() == {'em_andamento': 0, 'na_fila': 0, 'na_fila_pico': 3,
+                                 'tenants_em_andamento': 0, 'tenants_na_fila': 0}
+
+
+def test_teto_do_tenant_e_429_worker_cheio_e_503():
+    controle = app.ControleAdmissao(max_global=1, max_por_tenant=1, fila_max=10)
+    assert controle.entrar('a', espera=0) == (None, False)
+
+    assert controle.entrar('a', espera=0.01) == (429, True)  # esperou, mas o próprio tenant segue no teto
+    assert controle.entrar('b', espera=0.01) == (503, True)  # o worker é que está cheio
+    assert controle.estado()['na_fila'] == 0
+
+
+def test_filas_cheias_recusam_sem_esperar():
+    controle = app.ControleAdmissao(max_global=1, max_por_tenant=1, fila_max=1)
+    assert controle.entrar('a', espera=0) == (None, False)
+    admitidos = []
+    thread = enfileirar(controle, 'a', 'a2', admitidos)
+
+    assert controle.entrar('a', espera=5) == (429, False)  # fila do tenant cheia
+    assert controle.entrar('b', espera=5) == (503, False)  # fila do worker cheia
+
+    controle.sair('a')
+    thread.join()
+    assert admitidos == [('a2', None, True)]
+    controle.sair('a')
+    assert controle.estado()['em_andamento'] == 0
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""DisjuntorBanco: fechado -> aberto -> meio_aberto -> fechado, e a sonda devolvida quando nenhuma conexão é obtida."""
+import asyncio
+import time
+
+import psycopg2
+import pytest
+from flask import g
+
+import app
+
+
+@pytest.fixture
+def disjuntor(monkeypatch):
+    """Disjuntor próprio do teste (2 falhas abrem, 50ms aberto) no lugar do global."""
+    disjuntor = app.DisjuntorBanco(limite_falhas=2, segundos_aberto=0.05)
+    monkeypatch.setattr(app, 'disjuntor_banco', disjuntor)
+    return disjuntor
+
+
+def abrir(disjuntor):
+    disjuntor.registrar_falha()
+    disjuntor.registrar_falha()
+    assert disjuntor.estado == 'aberto'
+    time.sleep(disjuntor.segundos_aberto + 0.01)
+
+
+def test_ciclo_completo(disjuntor):
+    assert disjuntor.permitir() == 'normal'
+    disjuntor.registrar_falha()
+    assert disjuntor.estado == 'fechado'
+    disjuntor.registrar_falha()
+    assert disjuntor.estado == 'aberto'
+    assert disjuntor.permitir() is None
+
+    time.sleep(disjuntor.segundos_aberto + 0.01)
+    assert disjuntor.permitir() == 'sonda'
+    assert disjuntor.estado == 'meio_aberto'
+    assert disjuntor.permitir() is None  # uma sonda por vez
+
+    disjuntor.registrar_sucesso()
+    assert disjuntor.estado == 'fechado'
+    assert disjuntor.falhas_seguidas == 0
+    assert disjuntor.permitir() == 'normal'
+
+
+def test_sonda_que_falha_reabre(disjuntor):
+    abrir(disjuntor)
+    assert disjuntor.permitir() == 'sonda'
+    disjuntor.registrar_falha()
+    assert disjuntor.estado == 'aberto'
+    assert disjuntor.permitir() is None
+
+
+def test_zerar_falhas_so_no_estado_fechado(disjuntor):
+    disjuntor.registrar_falha()
+    disjuntor.zerar_falhas()
+    disjuntor.registrar_falha()
+    assert disjuntor.estado == 'fechado'  # as falhas não eram seguidas
+
+    abrir(disjuntor)
+    falhas = disjuntor.falhas_seguidas
+    disjuntor.zerar_falhas()  # aberto: só a sonda fecha o disjuntor
+    assert disjuntor.falhas_seguidas == falhas
+    assert disjuntor.permitir() == 'sonda'
+
+
+def test_sonda_devolvida_sem_vaga_de_conexao(disjuntor, monkeypatch):
+    abrir(disjuntor)
+    monkeypatch.setattr(app, 'reservar_vaga', lambda espera: False)
+    assert app.get_db_connection() is None
+    assert disjuntor.estado == 'meio_aberto'
+    assert disjuntor.permitir() == 'sonda'
+
+
+def test_sonda_que_nao_conecta_reabre(disjuntor, monkeypatch):
+    abrir(disjuntor)
+
+    def recusar(**parametros):
+        raise psycopg2.OperationalError("conexão recusada")
+    monkeypatch.setattr(app.psycopg2, 'connect', recusar)
+    assert app.get_db_connection() is None
+    assert disjuntor.estado == 'aberto'
+
+
+def test_sonda_devolvida_quando_o_connect_e_interrompido(disjuntor, monkeypatch):
+    abrir(disjuntor)
+
+    class Interrompido(BaseException):
+        pass
+
+    def interromper(**parametros):
+        raise Interrompido()
+    monkeypatch.setattr(app.psycopg2, 'connect', interromper)
+    with pytest.raises(Interrompido):
+        app.get_db_connection()
+    assert disjuntor.permitir() == 'sonda'
+
+
+class PoolEsgotado:
+    async def acquire(self, timeout=None):
+        raise asyncio.TimeoutError()
+
+
+@pytest.mark.parametrize('prazo_segundos', [5, -1], ids=['pool_esgotado', 'prazo_vencido'])
+def test_sonda_devolvida_no_caminho_asgi(disjuntor, monkeypatch, prazo_segundos):
+    pytest.importorskip('asyncpg')
+    pytest.importorskip('asgiref')
+    import asgi
+    monkeypatch.setattr(asgi, 'disjuntor_banco', disjuntor)
+    monkeypatch.setattr(asgi, '_pool', PoolEsgotado())
+    abrir(disjuntor)
+
+    async def executar():
+        with app.app.test_request_context('/dashboard'):
+            g.prazo = time.monotonic() + prazo_segundos
+            with pytest.raises(app.PrazoExcedido):
+                await asgi.executar_grupos_async({'um': app.GrupoConsulta("SELECT 1")})
+    asyncio.run(executar())
+    assert disjuntor.permitir() == 'sonda'
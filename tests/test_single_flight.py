@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""coalescer() e coalescer_async(): uma execução por chave, cópias independentes e o erro do líder em cada seguidor."""
+import asyncio
+import threading
+import time
+
+import psycopg2
+import pytest
+from flask import g
+
+import app
+
+SEGUIDORES = 3
+
+
+def esperar(condicao, limite=2.0):
+    fim = time.monotonic() + limite
+    while not condicao():
+        assert time.monotonic() < fim, "condição não atingida a tempo"
+        time.sleep(0.005)
+
+
+def conteineres(valor, vistos=None):
+    """ids de todos os dicts/listas de um resultado."""
+    vistos = set() if vistos is None else vistos
+    if isinstance(valor, (dict, list)):
+        vistos.add(id(valor))
+        for item in (valor.values() if isinstance(valor, dict) else valor):
+            conteineres(item, vistos)
+    return vistos
+
+
+def coalescer_em_threads(chave, calcular, liberar):
+    """Líder e SEGUIDORES threads na mesma chave, cada uma no seu contexto de requisição: {nome: (retorno ou exceção, g)}."""
+    retornos = {}
+
+    def requisicao(nome):
+        with app.app.test_request_context('/dashboard'):
+            g.prazo = time.monotonic() + 5
+            try:
+                retornos[nome] = (app.coalescer(chave, calcular), vars(g).copy())
+            except Exception as e:
+                retornos[nome] = (e, vars(g).copy())
+
+    threads = [threading.Thread(target=requisicao, args=('lider',))]
+    threads[0].start()
+    esperar(lambda: chave in app._voos)
+    for i in range(SEGUIDORES):
+        threads.append(threading.Thread(target=requisicao, args=(f"seguidor{i}",)))
+        threads[-1].start()
+    esperar(lambda: app._voos[chave].seguidores == SEGUIDORES)
+    liberar.set()
+    for thread in threads:
+        thread.join()
+    return retornos
+
+
+def test_uma_execucao_e_copias_independentes():
+    liberar, chamadas = threading.Event(), []
+
+    def calcular():
+        chamadas.append(1)
+        liberar.wait(5)
+        return {'linhas': [{'valor': 1}, {'valor': 2}]}
+
+    retornos = coalescer_em_threads('teste/copias', calcular, liberar)
+    assert len(chamadas) == 1
+    resultados = [resultado for resultado, _ in retornos.values()]
+    assert all(resultado == {'linhas': [{'valor': 1}, {'valor': 2}]} for resultado in resultados)
+    for i, a in enumerate(resultados):
+        for b in resultados[i + 1:]:
+            assert not conteineres(a) & conteineres(b)
+    assert 'teste/copias' not in app._voos
+
+
+def test_resultados_do_lote_mantem_os_grupos_que_falharam():
+    liberar = threading.Event()
+
+    def calcular():
+        liberar.wait(5)
+        resultados = app.ResultadosLote()
+        resultados['metas'] = None
+        resultados.opcionais_falhos.append('metas')
+        return resultados
+
+    for resultado, _ in coalescer_em_threads('teste/opcionais', calcular, liberar).values():
+        assert isinstance(resultado, app.ResultadosLote)
+        assert resultado.opcionais_falhos == ['metas']
+
+
+def test_erro_de_banco_do_lider_em_cada_seguidor():
+    liberar = threading.Event()
+
+    def calcular():
+        liberar.wait(5)
+        raise psycopg2.OperationalError("conexão perdida")
+
+    retornos = coalescer_em_threads('teste/erro_banco', calcular, liberar)
+    erro_lider = retornos.pop('lider')[0]
+    assert isinstance(erro_lider, psycopg2.OperationalError)
+    erros = [erro for erro, _ in retornos.values()]
+    for erro, contexto in retornos.values():
+        assert type(erro) is psycopg2.OperationalError
+        assert erro is not erro_lider and erro.__cause__ is erro_lider
+        assert contexto.get('banco_indisponivel')
+    assert len({id(erro) for erro in erros}) == SEGUIDORES
+
+
+def test_prazo_do_lider_vira_prazo_no_seguidor():
+    liberar = threading.Event()
+
+    def calcular():
+        liberar.wait(5)
+        raise app.PrazoExcedido("statement timeout")
+
+    retornos = coalescer_em_threads('teste/prazo', calcular, liberar)
+    del retornos['lider']
+    for erro, contexto in retornos.values():
+        assert isinstance(erro, app.PrazoExcedido)
+        assert contexto.get('prazo_excedido')
+
+
+def test_erro_fora_do_psycopg2_chega_embrulhado():
+    liberar = threading.Event()
+
+    def calcular():
+        liberar.wait(5)
+        raise ValueError("bug no transformar")
+
+    retornos = coalescer_em_threads('teste/erro_python', calcular, liberar)
+    erro_lider = retornos.pop('lider')[0]
+    assert isinstance(erro_lider, ValueError)
+    for erro, _ in retornos.values():
+        assert isinstance(erro, RuntimeError) and erro.__cause__ is erro_lider
+
+
+# --- Caminho ASGI ---
+@pytest.fixture
+def asgi():
+    pytest.importorskip('asyncpg')
+    pytest.importorskip('asgiref')
+    import asgi
+    return asgi
+
+
+async def requisicao_async(asgi, chave, calcular):
+    with app.app.test_request_context('/dashboard'):
+        g.prazo = time.monotonic() + 5
+        return await asgi.coalescer_async(chave, calcular)
+
+
+def test_async_uma_execucao_e_copias_independentes(asgi):
+    chamadas = []
+
+    async def calcular():
+        chamadas.append(1)
+        await asyncio.sleep(0.05)
+        return {'linhas': [{'valor': 1}]}
+
+    async def rodar():
+        return await asyncio.gather(*(requisicao_async(asgi, 'teste/async', calcular) for _ in range(SEGUIDORES + 1)))
+
+    resultados = asyncio.run(rodar())
+    assert len(chamadas) == 1
+    assert all(resultado == {'linhas': [{'valor': 1}]} for resultado in resultados)
+    for i, a in enumerate(resultados):
+        for b in resultados[i + 1:]:
+            assert not conteineres(a) & conteineres(b)
+
+
+def test_async_lider_cancelado_um_seguidor_assume(asgi):
+    chamadas = []
+
+    async def calcular():
+        chamadas.append(1)
+        await asyncio.sleep(10 if len(chamadas) == 1 else 0.01)
+        return {'linhas': []}
+
+    async def rodar():
+        lider = asyncio.create_task(requisicao_async(asgi, 'teste/cancelado', calcular))
+        await asyncio.sleep(0.01)
+        seguidores = [asyncio.create_task(requisicao_async(asgi, 'teste/cancelado', calcular)) for _ in range(SEGUIDORES)]
+        await asyncio.sleep(0.01)
+        lider.cancel()
+        return await asyncio.gather(*seguidores, return_exceptions=True)
+
+    assert asyncio.run(rodar()) == [{'linhas': []}] * SEGUIDORES
+    assert len(chamadas) == 2
+
+
+def test_async_erro_do_lider_em_cada_seguidor(asgi):
+    async def calcular():
+        await asyncio.sleep(0.05)
+        raise ValueError("bug no transformar")
+
+    async def rodar():
+        return await asyncio.gather(*(requisicao_async(asgi, 'teste/async_erro', calcular) for _ in range(SEGUIDORES + 1)),
+                                    return_exceptions=True)
+
+    erro_lider, *erros = asyncio.run(rodar())
+    assert isinstance(erro_lider, ValueError)
+    assert all(isinstance(erro, RuntimeError) and erro.__cause__ is erro_lider for erro in erros)
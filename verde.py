@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Modo green threads (gevent): os handlers continuam síncronos, mas um worker atende centenas de
+requisições concorrentes enquanto elas esperam o PostgreSQL.
+
+Uso:
+    gunicorn -k gevent --worker-connections 500 -w 4 verde:app
+    python verde.py                  (servidor WSGI do próprio gevent, porta PORT ou 3333)
+
+Este módulo precisa carregar antes do app: aplica o monkey patch do gevent, registra o wait callback
+do psycopg2 (cada ida ao banco cede a vez aos outros greenlets em vez de bloquear o processo) e só
+então importa app.py, cujos locks, semáforos e threads de fundo passam a ser os do gevent.
+verificar_patch() aborta o startup se algo ficou inconsistente (app importado antes do patch,
+módulos sem patch, wait callback ausente).
+
+DB_CONEXOES_MAX, se não definido, vira 2x DB_POOL_MAX: sem teto, cada greenlet abriria a sua conexão.
+O /admin/profiler amostra threads do SO e por isso só enxerga o hub neste modo.
+"""
+import sys
+
+APP_IMPORTADO_ANTES = 'app' in sys.modules
+
+from gevent import monkey  # noqa: E402
+
+monkey.patch_all()
+
+import logging  # noqa: E402
+import os  # noqa: E402
+import threading  # noqa: E402
+
+import psycopg2  # noqa: E402
+from gevent.socket import wait_read, wait_write  # noqa: E402
+from psycopg2 import extensions  # noqa: E402
+
+MODULOS_COM_PATCH = ('socket', 'ssl', 'select', 'thread', 'threading', 'time', 'queue')
+
+
+def esperar_psycopg2(conn, timeout=None):
+    """Wait callback do psycopg2: em vez de bloquear no socket, espera no hub do gevent."""
+    while True:
+        estado = conn.poll()
+        if estado == extensions.POLL_OK:
+            break
+        elif estado == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif estado == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f"Estado de poll inesperado do psycopg2: {estado!r}")
+
+
+extensions.set_wait_callback(esperar_psycopg2)
+os.environ.setdefault('DB_CONEXOES_MAX', str(2 * int(os.environ.get('DB_POOL_MAX', '10'))))
+
+import app as app_modulo  # noqa: E402
+
+app = app_modulo.criar_app()  # sem pré-carga: cada worker aquece lendo o bytecode do JINJA_CACHE_DIR
+
+
+def verificar_patch():
+    """Lista de problemas que tornam o modo gevent inseguro (vazia = ok)."""
+    problemas = []
+    if APP_IMPORTADO_ANTES:
+        problemas.append("app.py foi importado antes do monkey patch (importe verde primeiro)")
+    problemas.extend(f"módulo '{modulo}' sem patch do gevent" for modulo in MODULOS_COM_PATCH
+                     if not monkey.is_module_patched(modulo))
+    if extensions.get_wait_callback() is not esperar_psycopg2:
+        problemas.append("wait callback do psycopg2 não registrado (as consultas bloqueariam o worker)")
+    # Locks criados antes do patch seriam locks do SO: um greenlet esperando travaria o worker inteiro
+    tipo_lock = type(threading.Lock())
+    for nome in ('_pool_lock', '_metricas_lock', '_executor_fanout_lock'):
+        if type(getattr(app_modulo, nome)) is not tipo_lock:
+            problemas.append(f"app.{nome} não é um lock do gevent")
+    if app_modulo.DB_CONEXOES_MAX <= 0:
+        problemas.append("DB_CONEXOES_MAX=0: sem teto de conexões por worker")
+    return problemas
+
+
+problemas = verificar_patch()
+if problemas:
+    for problema in problemas:
+        logging.critical("Modo gevent inconsistente: %s", problema)
+    raise SystemExit("verde.py: patch do gevent inconsistente; ver log")
+logging.info("Modo gevent ativo: psycopg2 cooperativo, DB_CONEXOES_MAX=%d", app_modulo.DB_CONEXOES_MAX)
+
+
+if __name__ == '__main__':
+    from gevent.pywsgi import WSGIServer
+
+    port = int(os.environ.get('PORT', 3333))
+    WSGIServer(('0.0.0.0', port), app, log=None).serve_forever()